@@ -1,18 +1,23 @@
 import streamlit as st
-import pandas as pd
 import time
-import sys
 import os
-from io import StringIO
+import shutil
+import tempfile
 from email_system import EmailSystem
+from send_journal import SendJournal
+from dataset_cache import read_dataset
+from schema import profile
+from preview import PreviewCache
+from suppression import SuppressionList
+from sender_accounts import STRATEGIES, QuotaStore
+from send_worker import get_worker
+from event_log import format_event
 
-# Global flag for cancellation
-if 'cancelled' not in st.session_state:
-    st.session_state.cancelled = False
-    
-# Function to handle cancellation
-def cancel_sending():
-    st.session_state.cancelled = True
+# Number of log lines shown per campaign
+LOG_TAIL_LINES = 30
+
+# Recipients shown per page of the email preview
+PREVIEW_PAGE_SIZE = 5
 
 # Set page config
 st.set_page_config(
@@ -53,6 +58,8 @@ if 'smtp_connected' not in st.session_state:
     st.session_state.smtp_connected = False
 if 'progress' not in st.session_state:
     st.session_state.progress = 0
+if 'job_ids' not in st.session_state:
+    st.session_state.job_ids = []
 
 # Sidebar for SMTP configuration
 with st.sidebar:
@@ -61,6 +68,36 @@ with st.sidebar:
     smtp_port = st.number_input("SMTP Port", value=587, min_value=1, max_value=65535, key="smtp_port")
     smtp_username = st.text_input("Your Email", key="smtp_username")
     smtp_password = st.text_input("Password/App Password", type="password", key="smtp_password")
+    daily_quota = st.number_input("Daily sending quota for this account (0 = no limit)",
+                                  min_value=0, value=0, key="daily_quota",
+                                  help="Sends are counted across runs, so the campaign stops before the provider's cap")
+    
+    # More mailboxes on the same server raise the daily volume beyond one account's cap
+    with st.expander("Additional sender accounts"):
+        extra_account_count = st.number_input("Number of additional accounts", min_value=0, max_value=10, value=0,
+                                              key="extra_account_count")
+        extra_accounts = []
+        for i in range(int(extra_account_count)):
+            extra_username = st.text_input(f"Account {i + 2} email", key=f"extra_username_{i}")
+            extra_password = st.text_input(f"Account {i + 2} password", type="password", key=f"extra_password_{i}")
+            extra_quota = st.number_input(f"Account {i + 2} daily quota (0 = no limit)", min_value=0, value=0,
+                                          key=f"extra_quota_{i}")
+            if extra_username and extra_password:
+                extra_accounts.append({
+                    'smtp_username': extra_username,
+                    'smtp_password': extra_password,
+                    'daily_quota': extra_quota or None
+                })
+        balance_strategy = st.selectbox(
+            "Spread recipients across accounts",
+            options=list(STRATEGIES),
+            format_func={
+                'least_used': "Evenly by quota used",
+                'round_robin': "Take turns",
+                'fill_first': "Fill each account in order"
+            }.get,
+            key="balance_strategy"
+        )
     
     st.session_state.smtp_config = {
         'smtp_server': smtp_server,
@@ -78,11 +115,9 @@ with tab1:
     
     if uploaded_file is not None:
         try:
-            # Read the uploaded file
-            if uploaded_file.name.endswith(('.xlsx', '.xls')):
-                df = pd.read_excel(uploaded_file)
-            else:
-                df = pd.read_csv(uploaded_file)
+            # Read the uploaded file; it is parsed once per upload and reused
+            # from the shared cache on every rerun
+            df = read_dataset(uploaded_file)
                 
             # Store in session state
             st.session_state.df = df
@@ -91,11 +126,18 @@ with tab1:
             # Show success message
             st.success(f"Successfully uploaded {uploaded_file.name} with {len(df)} rows")
             
+            # Preselect the columns inferred from a sample of the rows;
+            # the guess is cached for this dataset across reruns
+            roles = profile(df)
+            columns = list(df.columns)
+            email_index = columns.index(roles.email_col) if roles.email_col in columns else 0
+            company_index = columns.index(roles.company_col) if roles.company_col in columns else 0
+            
             # Show column selector
             email_col = st.selectbox(
                 "Select the column containing email addresses",
                 df.columns,
-                index=0,
+                index=email_index,
                 help="Select the column that contains the recipient email addresses",
                 key="email_column_selector"
             )
@@ -103,7 +145,7 @@ with tab1:
             company_col = st.selectbox(
                 "Select the column containing company names",
                 df.columns,
-                index=1 if len(df.columns) > 1 else 0,
+                index=company_index,
                 help="Select the column that contains the company names",
                 key="company_column_selector"
             )
@@ -164,6 +206,10 @@ Best regards,
                                      placeholder="https://drive.google.com/your-resume-link",
                                      help="Make sure the link is set to 'Anyone with the link can view'",
                                      key="resume_link")
+            attachment_files = st.file_uploader("Attach files to every email (optional)",
+                                                accept_multiple_files=True,
+                                                help="Each file is encoded once and shared by the whole campaign",
+                                                key="attachment_uploader")
             
             # Sending Settings Section
             with st.expander("⚙️ Advanced Sending Settings"):
@@ -182,6 +228,46 @@ Best regards,
                                                      max_value=300, 
                                                      value=15,
                                                      key="batch_delay_input")
+                max_per_hour = st.number_input("Max emails per hour per account (0 = no limit)",
+                                            min_value=0,
+                                            max_value=100000,
+                                            value=0,
+                                            help="Sending stops once the cap is reached; the daily cap is the "
+                                                 "account's quota in the sidebar. Sending also slows down "
+                                                 "automatically if the mail server asks it to",
+                                            key="max_per_hour_input")
+                pool_size = st.number_input("Parallel SMTP connections",
+                                         min_value=1,
+                                         max_value=10,
+                                         value=1,
+                                         help="Only raise this if your mail provider allows several concurrent sessions",
+                                         key="pool_size_input")
+                domain_per_minute = st.number_input("Max emails per minute to one receiving domain (0 = no limit)",
+                                                    min_value=0,
+                                                    value=0,
+                                                    help="Recipients at different companies are sent to in turn; a cap also "
+                                                         "keeps a single domain from greylisting you",
+                                                    key="domain_per_minute_input")
+                domain_in_flight = st.number_input("Parallel sends to one receiving domain (0 = no limit)",
+                                                   min_value=0,
+                                                   value=0,
+                                                   key="domain_in_flight_input")
+                recycle_after = st.number_input("Reconnect after this many emails per connection (0 = never)",
+                                                min_value=0,
+                                                value=0,
+                                                help="Some providers drop long-lived sessions; fresh connections avoid failed sends",
+                                                key="recycle_after_input")
+                resume_campaign = st.checkbox("Skip recipients already emailed with this template",
+                                              value=True,
+                                              help="Sent emails are recorded, so an interrupted campaign can be restarted without duplicates",
+                                              key="resume_campaign_input")
+                use_suppression = st.checkbox("Never email opted-out or previously contacted addresses",
+                                              value=True,
+                                              help="Everyone emailed is added to a suppression list that all later campaigns respect",
+                                              key="use_suppression_input")
+                opt_out_file = st.file_uploader("Import opt-out / bounce list (CSV or TXT)",
+                                                type=['csv', 'txt'],
+                                                key="opt_out_uploader")
             
             # Column Selection
             st.markdown("---")
@@ -191,17 +277,48 @@ Best regards,
             email_col = st.selectbox(
                 "Select Email Column",
                 options=df.columns,
-                index=next((i for i, col in enumerate(df.columns) if 'email' in col.lower()), 0),
+                index=email_index,
                 key="email_column_selector_main"
             )
             
             company_col = st.selectbox(
                 "Select Company Name Column",
                 options=df.columns,
-                index=next((i for i, col in enumerate(df.columns) if 'company' in col.lower() or 'org' in col.lower() or 'name' in col.lower()), 0),
+                index=company_index,
                 key="company_column_selector_main"
             )
             
+            # Sender details filled into every email
+            sender_details = {
+                'Your Name': your_name,
+                'Position': your_position,
+                'Your Email': your_email,
+                'Your Phone': your_phone,
+                'Your custom message here': custom_message,
+                'Your Contact Information': f"Email: {your_email}\nPhone: {your_phone}",
+                'Resume Link': resume_link
+            }
+            
+            # Live preview of the visible page only; rendered rows are
+            # memoized per template version, so edits re-render just this page
+            st.markdown("---")
+            st.subheader("Preview")
+            preview_cache = st.session_state.setdefault('preview_cache', PreviewCache())
+            preview_pages = max(1, -(-len(df) // PREVIEW_PAGE_SIZE))
+            preview_page = st.number_input(f"Page (of {preview_pages})", min_value=1, max_value=preview_pages, value=1,
+                                           key="preview_page")
+            preview_rows = preview_cache.page(
+                df, email_template, email_col, company_col,
+                additional_cols=additional_cols,
+                user_details=sender_details,
+                resume_link=resume_link,
+                start=(preview_page - 1) * PREVIEW_PAGE_SIZE,
+                count=PREVIEW_PAGE_SIZE
+            )
+            for preview_row in preview_rows:
+                with st.expander(f"Row {preview_row.row + 1}: {preview_row.recipient} | {preview_row.subject}"):
+                    st.text(preview_row.body)
+            
             # Ready to Send Section
             st.markdown("---")
             st.subheader("Ready to Send")
@@ -236,20 +353,6 @@ Best regards,
                     email_system.data = df
                     email_system.template = email_template
                     
-                    # Set user details
-                    user_details = {
-                        'Your Name': your_name,
-                        'Position': your_position,
-                        'Your Email': your_email,
-                        'Your Phone': your_phone,
-                        'Your custom message here': custom_message,
-                        'Your Contact Information': f"Email: {your_email}\nPhone: {your_phone}"
-                    }
-                    
-                    # Set up progress bar
-                    progress_bar = st.progress(0)
-                    status_text = st.empty()
-                    
                     # Prepare email system
                     email_system = EmailSystem(uploaded_file)
                     email_system.load_data()
@@ -257,20 +360,9 @@ Best regards,
                     # Set resume link
                     email_system.resume_link = resume_link
                     
-                    # Set user details in the template
-                    template = email_template
-                    template = template.replace("[Your Name]", your_name)
-                    template = template.replace("[Your Email]", your_email)
-                    template = template.replace("[Your Phone]", your_phone)
-                    template = template.replace("[Position]", your_position)
-                    template = template.replace("[Your custom message here]", custom_message)
-                    template = template.replace(
-                        "[Your Contact Information]", 
-                        f"Email: {your_email}\nPhone: {your_phone}"
-                    )
-                    template = template.replace("[Resume Link]", resume_link)
-                    
-                    email_system.template = template
+                    # Sender details are filled in per row by the template
+                    # engine, the same way the preview renders them
+                    email_system.template = email_template
                     
                     # Set up SMTP config with user details
                     smtp_config = {
@@ -278,169 +370,112 @@ Best regards,
                         'smtp_port': smtp_port,
                         'smtp_username': smtp_username,
                         'smtp_password': smtp_password,
-                        'user_details': {
-                            'Your Name': your_name,
-                            'Position': your_position,
-                            'Your Email': your_email,
-                            'Your Phone': your_phone,
-                            'Your custom message here': custom_message,
-                            'Your Contact Information': f"Email: {your_email} | Phone: {your_phone}",
-                            'Resume Link': resume_link
-                        },
-                        'additional_cols': {}
+                        'pool_size': pool_size,
+                        'max_messages_per_connection': recycle_after or None,
+                        'user_details': sender_details,
+                        'additional_cols': additional_cols
                     }
                     
-                    # Set up progress tracking
-                    progress_bar = st.progress(0)
-                    status_text = st.empty()
-                    
-                    # Create a placeholder for logs
-                    log_placeholder = st.empty()
-                    
-                    # Redirect print to the UI
-                    import sys
-                    from io import StringIO
-                    
-                    class StdoutCatcher:
-                        def __init__(self):
-                            self.log = ""
-                        
-                        def write(self, message):
-                            self.log += message
-                            log_placeholder.text_area("Sending Logs", value=self.log, height=200)
-                    
-                    # Start capturing stdout
-                    old_stdout = sys.stdout
-                    sys.stdout = StdoutCatcher()
-                    
-                    # Reset cancellation flag at start
-                    st.session_state.cancelled = False
-                    
-                    # Create containers for UI elements
-                    progress_container = st.empty()
-                    stop_container = st.empty()
+                    # Load the suppression list, adding any uploaded opt-outs
+                    suppression_list = None
+                    if use_suppression or opt_out_file is not None:
+                        suppression_list = SuppressionList()
+                        if opt_out_file is not None:
+                            added = suppression_list.import_file(opt_out_file)
+                            st.info(f"Imported {added} new addresses into the suppression list")
                     
-                    # Initialize progress bar
-                    progress_bar = progress_container.progress(0)
+                    # Attachments are attached by path, so keep a copy of each
+                    # upload on disk, in a directory of this job's own that is
+                    # removed once the job has finished
+                    attachment_paths = []
+                    attachment_dir = None
+                    if attachment_files:
+                        attachment_dir = tempfile.mkdtemp(prefix="cold_email_attachments_")
+                        for attachment in attachment_files:
+                            path = os.path.join(attachment_dir, os.path.basename(attachment.name))
+                            with open(path, "wb") as fp:
+                                fp.write(attachment.getvalue())
+                            attachment_paths.append(path)
                     
-                    # Add stop button
-                    stop_button = stop_container.button("🛑 Stop Sending", 
-                                                    on_click=cancel_sending,
-                                                    key="stop_button")
-                    
-                    # Status text
-                    status_text = st.empty()
-                    
-                    try:
-                        # Get total number of valid emails (non-null email addresses)
-                        valid_emails = df[df[email_col].notna() & (df[email_col] != '')]
-                        total_emails = len(valid_emails)
-                        
-                        # Use session state to track progress across reruns
-                        if 'progress_state' not in st.session_state:
-                            st.session_state.progress_state = {
-                                'last_update': 0,
-                                'last_progress': -1
-                            }
-                        
-                        def update_progress(progress):
-                            """Update progress bar and status text"""
-                            try:
-                                # Get current timestamp
-                                current_time = time.time()
-                                
-                                # Throttle updates to at most once every 0.5 seconds
-                                if current_time - st.session_state.progress_state['last_update'] < 0.5:
-                                    return
-                                
-                                # Only update if progress has changed significantly (1% or more)
-                                current_progress = int(progress * 100)
-                                if current_progress == st.session_state.progress_state['last_progress']:
-                                    return
-                                
-                                # Update state
-                                st.session_state.progress_state.update({
-                                    'last_update': current_time,
-                                    'last_progress': current_progress
-                                })
-                                
-                                # Ensure progress is between 0 and 1
-                                safe_progress = max(0.0, min(float(progress), 1.0))
-                                
-                                # Update progress bar with error handling
-                                try:
-                                    progress_bar.progress(safe_progress)
-                                except Exception as e:
-                                    print(f"Progress bar error: {str(e)}")
-                                
-                                # Calculate current email being processed
-                                current = min(int(round(safe_progress * total_emails)), total_emails)
-                                
-                                # Update status text with error handling
-                                try:
-                                    status_text.text(f"Sending email {current} of {total_emails}...")
-                                except Exception as e:
-                                    print(f"Status text error: {str(e)}")
-                                
-                                # Check for cancellation
-                                if st.session_state.get('cancelled', False):
-                                    raise Exception("Process cancelled by user")
-                                    
-                            except Exception as e:
-                                # Only re-raise cancellation exceptions
-                                if 'cancelled' in str(e).lower():
-                                    raise e
-                                # Log other errors but don't crash the app
-                                print(f"Progress update error: {str(e)}")
-                                if st.session_state.get('cancelled', False):
-                                    raise Exception("Process cancelled by user")
-                        
-                        # Call the email sending function
-                        with st.spinner("Sending emails..."):
-                            # Send emails with progress tracking
-                            try:
-                                email_system.send_emails(
-                                    smtp_config=smtp_config,
-                                    test_mode=False,
-                                    batch_size=batch_size,
-                                    email_col=email_col,
-                                    company_col=company_col,
-                                    progress_callback=update_progress
-                                )
-                            except Exception as e:
-                                if "cancelled" not in str(e).lower():
-                                    raise e
-                            
-                            # If we get here, sending completed successfully
-                            if not st.session_state.cancelled:
-                                progress_bar.progress(1.0)
-                                status_text.success("✅ All emails sent successfully!")
-                                st.balloons()
-                        
-                        # Restore stdout
-                        sys.stdout = old_stdout
-                        
-                        # Show success message
-                        st.session_state.email_sent = True
-                        st.session_state.progress = 100
-                        progress_bar.progress(100)
-                        status_text.success("✅ All emails sent successfully!")
-                        st.balloons()
-                        
-                    except Exception as e:
-                        # Restore stdout in case of error
-                        sys.stdout = old_stdout
-                        if "cancelled" in str(e).lower():
-                            st.warning("⚠️ Email sending was cancelled. Some emails may have been sent.")
-                        else:
-                            st.error(f"❌ Error sending emails: {str(e)}")
-                            st.exception(e)
+                    # Hand the campaign to the background worker; the page
+                    # stays responsive and polls the job below
+                    job = get_worker().submit(
+                        email_system,
+                        label=f"{uploaded_file.name} ({len(df)} rows)",
+                        on_finished=(lambda: shutil.rmtree(attachment_dir, ignore_errors=True)) if attachment_dir else None,
+                        smtp_config=smtp_config,
+                        test_mode=False,
+                        batch_size=batch_size,
+                        email_col=email_col,
+                        company_col=company_col,
+                        delay_between_emails=delay_between_emails,
+                        delay_between_batches=delay_between_batches,
+                        rate_limits={'per_hour': max_per_hour or None},
+                        journal=SendJournal(),
+                        resume=resume_campaign,
+                        suppression=suppression_list,
+                        suppress_after_send=use_suppression,
+                        attachments=attachment_paths,
+                        accounts=[{'daily_quota': daily_quota or None}] + extra_accounts,
+                        quota_store=QuotaStore(),
+                        balance=balance_strategy,
+                        domain_limits={
+                            'per_minute': domain_per_minute or None,
+                            'max_in_flight': domain_in_flight or None
+                        }
+                    )
+                    st.session_state.job_ids.append(job.id)
         
         except Exception as e:
             st.error(f"Error processing file: {str(e)}")
             st.exception(e)
     else:
         st.info("Please upload a dataset to get started.")
+    
+    # Campaigns submitted from this session, polled on every rerun
+    jobs = [job for job in map(get_worker().get, st.session_state.job_ids) if job is not None]
+    if jobs:
+        st.markdown("---")
+        st.subheader("Campaigns")
+    for job in reversed(jobs):
+        st.write(f"**{job.label}** - {job.state}")
+        if not job.finished:
+            st.progress(job.progress)
+            st.button("🛑 Stop Sending", on_click=job.cancel, key=f"stop_job_{job.id}")
+        elif job.state == 'done':
+            st.success("✅ All emails sent successfully!")
+            if not st.session_state.email_sent:
+                st.session_state.email_sent = True
+                st.balloons()
+        elif job.state == 'cancelled':
+            st.warning("⚠️ Email sending was cancelled. Some emails may have been sent.")
+        elif job.state == 'quota_reached':
+            st.warning("⚠️ Every sender account has reached its quota. Send the campaign again later with "
+                       "'Skip recipients already emailed' checked to reach the rest.")
+        elif job.state == 'failed':
+            st.error(f"❌ Error sending emails: {str(job.error)}")
+        
+        # Only the most recent events are rendered; the log itself is a bounded ring buffer
+        events = job.email_system.events
+        with st.expander("Sending Logs", expanded=not job.finished):
+            st.caption(", ".join(f"{count} {kind}" for kind, count in events.counts.items()))
+            snapshot = job.email_system.metrics.snapshot()
+            smtp_latency = snapshot['stages'].get('smtp_send')
+            if smtp_latency:
+                st.caption(f"{snapshot['messages_per_second']:.2f} emails/s · SMTP p50 "
+                           f"{smtp_latency['p50_seconds'] * 1000:.0f} ms, p95 {smtp_latency['p95_seconds'] * 1000:.0f} ms · "
+                           f"throttled {snapshot['throttled_seconds']:.0f}s")
+            st.text("\n".join(format_event(event) for event in events.tail(LOG_TAIL_LINES)))
+        
+        # Show rows dropped by address validation
+        rejected = job.email_system.rejected
+        if job.finished and rejected is not None and len(rejected):
+            with st.expander(f"⚠️ {len(rejected)} rows were skipped by address validation"):
+                st.dataframe(rejected)
+    
+    if any(not job.finished for job in jobs):
+        time.sleep(1)
+        st.rerun()
 
 with tab2:
     if 'df' in st.session_state:
@@ -0,0 +1,398 @@
+"""
+asyncio sending engine.
+
+An alternative to the blocking loop in ``EmailSystem.send_emails``: several
+SMTP sessions are driven over asyncio streams, delays never block the event
+loop, and per-recipient results are exposed as an async iterator.
+
+``LocalSMTPSink`` is a minimal in-process SMTP server that accepts and keeps
+every message, so the engine can be exercised and timed without a relay::
+
+    sink = LocalSMTPSink()
+    await sink.start()
+    config = {'smtp_server': '127.0.0.1', 'smtp_port': sink.port,
+              'smtp_username': 'me@example.com', 'smtp_password': '', 'use_tls': False}
+    async for result in email_system.send_emails_async(config, test_mode=False):
+        ...
+"""
+import asyncio
+import base64
+import re
+import smtplib
+import ssl
+import time
+from collections import namedtuple
+
+from attachment_cache import ATTACHMENT_CACHE
+from mime_fastpath import MessageSkeleton, PreparedMessage, smtp_flatten
+from rate_limiter import RateLimiter, is_throttle_error
+from send_journal import make_campaign_id
+from sender_accounts import AccountRouter, SenderAccount
+
+SendResult = namedtuple('SendResult', ['recipient', 'status', 'detail'])
+
+_LEADING_DOT = re.compile(rb'(?m)^\.')
+
+
+class AsyncSMTPClient:
+    """A small SMTP client speaking the protocol over asyncio streams"""
+
+    def __init__(self, host, port=587, timeout=30):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.reader = None
+        self.writer = None
+        self.extensions = {}
+
+    async def _read_reply(self):
+        lines = []
+        while True:
+            line = await asyncio.wait_for(self.reader.readline(), self.timeout)
+            if not line:
+                raise smtplib.SMTPServerDisconnected("Connection unexpectedly closed")
+            lines.append(line[4:].strip())
+            if line[3:4] != b'-':
+                return int(line[:3]), b'\n'.join(lines)
+
+    async def command(self, line, expect=(250,)):
+        """Send one command line and return (code, message), raising on unexpected codes"""
+        self.writer.write(line.encode('ascii') + b'\r\n')
+        await self.writer.drain()
+        code, message = await self._read_reply()
+        if code not in expect:
+            raise smtplib.SMTPResponseException(code, message)
+        return code, message
+
+    async def ehlo(self):
+        code, message = await self.command('EHLO localhost')
+        self.extensions = {}
+        for line in message.decode('latin-1').split('\n')[1:]:
+            keyword, _, params = line.partition(' ')
+            self.extensions[keyword.upper()] = params
+        return code, message
+
+    async def connect(self, use_tls=True):
+        """Open the connection, secure it with STARTTLS and greet the server"""
+        self.reader, self.writer = await asyncio.wait_for(
+            asyncio.open_connection(self.host, self.port), self.timeout
+        )
+        code, message = await self._read_reply()
+        if code != 220:
+            raise smtplib.SMTPConnectError(code, message)
+        await self.ehlo()
+        if use_tls:
+            if 'STARTTLS' not in self.extensions:
+                raise smtplib.SMTPNotSupportedError("STARTTLS extension not supported by server.")
+            await self.command('STARTTLS', expect=(220,))
+            await self.writer.start_tls(ssl.create_default_context(), server_hostname=self.host)
+            await self.ehlo()
+
+    async def login(self, username, password):
+        methods = self.extensions.get('AUTH', '').upper().split()
+        if 'PLAIN' in methods or not methods:
+            token = base64.b64encode(f"\0{username}\0{password}".encode('utf-8')).decode('ascii')
+            await self.command(f'AUTH PLAIN {token}', expect=(235,))
+        else:
+            await self.command('AUTH LOGIN', expect=(334,))
+            await self.command(base64.b64encode(username.encode('utf-8')).decode('ascii'), expect=(334,))
+            await self.command(base64.b64encode(password.encode('utf-8')).decode('ascii'), expect=(235,))
+
+    async def sendmail(self, from_addr, to_addrs, data):
+        """Send already-serialized message bytes to the given recipients"""
+        await self.command(f'MAIL FROM:<{from_addr}>')
+        for addr in to_addrs:
+            await self.command(f'RCPT TO:<{addr}>', expect=(250, 251))
+        await self.command('DATA', expect=(354,))
+        data = _LEADING_DOT.sub(b'..', data)
+        if not data.endswith(b'\r\n'):
+            data += b'\r\n'
+        self.writer.write(data + b'.\r\n')
+        await self.writer.drain()
+        code, message = await self._read_reply()
+        if code != 250:
+            raise smtplib.SMTPDataError(code, message)
+
+    async def quit(self):
+        try:
+            await self.command('QUIT', expect=(221,))
+        finally:
+            self.writer.close()
+
+
+async def open_async_session(smtp_config):
+    """Connect and log in one asyncio SMTP session"""
+    client = AsyncSMTPClient(smtp_config['smtp_server'], smtp_config.get('smtp_port', 587))
+    await client.connect(use_tls=smtp_config.get('use_tls', True))
+    if smtp_config.get('smtp_username') and smtp_config.get('smtp_password'):
+        await client.login(smtp_config['smtp_username'], smtp_config['smtp_password'])
+    return client
+
+
+def serialize_message(msg):
+    """Flatten a MIME message into wire bytes the way smtplib.send_message does"""
+    return smtp_flatten(msg)
+
+
+async def iter_send_results(email_system, smtp_config, test_mode=True, batch_size=100,
+                            email_col=None, company_col=None, concurrency=None,
+                            delay_between_emails=2, delay_between_batches=15, rate_limits=None,
+                            max_retries=3, journal=None, campaign_id=None, resume=True, stream=False,
+                            resolver=None, suppression=None, suppress_after_send=False, fast_mime=True,
+                            attachments=None, quota_store=None):
+    """
+    Send a campaign over several asyncio SMTP sessions.
+
+    Args:
+        email_system (EmailSystem): Loaded email system holding data and template
+        smtp_config (dict): SMTP configuration; 'pool_size' sets the session count
+        test_mode (bool): If True, render only and report every recipient as 'preview'
+        batch_size (int): Number of emails in each batch
+        email_col (str): Name of the column containing email addresses
+        company_col (str): Name of the column containing company names
+        concurrency (int): Number of concurrent SMTP sessions
+        delay_between_emails (float): Minimum spacing between sends across all sessions
+        delay_between_batches (float): Pause between batches
+        rate_limits (dict): Optional send caps: 'per_minute' paces sending, while
+            'per_hour' and 'per_day' are quotas of the sending account; sending
+            stops with a 'quota' event once one is used up
+        max_retries (int): Retries for a message the relay throttled or dropped
+        journal (SendJournal): Optional journal recording every accepted message
+        campaign_id (str): Journal key; derived from the sender and template by default
+        resume (bool): Skip recipients the journal already lists as sent
+        stream (bool): Read recipients from the file in chunks while sending
+        resolver (DomainResolver): Optional resolver used to drop domains that cannot receive mail
+        suppression (SuppressionList): Addresses never to email
+        suppress_after_send (bool): Add every recipient to the suppression list once sent
+        fast_mime (bool): Assemble wire bytes from a per-campaign message skeleton
+        attachments (list): Paths of files to attach to every email, encoded once
+        quota_store (QuotaStore): Persists the account's usage so quotas hold across runs
+
+    Yields:
+        SendResult: One result per recipient, in completion order
+    """
+    already_sent = None
+    if journal is not None and not test_mode:
+        campaign_id = campaign_id or make_campaign_id(smtp_config.get('smtp_username'), email_system.template)
+        if resume:
+            already_sent = journal.completed(campaign_id)
+    else:
+        journal = None
+
+    campaign = email_system._prepare_campaign(smtp_config, batch_size, email_col, company_col,
+                                              exclude=already_sent, stream=stream, resolver=resolver,
+                                              suppression=suppression)
+    if campaign is None:
+        return
+
+    concurrency = max(1, int(concurrency or smtp_config.get('pool_size', 1)))
+    pending = asyncio.Queue(maxsize=concurrency * 2)
+    results = asyncio.Queue()
+    limiter = RateLimiter.from_settings(delay_between_emails, rate_limits)
+    metrics = email_system.metrics
+    metrics.reset(limiter)
+    from_addr = smtp_config.get('smtp_username', '')
+    router = None
+    if not test_mode:
+        account = SenderAccount.from_settings(smtp_config, rate_limits=rate_limits)
+        router = AccountRouter([account], quota_store)
+    attachments = email_system._load_attachments(attachments)
+    if attachments is None:
+        return
+    skeleton = MessageSkeleton(from_addr, attachments=[
+        ATTACHMENT_CACHE.get(path) for path in attachments
+    ]) if fast_mime and not test_mode else None
+
+    async def deliver(client, recipient, data):
+        """Send one message with retries; returns the (possibly new) session"""
+        attempt = 0
+        while True:
+            wait = limiter.reserve()
+            await asyncio.sleep(wait)
+            metrics.observe('rate_wait', wait)
+            try:
+                send_start = time.perf_counter()
+                await client.sendmail(from_addr, [recipient], data)
+                metrics.observe('smtp_send', time.perf_counter() - send_start)
+                metrics.incr('sent')
+                router.record_sent(account)
+                limiter.record_success()
+                if journal:
+                    journal.record(campaign_id, recipient)
+                if suppression is not None and suppress_after_send:
+                    suppression.add(recipient, 'contacted')
+                await results.put(SendResult(recipient, 'sent', attempt or None))
+                return client
+            except (smtplib.SMTPException, OSError, asyncio.TimeoutError) as e:
+                retry = attempt < max_retries and (
+                    isinstance(e, smtplib.SMTPServerDisconnected) or is_throttle_error(e)
+                )
+                if is_throttle_error(e):
+                    limiter.record_throttle()
+                try:
+                    # Clear the half-finished transaction before going on
+                    await client.command('RSET')
+                except (smtplib.SMTPException, OSError, asyncio.TimeoutError):
+                    client = await open_async_session(smtp_config)
+                if not retry:
+                    router.release(account)
+                    metrics.incr('failed')
+                    if journal:
+                        journal.record(campaign_id, recipient, 'failed', str(e))
+                    await results.put(SendResult(recipient, 'failed', str(e)))
+                    return client
+            attempt += 1
+            metrics.incr('retried')
+
+    async def session_worker():
+        client = await open_async_session(smtp_config)
+        try:
+            while True:
+                item = await pending.get()
+                if item is None:
+                    pending.task_done()
+                    return
+                recipient, data = item
+                try:
+                    client = await deliver(client, recipient, data)
+                finally:
+                    pending.task_done()
+        finally:
+            try:
+                await client.quit()
+            except Exception:
+                pass
+
+    async def produce():
+        quota_reached = False
+        for batch_num, (_, batch) in enumerate(campaign.batches()):
+            if quota_reached:
+                break
+            if batch_num > 0 and not test_mode:
+                # Let the previous batch drain before pausing
+                await pending.join()
+                await asyncio.sleep(delay_between_batches)
+            with metrics.time('render'):
+                recipients, subjects, bodies = campaign.render(batch)
+            for recipient, subject_line, body in zip(recipients, subjects, bodies):
+                if test_mode:
+                    await results.put(SendResult(recipient, 'preview', subject_line))
+                else:
+                    if router.choose() is None:
+                        email_system.events.emit('quota', "The sender account has reached its quota; run the "
+                                                          "campaign again later to reach the remaining recipients.",
+                                                 usage=router.usage())
+                        quota_reached = True
+                        break
+                    with metrics.time('build_message'):
+                        msg = email_system.prepare_message(smtp_config, recipient, subject_line, body, skeleton,
+                                                           attachments)
+                        data = msg.data if isinstance(msg, PreparedMessage) else serialize_message(msg)
+                    await pending.put((recipient, data))
+        for _ in workers:
+            await pending.put(None)
+
+    workers = [] if test_mode else [asyncio.create_task(session_worker()) for _ in range(concurrency)]
+    producer = asyncio.create_task(produce())
+    tasks = [producer] + workers
+    try:
+        while True:
+            for task in tasks:
+                if task.done() and task.exception():
+                    raise task.exception()
+            if results.empty() and all(task.done() for task in tasks):
+                break
+            try:
+                result = await asyncio.wait_for(results.get(), 0.5)
+            except asyncio.TimeoutError:
+                continue
+            yield result
+    finally:
+        producer.cancel()
+        for worker in workers:
+            worker.cancel()
+        await asyncio.gather(producer, *workers, return_exceptions=True)
+
+
+class LocalSMTPSink:
+    """
+    An in-process asyncio SMTP server that accepts and stores every message.
+
+    Args:
+        host (str): Interface to listen on
+        port (int): Port to listen on; 0 picks a free port
+        latency (float): Artificial delay before acknowledging each message
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.messages = []
+        self._server = None
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self):
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _handle(self, reader, writer):
+        def reply(line):
+            writer.write(line.encode('ascii') + b'\r\n')
+
+        reply('220 localhost sink ready')
+        mail_from = None
+        rcpt_to = []
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                verb = line[:4].upper()
+                if verb in (b'EHLO', b'HELO'):
+                    reply('250-localhost')
+                    reply('250-AUTH PLAIN LOGIN')
+                    reply('250 8BITMIME')
+                elif verb == b'AUTH':
+                    reply('235 Authentication successful')
+                elif verb == b'MAIL':
+                    mail_from = line[10:].strip().strip(b'<>').decode('latin-1')
+                    rcpt_to = []
+                    reply('250 OK')
+                elif verb == b'RCPT':
+                    rcpt_to.append(line[8:].strip().strip(b'<>').decode('latin-1'))
+                    reply('250 OK')
+                elif verb == b'DATA':
+                    reply('354 End data with <CR><LF>.<CR><LF>')
+                    await writer.drain()
+                    chunks = []
+                    while True:
+                        data_line = await reader.readline()
+                        if not data_line or data_line == b'.\r\n':
+                            break
+                        if data_line.startswith(b'..'):
+                            data_line = data_line[1:]
+                        chunks.append(data_line)
+                    if self.latency:
+                        await asyncio.sleep(self.latency)
+                    self.messages.append((mail_from, rcpt_to, b''.join(chunks)))
+                    reply('250 OK: queued')
+                elif verb in (b'NOOP', b'RSET'):
+                    reply('250 OK')
+                elif verb == b'QUIT':
+                    reply('221 Bye')
+                    await writer.drain()
+                    break
+                else:
+                    reply('502 Command not implemented')
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
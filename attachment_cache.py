@@ -0,0 +1,90 @@
+"""
+Encode-once attachment cache.
+
+Attaching the same file to every email of a campaign used to mean reading
+and base64-encoding it once per message. Files are now read once (large
+ones through mmap, without an extra copy), encoded once, and the encoded
+payload is shared by every message that attaches them. Entries are keyed
+by path, size and modification time, so an edited file is picked up on the
+next campaign, and the cache is bounded by total encoded size.
+"""
+import base64
+import mimetypes
+import mmap
+import os
+
+from email.mime.base import MIMEBase
+
+from bounded_cache import BoundedLRU
+
+# Files at least this large are read through mmap
+MMAP_THRESHOLD = 1024 * 1024
+
+
+def _read_encoded(path, size):
+    """Base64-encode a file the way email.encoders.encode_base64 does"""
+    with open(path, 'rb') as fp:
+        if size >= MMAP_THRESHOLD:
+            with mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                return base64.encodebytes(mapped).decode('ascii')
+        return base64.encodebytes(fp.read()).decode('ascii')
+
+
+class EncodedAttachment:
+    """
+    A file encoded once and ready to be attached to any number of messages.
+
+    Args:
+        path (str): File to attach
+    """
+
+    def __init__(self, path):
+        stat = os.stat(path)
+        self.path = path
+        self.filename = os.path.basename(path)
+        self.size = stat.st_size
+        self.mtime_ns = stat.st_mtime_ns
+
+        # Guess the content type based on the file's extension
+        ctype, encoding = mimetypes.guess_type(path)
+        if ctype is None or encoding is not None:
+            ctype = 'application/octet-stream'
+        self.maintype, self.subtype = ctype.split('/', 1)
+        self.payload = _read_encoded(path, self.size)
+
+    def make_part(self):
+        """A MIME part carrying the shared, already encoded payload"""
+        part = MIMEBase(self.maintype, self.subtype)
+        part.set_payload(self.payload)
+        part['Content-Transfer-Encoding'] = 'base64'
+        part.add_header('Content-Disposition', 'attachment', filename=self.filename)
+        return part
+
+
+class AttachmentCache:
+    """
+    A thread-safe LRU cache of encoded attachments bounded by memory.
+
+    Args:
+        max_bytes (int): Evict least recently used files beyond this total encoded size
+        max_entries (int): Evict least recently used files beyond this count
+    """
+
+    def __init__(self, max_bytes=128 * 1024 * 1024, max_entries=16):
+        self._entries = BoundedLRU(max_entries, max_size=max_bytes, sizeof=lambda attachment: len(attachment.payload))
+
+    def get(self, path):
+        """Return the EncodedAttachment for a file, encoding it on first use"""
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        attachment = self._entries.get((path, stat.st_size, stat.st_mtime_ns))
+        if attachment is None:
+            attachment = EncodedAttachment(path)
+            self._entries.put((path, attachment.size, attachment.mtime_ns), attachment)
+        return attachment
+
+    def clear(self):
+        self._entries.clear()
+
+
+ATTACHMENT_CACHE = AttachmentCache()
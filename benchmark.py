@@ -0,0 +1,358 @@
+"""
+Benchmarks for loading, rendering and sending at scale.
+
+Synthetic recipient files are generated once (CSV and .xlsx, 10k / 100k / 1M
+rows by default) and every measurement runs in a fresh process, so parsed
+dataset caches never carry over between cases and peak memory belongs to the
+case alone. Sends go to an in-process SMTP sink, never to a real relay.
+
+Usage:
+    python benchmark.py                                  # full suite
+    python benchmark.py --sizes 10000 --formats csv      # quick run
+    python benchmark.py --compare old_results.json       # show change against an earlier run
+
+Results are written as JSON (see --output) with one entry per case:
+elapsed seconds, rows per second and peak memory, plus send metrics for
+the end-to-end cases.
+"""
+import argparse
+import asyncio
+import contextlib
+import csv
+import json
+import logging
+import os
+import platform
+import random
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+DEFAULT_SIZES = (10000, 100000, 1000000)
+DEFAULT_FORMATS = ('csv', 'xlsx')
+DEFAULT_CASES = ('load', 'render', 'mime', 'mime_tree', 'send', 'send_async')
+
+COLUMNS = ['Company Name', 'Email', 'Position', 'City']
+POSITIONS = ['Software Engineer', 'Data Analyst', 'Product Manager', 'Intern', 'Designer']
+CITIES = ['Berlin', 'London', 'New York', 'Bangalore', 'Toronto', 'Sydney', 'Paris', 'Austin']
+
+TEMPLATE = """Subject: Application for [Position] at [Company Name]
+
+Dear [Company Name] HR Team,
+
+I am writing to express my interest in the [Position] position at [Company Name] in [City].
+
+[Your custom message here]
+
+You can find my resume here: [Resume Link]
+
+Best regards,
+[Your Name]
+[Your Contact Information]"""
+
+SMTP_CONFIG = {
+    'smtp_server': '127.0.0.1',
+    'smtp_username': 'bench@example.com',
+    'smtp_password': '',
+    'use_tls': False,
+    'user_details': {
+        'Your Name': 'Bench Mark',
+        'Your custom message here': 'I enjoy making things fast.',
+        'Your Contact Information': 'bench@example.com',
+    },
+    'additional_cols': {'Position': 'Position', 'City': 'City'},
+}
+
+
+def generate_rows(rows, seed=42):
+    """Yield deterministic synthetic recipient rows"""
+    rng = random.Random(seed)
+    companies = [f"Company {i}" for i in range(max(1, rows // 20))]
+    for i in range(rows):
+        company = rng.choice(companies)
+        yield [company, f"contact{i}@{company.lower().replace(' ', '')}.example.com",
+               rng.choice(POSITIONS), rng.choice(CITIES)]
+
+
+def write_dataset(path, rows):
+    """Write a synthetic dataset as CSV or .xlsx, chosen by the file extension"""
+    tmp_path = f"{path}.tmp"
+    if path.endswith('.csv'):
+        with open(tmp_path, 'w', newline='', encoding='utf-8') as fp:
+            writer = csv.writer(fp)
+            writer.writerow(COLUMNS)
+            writer.writerows(generate_rows(rows))
+    else:
+        from openpyxl import Workbook
+
+        workbook = Workbook(write_only=True)
+        sheet = workbook.create_sheet()
+        sheet.append(COLUMNS)
+        for row in generate_rows(rows):
+            sheet.append(row)
+        with open(tmp_path, 'wb') as fp:
+            workbook.save(fp)
+    os.replace(tmp_path, path)
+
+
+def ensure_dataset(data_dir, rows, fmt):
+    """Return the path of a synthetic dataset, generating it on first use"""
+    os.makedirs(data_dir, exist_ok=True)
+    path = os.path.join(data_dir, f"recipients_{rows}.{fmt}")
+    if not os.path.exists(path):
+        print(f"Generating {path}...", flush=True)
+        write_dataset(path, rows)
+    return path
+
+
+def peak_memory_mb():
+    """Peak resident memory of this process in MB, or None where unsupported"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KB, macOS bytes
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def _loaded_system(path):
+    from email_system import EmailSystem
+
+    email_system = EmailSystem(path)
+    email_system.load_data()
+    email_system.template = TEMPLATE
+    email_system.resume_link = 'https://example.com/resume'
+    return email_system
+
+
+def _prepared_campaign(path):
+    email_system = _loaded_system(path)
+    campaign = email_system._prepare_campaign(SMTP_CONFIG, batch_size=1000, email_col='Email',
+                                              company_col='Company Name')
+    return email_system, campaign
+
+
+def _rendered(campaign):
+    for _, batch in campaign.batches():
+        yield from zip(*campaign.render(batch))
+
+
+@contextlib.contextmanager
+def _local_sink():
+    """Run a LocalSMTPSink on its own event loop thread"""
+    from async_sender import LocalSMTPSink
+
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    sink = LocalSMTPSink()
+    asyncio.run_coroutine_threadsafe(sink.start(), loop).result()
+    try:
+        yield sink
+    finally:
+        asyncio.run_coroutine_threadsafe(sink.stop(), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+
+
+def bench_load(path, options):
+    """Parse and clean the whole file"""
+    from email_system import EmailSystem
+
+    start = time.perf_counter()
+    email_system = EmailSystem(path)
+    email_system.load_data()
+    return time.perf_counter() - start, len(email_system.data), {}
+
+
+def bench_render(path, options):
+    """Validate recipients and render every subject and body"""
+    email_system = _loaded_system(path)
+    start = time.perf_counter()
+    campaign = email_system._prepare_campaign(SMTP_CONFIG, batch_size=1000, email_col='Email',
+                                              company_col='Company Name')
+    rows = sum(1 for _ in _rendered(campaign))
+    return time.perf_counter() - start, rows, {}
+
+
+def bench_mime(path, options):
+    """Produce the wire bytes of every rendered email through the skeleton fast path"""
+    from mime_fastpath import MessageSkeleton
+
+    email_system, campaign = _prepared_campaign(path)
+    rendered = list(_rendered(campaign))
+    start = time.perf_counter()
+    skeleton = MessageSkeleton(SMTP_CONFIG['smtp_username'])
+    for recipient, subject, body in rendered:
+        email_system.prepare_message(SMTP_CONFIG, recipient, subject, body, skeleton)
+    return time.perf_counter() - start, len(rendered), {}
+
+
+def bench_mime_tree(path, options):
+    """Build and flatten a MIME tree per email, as send_message would"""
+    from mime_fastpath import smtp_flatten
+
+    email_system, campaign = _prepared_campaign(path)
+    rendered = list(_rendered(campaign))
+    start = time.perf_counter()
+    for recipient, subject, body in rendered:
+        smtp_flatten(email_system.build_message(SMTP_CONFIG, recipient, subject, body))
+    return time.perf_counter() - start, len(rendered), {}
+
+
+def _send_subset(path, options):
+    email_system = _loaded_system(path)
+    email_system.data = email_system.data.iloc[:options['send_rows']]
+    return email_system
+
+
+def bench_send(path, options):
+    """End-to-end send_emails against the local sink"""
+    email_system = _send_subset(path, options)
+    with _local_sink() as sink:
+        config = dict(SMTP_CONFIG, smtp_port=sink.port, pool_size=options['pool_size'])
+        start = time.perf_counter()
+        email_system.send_emails(config, test_mode=False, batch_size=1000, email_col='Email',
+                                 company_col='Company Name', delay_between_emails=0, delay_between_batches=0,
+                                 render_workers=options['render_workers'])
+        elapsed = time.perf_counter() - start
+        delivered = len(sink.messages)
+    return elapsed, delivered, {'metrics': email_system.metrics.snapshot()}
+
+
+def bench_send_async(path, options):
+    """End-to-end asyncio engine against the local sink"""
+    from async_sender import LocalSMTPSink
+
+    email_system = _send_subset(path, options)
+
+    async def run():
+        sink = await LocalSMTPSink().start()
+        config = dict(SMTP_CONFIG, smtp_port=sink.port)
+        try:
+            start = time.perf_counter()
+            async for _ in email_system.send_emails_async(
+                    config, test_mode=False, batch_size=1000, email_col='Email', company_col='Company Name',
+                    concurrency=options['pool_size'], delay_between_emails=0, delay_between_batches=0):
+                pass
+            return time.perf_counter() - start, len(sink.messages)
+        finally:
+            await sink.stop()
+
+    elapsed, delivered = asyncio.run(run())
+    return elapsed, delivered, {'metrics': email_system.metrics.snapshot()}
+
+
+CASES = {
+    'load': bench_load,
+    'render': bench_render,
+    'mime': bench_mime,
+    'mime_tree': bench_mime_tree,
+    'send': bench_send,
+    'send_async': bench_send_async,
+}
+
+
+def run_case(case, path, options):
+    """Run one case in the current (fresh) process and return its result dict"""
+    logging.getLogger('email_system').setLevel(logging.ERROR)
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        baseline = peak_memory_mb()
+        elapsed, rows, extra = CASES[case](path, options)
+    peak = peak_memory_mb()
+    result = {
+        'elapsed_seconds': round(elapsed, 4),
+        'rows': rows,
+        'rows_per_second': round(rows / elapsed, 1) if elapsed > 0 else None,
+        'peak_rss_mb': round(peak, 1) if peak is not None else None,
+        'baseline_rss_mb': round(baseline, 1) if baseline is not None else None,
+    }
+    result.update(extra)
+    return result
+
+
+def environment():
+    """Versions and machine details stored alongside the results"""
+    import pandas
+
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'git_commit': commit,
+        'python': platform.python_version(),
+        'pandas': pandas.__version__,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+    }
+
+
+def compare(results, previous_path):
+    """Print the elapsed-time change of every case also present in an earlier run"""
+    with open(previous_path, encoding='utf-8') as fp:
+        previous = {(r['case'], r['format'], r['size']): r for r in json.load(fp)['results']}
+    print(f"\nChange against {previous_path}:")
+    for result in results:
+        before = previous.get((result['case'], result['format'], result['size']))
+        if before and before.get('elapsed_seconds') and result.get('elapsed_seconds'):
+            change = result['elapsed_seconds'] / before['elapsed_seconds'] - 1
+            print(f"  {result['case']:<11} {result['format']:<5} {result['size']:>8}: {change:+.1%}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark loading, rendering and sending")
+    parser.add_argument('--sizes', default=','.join(map(str, DEFAULT_SIZES)),
+                        help="Comma-separated dataset row counts")
+    parser.add_argument('--formats', default=','.join(DEFAULT_FORMATS), help="Comma-separated: csv, xlsx")
+    parser.add_argument('--cases', default=','.join(DEFAULT_CASES), help="Comma-separated: " + ', '.join(CASES))
+    parser.add_argument('--send-rows', type=int, default=10000,
+                        help="Recipients per end-to-end send case (sending 1M messages takes very long)")
+    parser.add_argument('--pool-size', type=int, default=4, help="SMTP connections for the send cases")
+    parser.add_argument('--render-workers', type=int, default=None,
+                        help="Render processes for the send case; renders inline by default")
+    parser.add_argument('--data-dir', default='bench_data', help="Where synthetic datasets are kept")
+    parser.add_argument('--output', default='benchmark_results.json', help="JSON file to write results to")
+    parser.add_argument('--compare', help="Earlier results file to compare against")
+    args = parser.parse_args(argv)
+
+    sizes = [int(size) for size in args.sizes.split(',')]
+    formats = [fmt.strip() for fmt in args.formats.split(',')]
+    cases = [case.strip() for case in args.cases.split(',')]
+    unknown = set(cases) - set(CASES)
+    if unknown:
+        parser.error(f"unknown cases: {', '.join(sorted(unknown))}")
+    options = {'send_rows': args.send_rows, 'pool_size': args.pool_size, 'render_workers': args.render_workers}
+
+    results = []
+    for size in sizes:
+        for fmt in formats:
+            path = ensure_dataset(args.data_dir, size, fmt)
+            for case in cases:
+                if case.startswith('send') and size > args.send_rows and size != min(sizes):
+                    # The send subset is the same for every larger file
+                    continue
+                # A fresh process per case keeps caches and memory peaks apart
+                with ProcessPoolExecutor(max_workers=1, mp_context=get_context('spawn')) as executor:
+                    result = executor.submit(run_case, case, path, options).result()
+                result = {'case': case, 'format': fmt, 'size': size, **result}
+                results.append(result)
+                print(f"{case:<11} {fmt:<5} {size:>8} rows: {result['elapsed_seconds']:>9.3f}s "
+                      f"{result['rows_per_second'] or 0:>11.0f} rows/s  peak {result['peak_rss_mb']} MB",
+                      flush=True)
+
+    with open(args.output, 'w', encoding='utf-8') as fp:
+        json.dump({'environment': environment(), 'options': options, 'results': results}, fp, indent=2)
+    print(f"\nResults written to {args.output}")
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+"""
+Bounded least-recently-used cache shared by the in-memory caches.
+
+Parsed datasets, encoded attachments, inferred column roles and rendered
+previews are all kept in a ``BoundedLRU``: a thread-safe mapping that
+evicts the least recently used entries once it holds more than a given
+number of entries or, when values have a size, more than a total size.
+"""
+import threading
+from collections import OrderedDict
+
+
+class BoundedLRU:
+    """
+    A thread-safe LRU mapping bounded by entry count and optionally by size.
+
+    Args:
+        max_entries (int): Evict least recently used entries beyond this count
+        max_size (int): Evict least recently used entries beyond this total
+            size, None for no size bound
+        sizeof (callable): Size of a value; needed with ``max_size``
+    """
+
+    def __init__(self, max_entries, max_size=None, sizeof=None):
+        if max_size is not None and sizeof is None:
+            raise ValueError("max_size needs a sizeof function")
+        self.max_entries = max_entries
+        self.max_size = max_size
+        self.sizeof = sizeof
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._entries
+
+    @property
+    def size(self):
+        """Total size of the cached values, 0 without a sizeof function"""
+        return self._size
+
+    def get(self, key, default=None):
+        """Return the value for ``key``, marking it as recently used"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def put(self, key, value):
+        """Store a value, evicting least recently used entries beyond the bounds"""
+        # Sizing can be slow (deep memory usage of a frame), so it happens
+        # outside the lock
+        size = self.sizeof(value) if self.sizeof is not None else 0
+        with self._lock:
+            if key in self._entries:
+                self._size -= self._entries.pop(key)[1]
+            self._entries[key] = (value, size)
+            self._size += size
+            # Always keep the newest entry, even if it alone exceeds the budget
+            while len(self._entries) > 1 and (len(self._entries) > self.max_entries or
+                                              (self.max_size is not None and self._size > self.max_size)):
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._size -= evicted_size
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
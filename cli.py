@@ -0,0 +1,384 @@
+"""
+Headless command line entry point for scheduled and containerized runs.
+
+Everything comes from a JSON config file, a .env file and environment
+variables; nothing is ever read from stdin. Progress and send events are
+written to stdout as JSON lines, one object per line, while anything the
+library prints for humans goes to stderr. Heavy modules (pandas, the email
+package, the SMTP stack) are only imported by the commands that need them,
+so ``--help`` and ``validate`` return almost instantly.
+
+Config file (all keys optional except where a command needs them)::
+
+    {
+        "data_file": "companies.xlsx",
+        "template_file": "template.txt",
+        "resume_link": "https://...",
+        "email_col": "Email",
+        "company_col": "Company Name",
+        "smtp": {"smtp_server": "smtp.gmail.com", "smtp_port": 587,
+                 "smtp_username": "me@example.com", "pool_size": 2},
+        "user_details": {"Your Name": "...", "Position": "..."},
+        "additional_cols": {"City": "City"},
+        "send": {"batch_size": 100, "delay_between_emails": 2,
+                 "rate_limits": {"per_day": 500}, "attachments": ["resume.pdf"]},
+        "journal": "send_journal.sqlite3",
+        "suppression": "suppression_list.tsv",
+        "outbox": "outbox",
+        "quota_store": "sender_quota.sqlite3"
+    }
+
+The hourly and daily caps in rate_limits are sender account quotas: a run
+stops once one is used up, and with a quota_store the counts hold across
+runs, so a scheduled job picks up where the last one stopped.
+
+SMTP settings can also come from SMTP_SERVER, SMTP_PORT, SMTP_USERNAME and
+SMTP_PASSWORD, which take precedence over the file; keep the password there.
+
+Exit status: 0 on success, 1 if the run could not start or went wrong,
+2 if some emails failed.
+"""
+import argparse
+import json
+import os
+import signal
+import sys
+import threading
+
+# Environment variables overriding the 'smtp' section of the config
+SMTP_ENV = {
+    'SMTP_SERVER': 'smtp_server',
+    'SMTP_PORT': 'smtp_port',
+    'SMTP_USERNAME': 'smtp_username',
+    'SMTP_PASSWORD': 'smtp_password',
+}
+
+# Keys of the 'send' section passed through to EmailSystem.send_emails
+SEND_OPTIONS = (
+    'batch_size', 'delay_between_emails', 'delay_between_batches', 'rate_limits', 'resume', 'stream',
+    'suppress_after_send', 'fast_mime', 'attachments', 'render_workers', 'accounts', 'balance',
+    'domain_limits', 'metrics_file',
+)
+
+REQUIRED_SMTP = ('smtp_server', 'smtp_username')
+
+
+def load_config(path=None, env_file='.env'):
+    """
+    Read the config file and apply environment overrides.
+
+    Args:
+        path (str): JSON config file; environment variables alone are enough
+            when it is omitted
+        env_file (str): dotenv file loaded into the environment if it exists;
+            variables already set are not overwritten
+    """
+    if env_file and os.path.exists(env_file):
+        from dotenv import load_dotenv
+        load_dotenv(env_file, override=False)
+
+    config = {}
+    if path:
+        with open(path, encoding='utf-8') as fp:
+            config = json.load(fp)
+    smtp = dict(config.get('smtp') or {})
+    for variable, key in SMTP_ENV.items():
+        if os.environ.get(variable):
+            smtp[key] = os.environ[variable]
+    if 'smtp_port' in smtp:
+        smtp['smtp_port'] = int(smtp['smtp_port'])
+    config['smtp'] = smtp
+    return config
+
+
+def read_template(config):
+    """The template text from the config, or None to keep the built-in one"""
+    if config.get('template'):
+        return config['template']
+    if config.get('template_file'):
+        with open(config['template_file'], encoding='utf-8') as fp:
+            return fp.read()
+    return None
+
+
+def validate_config(config, needs_smtp=True):
+    """
+    Check a config without touching the data or the network.
+
+    Returns:
+        list: Problems found; empty when the config is usable
+    """
+    problems = []
+    data_file = config.get('data_file')
+    if not data_file:
+        problems.append("no data_file configured")
+    elif not os.path.exists(data_file):
+        problems.append(f"data_file {data_file} does not exist")
+    if needs_smtp:
+        missing = [key for key in REQUIRED_SMTP if not config['smtp'].get(key)]
+        if missing:
+            problems.append(f"missing SMTP settings: {', '.join(missing)}")
+    for path in (config.get('send') or {}).get('attachments') or ():
+        if not os.path.exists(path):
+            problems.append(f"attachment {path} does not exist")
+    try:
+        read_template(config)
+    except OSError as e:
+        problems.append(f"cannot read template_file: {e}")
+    return problems
+
+
+def template_placeholders(config):
+    """Placeholders the template uses that nothing in the config fills in"""
+    from template_engine import PLACEHOLDER_PATTERN
+
+    try:
+        template = read_template(config)
+    except OSError:
+        return []
+    if template is None:
+        return []
+    known = {'Company Name', 'Resume Link', 'Your Contact Information'}
+    known.update(config.get('user_details') or {})
+    known.update((config.get('additional_cols') or {}).values())
+    return sorted({name for name in PLACEHOLDER_PATTERN.findall(template)} - known)
+
+
+class JSONLines:
+    """Writes one JSON object per line to a stream, safely from any thread"""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self._lock = threading.Lock()
+
+    def write(self, kind, **fields):
+        line = json.dumps({'kind': kind, **fields}, default=str)
+        with self._lock:
+            self.stream.write(line + '\n')
+            self.stream.flush()
+
+
+def stream_events(email_system, out):
+    """Forward every event the email system emits to ``out``"""
+    import logging
+
+    class EventHandler(logging.Handler):
+        def emit(self, record):
+            event = getattr(record, 'event', None)
+            if event is not None:
+                out.write(event.kind, seq=event.seq, time=event.time, message=event.message, **event.data)
+
+    logger = logging.getLogger('email_system')
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    logger.addHandler(EventHandler())
+
+
+def cancel_on_signals(cancel_event):
+    """Stop gracefully on SIGINT and SIGTERM, e.g. when a container is stopped"""
+    def handle(signum, frame):
+        cancel_event.set()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, handle)
+
+
+def build_email_system(config):
+    """Load the data and template into a ready EmailSystem"""
+    from email_system import EmailSystem
+
+    email_system = EmailSystem(config['data_file'])
+    email_system.resume_link = config.get('resume_link') or None
+    template = read_template(config)
+    if template is not None:
+        email_system.template = template
+    if not (config.get('send') or {}).get('stream'):
+        email_system.load_data()
+    return email_system
+
+
+def smtp_settings(config):
+    """The smtp_config dict EmailSystem expects"""
+    return {
+        **config['smtp'],
+        'user_details': config.get('user_details') or {},
+        'additional_cols': config.get('additional_cols') or {},
+    }
+
+
+def cmd_validate(args, config, out):
+    problems = validate_config(config, needs_smtp=not args.offline)
+    result = {'ok': not problems, 'problems': problems, 'unfilled_placeholders': template_placeholders(config)}
+    if args.check_data and config.get('data_file') and os.path.exists(config['data_file']):
+        from data_loader import estimate_rows, iter_chunks
+
+        first = next(iter_chunks(config['data_file'], 1000), None)
+        result['columns'] = [] if first is None else [str(col) for col in first.columns]
+        result['estimated_rows'] = estimate_rows(config['data_file'])
+    out.write('validate', **result)
+    return 0 if not problems else 1
+
+
+def _run_options(config, cancel_event, out):
+    """Keyword arguments shared by the send and spool commands"""
+    options = {key: value for key, value in (config.get('send') or {}).items() if key in SEND_OPTIONS}
+    options.update(
+        email_col=config.get('email_col'),
+        company_col=config.get('company_col'),
+        cancel_event=cancel_event,
+        progress_callback=lambda progress: out.write('progress', progress=round(progress, 4)),
+    )
+    if config.get('journal'):
+        from send_journal import SendJournal
+        options['journal'] = SendJournal(config['journal'])
+    if config.get('suppression'):
+        from suppression import SuppressionList
+        options['suppression'] = SuppressionList(config['suppression'])
+    return options
+
+
+def _exit_status(email_system, outcome=None):
+    # A run that reports its outcome only fails on a fatal error, not on
+    # a non-fatal 'error' event such as a progress callback failing
+    counts = email_system.events.counts
+    if outcome == 'error' or (outcome is None and counts.get('error')):
+        return 1
+    if counts.get('failed'):
+        return 2
+    return 0
+
+
+def cmd_send(args, config, out):
+    problems = validate_config(config, needs_smtp=not args.dry_run)
+    if problems:
+        out.write('error', message="; ".join(problems))
+        return 1
+    cancel_event = threading.Event()
+    cancel_on_signals(cancel_event)
+    email_system = build_email_system(config)
+    stream_events(email_system, out)
+    options = _run_options(config, cancel_event, out)
+    if config.get('quota_store'):
+        from sender_accounts import QuotaStore
+        options['quota_store'] = QuotaStore(config['quota_store'])
+    if args.dry_run:
+        options.pop('journal', None)
+    outcome = email_system.send_emails(smtp_settings(config), test_mode=args.dry_run, **options)
+    out.write('summary', outcome=outcome, counts=dict(email_system.events.counts),
+              metrics=email_system.metrics.snapshot())
+    return _exit_status(email_system, outcome)
+
+
+def cmd_spool(args, config, out):
+    problems = validate_config(config, needs_smtp=False)
+    if problems:
+        out.write('error', message="; ".join(problems))
+        return 1
+    from outbox import Outbox
+
+    cancel_event = threading.Event()
+    cancel_on_signals(cancel_event)
+    email_system = build_email_system(config)
+    stream_events(email_system, out)
+    options = _run_options(config, cancel_event, out)
+    for key in ('delay_between_emails', 'delay_between_batches', 'rate_limits', 'suppress_after_send',
+                'accounts', 'balance', 'domain_limits', 'metrics_file'):
+        options.pop(key, None)
+    outbox = Outbox(config.get('outbox') or 'outbox')
+    email_system.spool_emails(smtp_settings(config), outbox, **options)
+    out.write('summary', counts=outbox.counts())
+    return _exit_status(email_system)
+
+
+def cmd_deliver(args, config, out):
+    missing = [key for key in REQUIRED_SMTP if not config['smtp'].get(key)]
+    if missing:
+        out.write('error', message=f"missing SMTP settings: {', '.join(missing)}")
+        return 1
+    from email_system import EmailSystem
+    from outbox import Outbox
+
+    cancel_event = threading.Event()
+    cancel_on_signals(cancel_event)
+    email_system = EmailSystem(config.get('data_file'))
+    stream_events(email_system, out)
+    send = config.get('send') or {}
+    outbox = Outbox(config.get('outbox') or 'outbox')
+    if args.retry_failed:
+        out.write('info', message=f"Queued {outbox.retry_failed()} failed emails again")
+    recovered = outbox.recover(older_than=args.recover_after)
+    if recovered:
+        out.write('info', message=f"Recovered {recovered} emails left claimed by an earlier run")
+    options = {key: send[key] for key in ('delay_between_emails', 'rate_limits', 'suppress_after_send',
+                                          'metrics_file') if key in send}
+    if config.get('journal'):
+        from send_journal import SendJournal
+        options['journal'] = SendJournal(config['journal'])
+    if config.get('suppression'):
+        from suppression import SuppressionList
+        options['suppression'] = SuppressionList(config['suppression'])
+    if config.get('quota_store'):
+        from sender_accounts import QuotaStore
+        options['quota_store'] = QuotaStore(config['quota_store'])
+    counts = email_system.deliver_outbox(
+        smtp_settings(config), outbox, cancel_event=cancel_event,
+        progress_callback=lambda progress: out.write('progress', progress=round(progress, 4)),
+        **options
+    )
+    out.write('summary', counts=counts)
+    return _exit_status(email_system)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        description="Send cold email campaigns without a browser or a terminal.",
+        epilog="Output is JSON lines on stdout. Exit status: 0 ok, 1 error, 2 some emails failed."
+    )
+    parser.add_argument('--config', help="JSON config file")
+    parser.add_argument('--env-file', default='.env', help="dotenv file with SMTP_* variables (default: .env)")
+    parser.add_argument('--data', help="Recipient file; overrides data_file from the config")
+    parser.add_argument('--template', help="Template file; overrides template_file from the config")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    validate = commands.add_parser('validate', help="Check the config and exit")
+    validate.add_argument('--offline', action='store_true', help="Don't require SMTP settings")
+    validate.add_argument('--check-data', action='store_true', help="Also read the data file's columns")
+    validate.set_defaults(handler=cmd_validate)
+
+    send = commands.add_parser('send', help="Send the campaign")
+    send.add_argument('--dry-run', action='store_true', help="Render every email without sending")
+    send.set_defaults(handler=cmd_send)
+
+    spool = commands.add_parser('spool', help="Render the campaign into the outbox without sending")
+    spool.set_defaults(handler=cmd_spool)
+
+    deliver = commands.add_parser('deliver', help="Deliver the emails waiting in the outbox")
+    deliver.add_argument('--retry-failed', action='store_true', help="Queue failed emails again first")
+    deliver.add_argument('--recover-after', type=float, default=3600,
+                         help="Seconds after which emails claimed by a crashed run are taken back")
+    deliver.set_defaults(handler=cmd_deliver)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    out = JSONLines(sys.stdout)
+    try:
+        config = load_config(args.config, args.env_file)
+    except (OSError, ValueError) as e:
+        out.write('error', message=f"Cannot read config: {e}")
+        return 1
+    if args.data:
+        config['data_file'] = args.data
+    if args.template:
+        config['template_file'] = args.template
+        config.pop('template', None)
+    # Keep stdout for JSON lines; the library's console output goes to stderr
+    stdout, sys.stdout = sys.stdout, sys.stderr
+    try:
+        return args.handler(args, config, out)
+    finally:
+        sys.stdout = stdout
+
+
+if __name__ == '__main__':
+    sys.exit(main())
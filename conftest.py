@@ -0,0 +1,44 @@
+import asyncio
+import threading
+
+import pandas as pd
+import pytest
+
+from async_sender import LocalSMTPSink
+from email_system import EmailSystem
+
+
+@pytest.fixture
+def smtp_sink():
+    """A LocalSMTPSink on its own event loop thread; ``messages`` holds what it accepted"""
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    sink = asyncio.run_coroutine_threadsafe(LocalSMTPSink().start(), loop).result()
+    try:
+        yield sink
+    finally:
+        asyncio.run_coroutine_threadsafe(sink.stop(), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+        loop.close()
+
+
+@pytest.fixture
+def smtp_config(smtp_sink):
+    return {'smtp_server': '127.0.0.1', 'smtp_port': smtp_sink.port, 'smtp_username': 'me@example.com',
+            'smtp_password': '', 'use_tls': False}
+
+
+def make_email_system(emails, cls=EmailSystem):
+    """An EmailSystem with one row per address and a one-line template"""
+    email_system = cls(None)
+    email_system.resume_link = 'https://example.com/resume'
+    email_system.data = pd.DataFrame({'Company': [f"Company {i}" for i in range(len(emails))], 'Email': emails})
+    email_system.template = "Subject: Hello [Company Name]\nDear [Company Name],\n\nHello.\n"
+    return email_system
+
+
+def delivered_to(sink):
+    """Recipients of the messages a sink accepted, in order"""
+    return [rcpt for _, rcpt_to, _ in sink.messages for rcpt in rcpt_to]
@@ -0,0 +1,153 @@
+"""
+Chunked dataset loading.
+
+Recipient spreadsheets are read in bounded chunks (openpyxl read-only mode
+for .xlsx, pandas' chunked reader for CSV) and each chunk is cleaned once,
+so memory stays flat however large the file is and sending can start
+before the whole file has been parsed.
+"""
+import os
+
+import pandas as pd
+
+DEFAULT_CHUNK_ROWS = 5000
+
+# Cell values that count as empty once everything is text
+EMPTY_VALUES = ['nan', 'None', '', '<NA>', 'NaT']
+
+
+def source_name(source):
+    """Best-effort file name for a path or an uploaded file object"""
+    if isinstance(source, (str, os.PathLike)):
+        return os.fspath(source)
+    return getattr(source, 'name', '')
+
+
+def _rewind(source):
+    if hasattr(source, 'seek'):
+        source.seek(0)
+
+
+def clean_chunk(frame):
+    """Normalize column names, turn every cell into text and drop empty rows"""
+    frame.columns = [str(col).strip() for col in frame.columns]
+    frame = frame.astype(str)
+    frame = frame.mask(frame.isin(EMPTY_VALUES))
+    return frame.dropna(how='all')
+
+
+def compact_frame(frame, max_unique_ratio=0.5):
+    """
+    Store repetitive text columns (company names, domains, positions) as
+    categoricals, in place. Columns that are mostly unique, such as email
+    addresses, stay plain strings.
+    """
+    rows = len(frame)
+    if not rows:
+        return frame
+    for col in frame.columns:
+        series = frame[col]
+        is_text = series.dtype == object or isinstance(series.dtype, pd.StringDtype)
+        if is_text and series.nunique(dropna=True) <= rows * max_unique_ratio:
+            frame[col] = series.astype('category')
+    return frame
+
+
+def excel_header(cells):
+    """
+    Column names for a sheet's header row, named and de-duplicated the way
+    pd.read_excel does it: empty cells become 'Unnamed: <position>', and a
+    repeated 'X' becomes 'X.1', 'X.2', ..., skipping names the header
+    already uses. Named columns are numbered before unnamed ones.
+    """
+    header = [f"Unnamed: {idx}" if cell is None or cell == '' else cell for idx, cell in enumerate(cells)]
+    unnamed = [idx for idx, cell in enumerate(cells) if cell is None or cell == '']
+    counts = {}
+    for idx in [idx for idx in range(len(header)) if idx not in unnamed] + unnamed:
+        name = original = header[idx]
+        count = counts.get(name, 0)
+        while count > 0:
+            counts[original] = count + 1
+            name = f"{original}.{count}"
+            count = count + 1 if name in header else counts.get(name, 0)
+        header[idx] = name
+        counts[name] = count + 1
+    return header
+
+
+def iter_excel_chunks(source, chunk_rows=DEFAULT_CHUNK_ROWS):
+    """Yield raw DataFrame chunks from the first sheet of an .xlsx workbook"""
+    from openpyxl import load_workbook
+
+    _rewind(source)
+    workbook = load_workbook(source, read_only=True, data_only=True)
+    try:
+        sheet = workbook.worksheets[0]
+        rows = sheet.iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        header = excel_header(header)
+        buffer = []
+        start = 0
+        for row in rows:
+            buffer.append(row[:len(header)])
+            if len(buffer) >= chunk_rows:
+                yield pd.DataFrame(buffer, columns=header, index=pd.RangeIndex(start, start + len(buffer)))
+                start += len(buffer)
+                buffer = []
+        if buffer:
+            yield pd.DataFrame(buffer, columns=header, index=pd.RangeIndex(start, start + len(buffer)))
+    finally:
+        workbook.close()
+
+
+def iter_csv_chunks(source, chunk_rows=DEFAULT_CHUNK_ROWS):
+    """Yield raw DataFrame chunks from a CSV file"""
+    _rewind(source)
+    with pd.read_csv(source, chunksize=chunk_rows, dtype=str) as reader:
+        for chunk in reader:
+            yield chunk
+
+
+def iter_chunks(source, chunk_rows=DEFAULT_CHUNK_ROWS):
+    """
+    Stream a recipient file as cleaned DataFrame chunks.
+
+    Args:
+        source: Path or file-like object (e.g. a Streamlit upload)
+        chunk_rows (int): Maximum rows per chunk
+
+    Yields:
+        DataFrame: Cleaned chunk with text cells and empty rows removed
+    """
+    name = source_name(source).lower()
+    if name.endswith('.csv'):
+        chunks = iter_csv_chunks(source, chunk_rows)
+    elif name.endswith('.xls'):
+        # Legacy workbooks have no streaming reader; read once and slice
+        _rewind(source)
+        frame = pd.read_excel(source, header=0)
+        chunks = (frame.iloc[start:start + chunk_rows] for start in range(0, len(frame), chunk_rows))
+    else:
+        chunks = iter_excel_chunks(source, chunk_rows)
+    for chunk in chunks:
+        chunk = clean_chunk(chunk)
+        if len(chunk):
+            yield chunk
+
+
+def estimate_rows(source):
+    """Return the number of data rows an .xlsx sheet declares, or None if unknown"""
+    if not source_name(source).lower().endswith('.xlsx'):
+        return None
+    from openpyxl import load_workbook
+
+    _rewind(source)
+    workbook = load_workbook(source, read_only=True)
+    try:
+        max_row = workbook.worksheets[0].max_row
+        return max(0, max_row - 1) if max_row else None
+    finally:
+        workbook.close()
+        _rewind(source)
@@ -0,0 +1,63 @@
+"""
+Parsed-dataset cache shared by the Streamlit app and EmailSystem.
+
+Uploads are keyed by a hash of their content, so every rerun of the app and
+every EmailSystem built from the same file reuse one parsed DataFrame
+instead of parsing the workbook again. Cached frames are shared: treat them
+as read-only.
+"""
+import hashlib
+import os
+
+import pandas as pd
+
+from bounded_cache import BoundedLRU
+from data_loader import compact_frame, iter_chunks, source_name
+
+_HASH_BLOCK = 1 << 20
+
+
+def content_key(source):
+    """Hash a path or file-like object's content together with its file type"""
+    digest = hashlib.blake2b(digest_size=16)
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, 'rb') as fp:
+            for block in iter(lambda: fp.read(_HASH_BLOCK), b''):
+                digest.update(block)
+    elif hasattr(source, 'getvalue'):
+        digest.update(source.getvalue())
+    else:
+        source.seek(0)
+        for block in iter(lambda: source.read(_HASH_BLOCK), b''):
+            digest.update(block)
+        source.seek(0)
+    extension = os.path.splitext(source_name(source))[1].lower()
+    return f"{digest.hexdigest()}{extension}"
+
+
+class DatasetCache(BoundedLRU):
+    """
+    A thread-safe LRU cache of parsed DataFrames bounded by memory.
+
+    Args:
+        max_bytes (int): Evict least recently used frames beyond this total size
+        max_entries (int): Evict least recently used frames beyond this count
+    """
+
+    def __init__(self, max_bytes=512 * 1024 * 1024, max_entries=8):
+        super().__init__(max_entries, max_size=max_bytes,
+                         sizeof=lambda frame: int(frame.memory_usage(deep=True).sum()))
+
+
+DATASET_CACHE = DatasetCache()
+
+
+def read_dataset(source, cache=DATASET_CACHE):
+    """Return the cleaned DataFrame for a file, parsing it only on the first request"""
+    key = content_key(source)
+    frame = cache.get(key)
+    if frame is None:
+        chunks = list(iter_chunks(source))
+        frame = compact_frame(pd.concat(chunks)) if chunks else pd.DataFrame()
+        cache.put(key, frame)
+    return frame
@@ -1,20 +1,148 @@
 import pandas as pd
+import numpy as np
 import os
-from datetime import datetime
-import smtplib
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
-from email.mime.application import MIMEApplication
-from email.mime.base import MIMEBase
-from email import encoders
-import time
-import mimetypes
+import itertools
+from template_engine import BatchRenderer, campaign_template
+from smtp_pool import SendCancelled, SendDispatcher, SMTPConnectionPool
+from smtp_session import wait_with_keepalive
+from mime_fastpath import MessageSkeleton, PreparedMessage, prepare_mime
+from attachment_cache import ATTACHMENT_CACHE
+from parallel_render import iter_rendered, render_items
+from rate_limiter import RateLimiter
+from send_journal import make_campaign_id, normalize_address
+from data_loader import DEFAULT_CHUNK_ROWS, estimate_rows, iter_chunks, source_name
+from dataset_cache import read_dataset
+from validation import RecipientValidator
+from event_log import EventLog
+from metrics import SendMetrics
+from sender_accounts import AccountRouter, SenderAccount
+from domain_scheduler import DomainScheduler, recipient_domain
+from schema import resolve_columns
+
+# Emails shown in full by a test-mode run
+PREVIEW_EVENTS = 5
+
+class Campaign:
+    """
+    A prepared sending run: resolved columns, compiled template and recipients.
+    
+    Recipients come either from a loaded DataFrame (see ``use_frame``) or from
+    a stream of DataFrame chunks (see ``use_chunks``), which are filtered and
+    re-cut into batches as they arrive.
+    """
+
+    def __init__(self, email_col, company_col, template, personalized_cols, batch_size=100, exclude=None,
+                 validator=None, events=None, exclude_reason='already sent'):
+        self.email_col = email_col
+        self.company_col = company_col
+        self.template = template
+        self.personalized_cols = list(personalized_cols)
+        self.batch_size = batch_size
+        self.exclude = exclude
+        self.exclude_reason = exclude_reason
+        self.validator = validator or RecipientValidator()
+        self.events = events or EventLog()
+        self.recipients = None
+        self.total = None
+        self.already_sent = 0
+        self._rows = None
+        self._addresses = None
+        self._columns = None
+        self._chunks = None
+
+    @property
+    def num_batches(self):
+        """Number of batches, or None while the total is unknown"""
+        if self.total is None:
+            return None
+        return (self.total + self.batch_size - 1) // self.batch_size
+
+    @property
+    def columns(self):
+        """The only columns rendering and sending ever read"""
+        names = [self.email_col, self.company_col] + self.personalized_cols
+        return [col for col in dict.fromkeys(names) if col is not None]
+
+    def use_frame(self, frame):
+        """
+        Send to the rows of an in-memory DataFrame.
+        
+        The frame is not copied: matching rows are kept as positions and only
+        the referenced columns of one batch at a time are materialized.
+        """
+        keep, addresses = self.check(frame)
+        self.recipients = frame
+        self._rows = np.flatnonzero(keep)
+        self._addresses = addresses[self._rows]
+        self._columns = [frame.columns.get_loc(col) for col in self.columns if col in frame.columns]
+        self.total = len(self._rows)
+        return self
+
+    def use_chunks(self, chunks, estimated_total=None):
+        """Send to rows streamed from an iterable of DataFrame chunks"""
+        self._chunks = chunks
+        self.total = estimated_total
+        return self
+
+    def check(self, frame):
+        """
+        Validate and de-duplicate the addresses of a frame and drop those in ``exclude``.
+        
+        Returns:
+            tuple: (keep, addresses) arrays of rows to send to and normalized addresses
+        """
+        keep, addresses = self.validator.check(frame, self.email_col)
+        if self.exclude:
+            already_sent = keep & pd.Series(addresses).isin(self.exclude).to_numpy()
+            if already_sent.any():
+                self.events.emit('skipped', f"Skipping {int(already_sent.sum())} recipients {self.exclude_reason} in a previous run",
+                                 count=int(already_sent.sum()), reason=self.exclude_reason)
+                keep = keep & ~already_sent
+                self.already_sent += int(already_sent.sum())
+        return keep, addresses
+
+    def batches(self):
+        """Yield (start_index, batch) slices of the recipients"""
+        if self.recipients is not None:
+            for start in range(0, self.total, self.batch_size):
+                end = start + self.batch_size
+                batch = self.recipients.iloc[self._rows[start:end], self._columns]
+                yield start, batch.assign(**{self.email_col: self._addresses[start:end]})
+            return
+        
+        start = 0
+        pending = None
+        for chunk in self._chunks:
+            keep, addresses = self.check(chunk)
+            chunk = chunk[keep].assign(**{self.email_col: addresses[keep]})
+            pending = chunk if pending is None else pd.concat([pending, chunk])
+            while len(pending) >= self.batch_size:
+                yield start, pending.iloc[:self.batch_size]
+                start += self.batch_size
+                pending = pending.iloc[self.batch_size:]
+        if pending is not None and len(pending):
+            yield start, pending
+
+    @property
+    def renderer(self):
+        """A BatchRenderer for this campaign's template and columns"""
+        return BatchRenderer(self.template, self.email_col, self.company_col, self.personalized_cols)
+
+    def render(self, batch):
+        """Render a batch column-wise into aligned (recipients, subjects, bodies) lists"""
+        return self.renderer.render(batch)
+
 
 class EmailSystem:
     def __init__(self, excel_file):
         self.excel_file = excel_file
         self.data = None
         self.resume_link = None
+        self.rejected = None
+        self.events = EventLog()
+        self.metrics = SendMetrics()
         self.template = """Subject: Application for [Position] in [Company Name]
 
 Dear [Company Name] HR Team,
@@ -36,25 +164,10 @@ Best regards,
     def load_data(self):
         """Load and clean data from Excel file"""
         try:
-            # Read the Excel file
-            xls = pd.ExcelFile(self.excel_file)
-            print(f"Available sheets: {xls.sheet_names}")
-            
-            # Read the first sheet
-            sheet_name = xls.sheet_names[0]
-            print(f"\nReading sheet: {sheet_name}")
-            
-            # Read data with first row as header
-            self.data = pd.read_excel(self.excel_file, sheet_name=sheet_name, header=0)
-            
-            # Clean up column names and handle any leading/trailing spaces
-            self.data.columns = [str(col).strip() for col in self.data.columns]
-            
-            # Convert all data to strings to handle any mixed types
-            self.data = self.data.astype(str)
-            
-            # Remove any empty rows
-            self.data = self.data.replace('nan', '').replace('None', '').replace('', pd.NA).dropna(how='all')
+            # Read the first sheet with the first row as header; files already
+            # parsed in this process (e.g. by the web app) come from the cache
+            print(f"\nReading file: {source_name(self.excel_file)}")
+            self.data = read_dataset(self.excel_file)
             
             print("\nFirst few rows of data:")
             print(self.data.head())
@@ -71,6 +184,10 @@ Best regards,
         except Exception as e:
             print(f"Error loading Excel file: {str(e)}")
 
+    def iter_data(self, chunk_rows=DEFAULT_CHUNK_ROWS):
+        """Stream the Excel/CSV file as cleaned DataFrame chunks without loading it whole"""
+        return iter_chunks(self.excel_file, chunk_rows)
+
     def set_template(self, template=None):
         """Set or update the email template"""
         if template:
@@ -80,55 +197,57 @@ Best regards,
         print(self.template)
         print("-" * 50)
 
-    def attach_file(self, msg, filepath):
-        """Attach a file to the email"""
+    def attach_file(self, msg, filepath, cache=ATTACHMENT_CACHE):
+        """
+        Attach a file to the email
+        
+        The file is read and base64-encoded only once; every later message
+        attaching the same unchanged file reuses the cached encoding.
+        """
         if not os.path.isfile(filepath):
             print(f"Warning: File not found: {filepath}")
             return False
-            
-        # Guess the content type based on the file's extension
-        ctype, encoding = mimetypes.guess_type(filepath)
-        if ctype is None or encoding is not None:
-            ctype = 'application/octet-stream'
-            
-        maintype, subtype = ctype.split('/', 1)
         
         try:
-            with open(filepath, 'rb') as fp:
-                part = MIMEBase(maintype, subtype)
-                part.set_payload(fp.read())
-                encoders.encode_base64(part)
-                
-                # Add header with filename
-                filename = os.path.basename(filepath)
-                part.add_header('Content-Disposition', 'attachment', filename=filename)
-                msg.attach(part)
+            msg.attach(cache.get(filepath).make_part())
             return True
         except Exception as e:
             print(f"Error attaching file {filepath}: {str(e)}")
             return False
 
-    def send_emails(self, smtp_config, test_mode=True, batch_size=100, email_col=None, company_col=None, progress_callback=None):
+    def _prepare_campaign(self, smtp_config, batch_size, email_col=None, company_col=None, exclude=None, stream=False,
+                          resolver=None, suppression=None, interactive=False, exclude_reason='already sent'):
         """
-        Send emails to the companies in batches
+        Resolve columns and compile the template for a sending run
         
         Args:
-            smtp_config (dict): SMTP configuration
-            test_mode (bool): If True, only show previews
-            batch_size (int): Number of emails to send in each batch
-            email_col (str): Name of the column containing email addresses
-            company_col (str): Name of the column containing company names
-            progress_callback (callable): Optional callback for progress updates (0-1)
+            interactive (bool): Ask on the console for a missing resume link or
+                email column; otherwise go without the link and give up
+                without an email column
+            exclude (set): Normalized addresses to leave out, e.g. already sent ones
+            exclude_reason (str): How skipped addresses are described in events
+            stream (bool): Read recipients from the file in chunks instead of self.data
+            resolver (DomainResolver): Optional resolver used to drop domains that cannot receive mail
+            suppression (SuppressionList): Optional list of addresses never to email
+        
+        Returns:
+            Campaign: The recipients to send to, with a total of 0 when every one
+            was excluded; None if the run cannot start, reported as an 'error' event
         """
-        if self.data is None:
-            print("No data loaded. Please load data first.")
-            return
-            
-        if test_mode:
-            print("\n--- TEST MODE - No emails will be sent ---")
-            
+        if stream:
+            # Detect columns from the first chunk; the rest is read while sending
+            chunks = self.iter_data()
+            data = next(chunks, None)
+            if data is None:
+                self.events.emit('error', "No valid email addresses found in the file.")
+                return None
+        else:
+            data = self.data
+        
         # Ask for resume link if not set
-        if not hasattr(self, 'resume_link') or not self.resume_link:
+        if not self.resume_link and not interactive:
+            self.events.emit('info', "No resume link will be included.")
+        elif not self.resume_link:
             self.resume_link = input("\nPlease enter your Google Drive resume link (or press Enter to skip): ").strip()
             if self.resume_link and self.resume_link.startswith(('http://', 'https://')):
                 print("Resume link added.")
@@ -139,74 +258,40 @@ Best regards,
                 print("No resume link will be included.")
         
         # Display available columns and get user input for mapping
-        print("\nAvailable columns in your Excel file:")
-        for idx, col in enumerate(self.data.columns):
-            print(f"{idx + 1}. {col}")
-        
-        # Auto-detect columns based on common patterns
-        email_col = None
-        company_col = None
-        
-        # First, try exact matches for known column names
-        for col in self.data.columns:
-            col_lower = str(col).lower()
-            if col_lower in ['email', 'e-mail', 'email address']:
-                email_col = col
-            elif col_lower in ['org. name', 'org name', 'organization', 'company', 'company name']:
-                company_col = col
-        
-        # If not found, try partial matches
-        if email_col is None or company_col is None:
-            for col in self.data.columns:
-                col_lower = str(col).lower()
-                if email_col is None and 'mail' in col_lower:
-                    email_col = col
-                if company_col is None and ('org' in col_lower or 'company' in col_lower):
-                    company_col = col
-        
-        # If still not found, use first column for company name and look for email
-        if company_col is None and len(self.data.columns) > 0:
-            company_col = self.data.columns[0]
-            
-        if email_col is None and len(self.data.columns) > 1:
-            # Look for any column that looks like an email
-            for col in self.data.columns[1:]:
-                if self.data[col].astype(str).str.contains('@').any():
-                    email_col = col
-                    break
+        if interactive:
+            print("\nAvailable columns in your Excel file:")
+            for idx, col in enumerate(data.columns):
+                print(f"{idx + 1}. {col}")
+        
+        # Explicit column choices are kept; missing ones are inferred from a
+        # sample of the rows, once per dataset
+        try:
+            email_col, company_col = resolve_columns(data, email_col, company_col)
+        except KeyError as e:
+            self.events.emit('error', str(e.args[0]))
+            return None
         
         # If we still don't have both, ask the user
+        if email_col is None and not interactive:
+            self.events.emit('error', "Could not detect the column containing email addresses.")
+            return None
         if email_col is None or company_col is None:
             print("\nCould not automatically detect all required columns.")
             
         if email_col is None:
             print("\nPlease select the column containing email addresses:")
-            for idx, col in enumerate(self.data.columns):
+            for idx, col in enumerate(data.columns):
                 print(f"{idx + 1}. {col}")
             email_col_idx = int(input("Enter the column number: ").strip()) - 1
-            email_col = self.data.columns[email_col_idx]
+            email_col = data.columns[email_col_idx]
         else:
-            print(f"\nUsing column '{email_col}' for email addresses")
+            self.events.emit('info', f"Using column '{email_col}' for email addresses")
             
         if company_col is None:
             print("\nPlease select the column containing company names:")
-            for idx, col in enumerate(self.data.columns):
+            for idx, col in enumerate(data.columns):
                 print(f"{idx + 1}. {col}")
         
-        # Filter out rows without email addresses
-        valid_emails = self.data.dropna(subset=[email_col]).copy()
-        total_emails = len(valid_emails)
-        
-        if total_emails == 0:
-            print("No valid email addresses found in the selected column.")
-            return
-            
-        print(f"\nFound {total_emails} valid email addresses.")
-        print(f"Will send emails in batches of {batch_size}.")
-        
-        # Calculate number of batches
-        num_batches = (total_emails + batch_size - 1) // batch_size
-        
         # User details should be provided in the template by Streamlit
         user_details = smtp_config.get('user_details', {})
         
@@ -216,170 +301,678 @@ Best regards,
         # If additional columns are provided in smtp_config, use them
         if 'additional_cols' in smtp_config:
             additional_cols = smtp_config['additional_cols']
-            print(f"Using {len(additional_cols)} additional columns for personalization")
+            self.events.emit('info', f"Using {len(additional_cols)} additional columns for personalization")
         
-        # Ask for confirmation before starting
-        if not test_mode:
+        # Parse the template once for the whole campaign; sender details are
+        # folded in up front and only per-recipient placeholders stay as slots
+        compiled_template, personalized_cols = campaign_template(
+            self.template,
+            user_details=user_details,
+            resume_link=self.resume_link,
+            additional_cols=additional_cols
+        )
+        
+        campaign = Campaign(
+            email_col, company_col, compiled_template, personalized_cols,
+            batch_size=batch_size,
+            exclude=exclude,
+            validator=RecipientValidator(resolver, suppression),
+            events=self.events,
+            exclude_reason=exclude_reason
+        )
+        self.rejected = campaign.validator.rejected
+        if stream:
+            campaign.use_chunks(itertools.chain([data], chunks), estimated_total=estimate_rows(self.excel_file))
+            self.events.emit('info', "Streaming recipients from the file while sending.")
+        else:
+            # Filter out rows without email addresses
+            campaign.use_frame(data)
+            self._report_rejected(campaign)
+            if campaign.total == 0 and campaign.already_sent:
+                self.events.emit('done', f"Every recipient was {campaign.exclude_reason} in a previous run.")
+                return campaign
+            if campaign.total == 0:
+                self.events.emit('error', "No valid email addresses found in the selected column.")
+                return None
+            self.events.emit('info', f"Found {campaign.total} valid email addresses.", total=campaign.total)
+        self.events.emit('info', f"Will send emails in batches of {batch_size}.")
+        return campaign
+
+    def _report_rejected(self, campaign):
+        """Keep and print the rows validation dropped so far"""
+        self.rejected = campaign.validator.rejected
+        summary = campaign.validator.summary()
+        if summary:
+            details = ", ".join(f"{count} {reason}" for reason, count in summary.items())
+            self.events.emit('skipped', f"Rejected {len(self.rejected)} rows before sending ({details})",
+                             count=len(self.rejected), reasons=summary)
+
+    def build_message(self, smtp_config, recipient, subject, body, attachments=()):
+        """Create the MIME message for a single recipient, with optional attachment file paths"""
+        msg = MIMEMultipart()
+        msg['From'] = smtp_config['smtp_username']
+        msg['To'] = recipient
+        msg['Subject'] = subject
+        
+        # Add the email body
+        msg.attach(MIMEText(body, 'plain'))
+        for filepath in attachments:
+            self.attach_file(msg, filepath)
+        return msg
+
+    def _load_attachments(self, attachments):
+        """Encode every attachment up front; returns None if one is missing or unreadable"""
+        attachments = list(attachments or ())
+        for filepath in attachments:
             try:
-                print(f"\n{'='*50}")
-                print(f"Connecting to SMTP server {smtp_config['smtp_server']}:{smtp_config.get('smtp_port', 587)}...")
-                server = smtplib.SMTP(smtp_config['smtp_server'], smtp_config.get('smtp_port', 587), timeout=30)
-                server.ehlo()
-                server.starttls()
-                server.ehlo()
-                print("Logging in to SMTP server...")
-                server.login(smtp_config['smtp_username'], smtp_config['smtp_password'])
-                print("Successfully connected to SMTP server")
-                print("="*50 + "\n")
-            except Exception as e:
-                print(f"Error connecting to SMTP server: {str(e)}")
-                if server:
-                    try:
-                        server.quit()
-                    except:
-                        pass
-                return
+                attachment = ATTACHMENT_CACHE.get(filepath)
+            except OSError as e:
+                self.events.emit('error', f"Cannot attach {filepath}: {str(e)}")
+                return None
+            self.events.emit('info', f"Attaching {attachment.filename} ({attachment.size / 1024:.0f} KB) to every email")
+        return attachments
+
+    def _rendered_batches(self, campaign, skeleton=None, render_workers=None):
+        """Yield (start_index, items) for every batch, rendered inline or on a process pool"""
+        if render_workers and render_workers > 1:
+            yield from iter_rendered(campaign.batches(), campaign.renderer, skeleton,
+                                     workers=render_workers, metrics=self.metrics)
+            return
+        renderer = campaign.renderer
+        for start_idx, batch in campaign.batches():
+            with self.metrics.time('render'):
+                items = render_items(renderer, None, batch)
+            yield start_idx, items
+
+    def prepare_message(self, smtp_config, recipient, subject, body, skeleton=None, attachments=()):
+        """
+        Return the message to send to one recipient: wire-ready bytes from the
+        campaign's MessageSkeleton when possible, otherwise a regular MIME message
+        """
+        if skeleton is not None:
+            prepared = skeleton.render(recipient, subject, body)
+            if prepared is not None:
+                return prepared
+        return self.build_message(smtp_config, recipient, subject, body, attachments)
+
+    def send_emails(self, smtp_config, test_mode=True, batch_size=100, email_col=None, company_col=None, progress_callback=None,
+                    delay_between_emails=2, delay_between_batches=15, rate_limits=None,
+                    journal=None, campaign_id=None, resume=True, stream=False, resolver=None,
+                    suppression=None, suppress_after_send=False, cancel_event=None, metrics_file=None,
+                    fast_mime=True, attachments=None, render_workers=None, accounts=None, quota_store=None,
+                    balance='least_used', domain_limits=None, interactive=False):
+        """
+        Send emails to the companies in batches
         
-        def update_progress(progress):
-            if callable(progress_callback):
-                try:
-                    progress_callback(progress)
-                except Exception as e:
-                    print(f"Error in progress callback: {e}")
+        Args:
+            smtp_config (dict): SMTP configuration
+            test_mode (bool): If True, only render; the first PREVIEW_EVENTS emails
+                are emitted as 'preview' events
+            batch_size (int): Number of emails to send in each batch
+            email_col (str): Name of the column containing email addresses
+            company_col (str): Name of the column containing company names
+            progress_callback (callable): Optional callback for progress updates (0-1)
+            delay_between_emails (float): Minimum seconds between two sends
+            delay_between_batches (float): Seconds to pause between batches
+            rate_limits (dict): Optional send caps: 'per_minute' paces sending, while
+                'per_hour' and 'per_day' are the hourly and daily quotas of every
+                account that doesn't set its own
+            journal (SendJournal): Optional journal recording every accepted message
+            campaign_id (str): Journal key for this campaign; derived from the sender and template by default
+            resume (bool): Skip recipients the journal already lists as sent for this campaign
+            stream (bool): Read recipients from the file in chunks while sending instead of
+                using the loaded data, so the first email goes out before the file is fully parsed
+            resolver (DomainResolver): Optional resolver used to drop domains that cannot receive mail
+            suppression (SuppressionList): Addresses never to email (opt-outs, bounces, earlier contacts)
+            suppress_after_send (bool): Add every recipient to the suppression list once sent
+            cancel_event (threading.Event): Stop once this is set; emails already being
+                sent are finished, those still waiting on the rate limiter are not sent
+            metrics_file (str): Write Prometheus-format metrics to this file after every batch
+            fast_mime (bool): Assemble wire bytes from a per-campaign message skeleton
+                instead of building and flattening a MIME tree per recipient
+            attachments (list): Paths of files to attach to every email; each is
+                read and encoded once for the whole campaign
+            render_workers (int): Render and serialize batches on this many worker
+                processes, feeding them in order to the sender; rendering runs
+                inline when unset or 1
+            accounts (list): Sender accounts to spread the campaign over; each entry
+                overrides smtp_config keys (e.g. 'smtp_username', 'smtp_password')
+                and may set 'daily_quota', 'hourly_quota' and 'weight'. By default
+                everything is sent from smtp_config alone
+            quota_store (QuotaStore): Persists per-account usage so quotas hold across runs
+            balance (str): How recipients are spread over accounts: 'least_used',
+                'round_robin' or 'fill_first'
+            domain_limits (dict): Optional per receiving domain caps: 'max_in_flight'
+                messages at once, 'per_minute' messages and a 'burst' allowance.
+                Domains always take turns within a batch, so a list sorted by
+                company doesn't hit one receiver with a long run of messages.
+                The caps are ignored in test mode, which sends nothing
+            interactive (bool): Prompt on the console for a missing resume link or
+                email column instead of going without or giving up
         
-        # Process emails in batches
-        for batch_num in range(num_batches):
-            start_idx = batch_num * batch_size
-            end_idx = min((batch_num + 1) * batch_size, total_emails)
-            batch = valid_emails.iloc[start_idx:end_idx]
+        Sending stops once every account has used up its quota; a later run
+        with the journal picks up the remaining recipients.
+        
+        Addresses are validated, normalized and de-duplicated before sending;
+        rejected rows are left in self.rejected. Stage timings and counters for
+        the run are kept in self.metrics.
+        
+        Returns:
+            str: How the run ended, named after its final event: 'done',
+            'cancelled', 'quota' (every account used up its quota) or 'error'
+            (the run could not start, e.g. the SMTP login was refused). Emails
+            that fail one by one are 'failed' events and don't change it
+        """
+        events = self.events
+        if self.data is None and not stream:
+            events.emit('error', "No data loaded. Please load data first.")
+            return 'error'
             
-            print(f"\nProcessing batch {batch_num + 1}/{num_batches} ({len(batch)} emails)")
+        if test_mode:
+            events.emit('info', "--- TEST MODE - No emails will be sent ---")
             
-            # Update progress at start of batch
-            if progress_callback:
-                update_progress(start_idx / total_emails)
+        # Look up who a previous run of this campaign already reached
+        already_sent = None
+        if journal is not None and not test_mode:
+            campaign_id = campaign_id or make_campaign_id(smtp_config.get('smtp_username'), self.template)
+            if resume:
+                already_sent = journal.completed(campaign_id)
+        else:
+            journal = None
+        
+        metrics = self.metrics
+        metrics.reset()
+        with metrics.time('prepare'):
+            campaign = self._prepare_campaign(smtp_config, batch_size, email_col, company_col,
+                                              exclude=already_sent, stream=stream, resolver=resolver,
+                                              suppression=suppression, interactive=interactive)
+        if campaign is None:
+            return 'error'
+        if campaign.total == 0:
+            return 'done'
+        total_emails = campaign.total
+        num_batches = campaign.num_batches or '?'
+        
+        attachments = self._load_attachments(attachments)
+        if attachments is None:
+            return 'error'
+        
+        # Every sender account gets its own connections, pacing and message
+        # skeleton; the router picks the account for each recipient. Test
+        # mode sends nothing, so it needs neither accounts nor credentials
+        senders = [] if test_mode else [SenderAccount.from_settings(smtp_config, account, rate_limits)
+                                         for account in accounts or [{}]]
+        router = AccountRouter(senders, quota_store, strategy=balance) if senders else None
+        metrics.limiter = router
+        if router:
             
-            # Process each email in the current batch
-            for idx, (_, row) in enumerate(batch.iterrows(), 1):
-                try:
-                    # Update progress before each email
-                    if progress_callback:
-                        current_progress = (start_idx + idx - 1) / total_emails
-                        update_progress(current_progress)
+            def record_retry(recipient, attempt, error):
+                metrics.incr('retried')
+                events.emit('retry', f"Retrying {recipient} (attempt {attempt + 1}): {str(error)}",
+                            recipient=recipient, attempt=attempt, error=str(error))
+            
+            def make_record_sent(account):
+                def record_sent(recipient):
+                    router.record_sent(account)
+                    metrics.incr('sent')
+                    if journal:
+                        journal.record(campaign_id, recipient)
+                    if suppression is not None and suppress_after_send:
+                        suppression.add(recipient, 'contacted')
+                return record_sent
+            
+            try:
+                for account in senders:
+                    # Pace sends to avoid being flagged as spam; the limiter also
+                    # backs off on its own when the relay starts throttling
+                    account.limiter = RateLimiter.from_settings(delay_between_emails, rate_limits)
+                    # Constant message parts are serialized once for the whole campaign
+                    if fast_mime:
+                        account.skeleton = MessageSkeleton(account.name, attachments=[
+                            ATTACHMENT_CACHE.get(path) for path in attachments
+                        ])
                     
-                    company_email = str(row[email_col]).strip()
-                    company_name = str(row[company_col]).strip()
+                    # Open the SMTP connection pool before starting
+                    config = account.smtp_config
+                    pool_size = config.get('pool_size', 1)
+                    events.emit('info', f"Connecting to SMTP server {config['smtp_server']}:{config.get('smtp_port', 587)} "
+                                        f"as {account.name} with {pool_size} connection(s)...")
+                    account.pool = SMTPConnectionPool(config, size=pool_size)
+                    account.pool.open()
+                    account.dispatcher = SendDispatcher(account.pool, limiter=account.limiter,
+                                                        on_sent=make_record_sent(account), on_retry=record_retry,
+                                                        metrics=metrics, cancel_event=cancel_event)
+                events.emit('info', "Successfully connected to SMTP server")
+            except Exception as e:
+                events.emit('error', f"Error connecting to SMTP server: {str(e)}")
+                for account in senders:
+                    if account.pool:
+                        account.pool.close()
+                return 'error'
+        
+        def update_progress(done):
+            # Progress is unknown while streaming a file without a row count
+            if callable(progress_callback) and (total_emails or done is None):
+                try:
+                    progress_callback(1.0 if done is None else min(done / total_emails, 1.0))
+                except Exception as e:
+                    events.emit('error', f"Error in progress callback: {e}")
+        
+        def report_sent(account, recipient, future):
+            try:
+                retries = future.result()
+                if retries:
+                    events.emit('sent', f"Email sent to {recipient} after {retries} retr{'y' if retries == 1 else 'ies'}",
+                                recipient=recipient, retries=retries, account=account.name)
+                else:
+                    events.emit('sent', f"Email sent to {recipient}", recipient=recipient, retries=0,
+                                account=account.name)
+            except SendCancelled:
+                # Never sent; a resumed run picks the recipient up
+                router.release(account)
+            except Exception as e:
+                router.release(account)
+                metrics.incr('failed')
+                events.emit('failed', f"Error sending email to {recipient}: {str(e)}", recipient=recipient, error=str(e))
+                if journal:
+                    journal.record(campaign_id, recipient, 'failed', str(e))
+        
+        def report_completed(wait=False):
+            for account in senders:
+                for recipient, future in account.dispatcher.completed(wait=wait):
+                    report_sent(account, recipient, future)
+        
+        # Render batches ahead of the sender, on worker processes if asked to;
+        # workers can only pre-serialize when every message has the same sender
+        skeleton = senders[0].skeleton if len(senders) == 1 else None
+        rendered = self._rendered_batches(campaign, skeleton, render_workers)
+        # Test mode keeps the order domains take turns in, but nothing is
+        # sent, so there is nothing to cap
+        scheduler = DomainScheduler() if test_mode else DomainScheduler.from_settings(domain_limits)
+        quota_reached = False
+        try:
+            # Process emails in batches
+            for batch_num, (start_idx, items) in enumerate(rendered):
+                if quota_reached:
+                    break
+                
+                # Add a delay between batches
+                if batch_num > 0 and not test_mode:
+                    events.emit('info', f"Waiting {delay_between_batches} seconds before next batch...")
+                    # Idle sessions are NOOPed during long waits so the
+                    # relay doesn't drop them before the next batch
+                    with metrics.time('batch_wait'):
+                        wait_with_keepalive(router, delay_between_batches, cancel_event)
+                
+                if cancel_event is not None and cancel_event.is_set():
+                    break
+                
+                events.emit('batch_start', f"Processing batch {batch_num + 1}/{num_batches} ({len(items)} emails)",
+                            batch=batch_num + 1, size=len(items))
+                
+                # Update progress at start of batch
+                if progress_callback:
+                    update_progress(start_idx)
+                
+                # Process each email in the current batch, with receiving
+                # domains taking turns
+                scheduled = scheduler.schedule(items, domain_of=lambda item: recipient_domain(item[0]),
+                                               cancel_event=cancel_event)
+                for idx, (domain, (company_email, msg, subject_line, body)) in enumerate(scheduled, 1):
+                    if cancel_event is not None and cancel_event.is_set():
+                        scheduler.release(domain)
+                        break
                     
-                    # Skip if email is not valid
-                    if '@' not in company_email:
-                        print(f"Skipping invalid email: {company_email}")
-                        continue
+                    account = None
+                    submitted = False
+                    try:
+                        # Update progress before each email
+                        if progress_callback:
+                            update_progress(start_idx + idx - 1)
                         
-                    # Personalize the template with company information
-                    email_content = self.template
-                    
-                    # Replace company information from Excel
-                    email_content = email_content.replace('[Company Name]', company_name)
-                    for col, placeholder in additional_cols.items():
-                        if col in row and pd.notna(row[col]):
-                            email_content = email_content.replace(f'[{placeholder}]', str(row[col]))
+                        if test_mode:
+                            # Only the first few emails are shown in full; the
+                            # rest are rendered and counted
+                            metrics.incr('previewed')
+                            if metrics.counters['previewed'] <= PREVIEW_EVENTS:
+                                events.emit('preview', f"Preview for {company_email}: {subject_line}\n\n{body}",
+                                            recipient=company_email, subject=subject_line, body=body)
                         else:
-                            email_content = email_content.replace(f'[{placeholder}]', '')
-                    
-                    # Replace user details and resume link
-                    for key, value in user_details.items():
-                        email_content = email_content.replace(f'[{key}]', value)
-                    
-                    # Add resume link if available
-                    if hasattr(self, 'resume_link') and self.resume_link:
-                        email_content = email_content.replace('[Resume Link]', self.resume_link)
-                    else:
-                        email_content = email_content.replace('You can find my resume here: [Resume Link]\n\n', '')
-                    
-                    if test_mode:
-                        subject_line = email_content.split('\n')[0]
-                        body = '\n'.join(email_content.split('\n')[1:])
-                        print("\n" + "="*50)
-                        print(f"To: {company_email}")
-                        print(f"Subject: {subject_line}")
-                        print("\n" + body)
-                        print("="*50 + "\n")
-                    else:
-                        # Create the email
-                        msg = MIMEMultipart()
-                        msg['From'] = smtp_config['smtp_username']
-                        msg['To'] = company_email
-                        msg['Subject'] = email_content.split('\n')[0].replace('Subject: ', '')
-                        
-                        # Add the email body
-                        msg.attach(MIMEText("\n".join(email_content.split('\n')[1:]), 'plain'))
-                        
-                        try:
-                            # Send the email
-                            if not test_mode and server:
-                                server.send_message(msg)
-                                print(f"Email sent to {company_email}")
-                            else:
-                                print(f"[TEST MODE] Would send email to {company_email}")
-                                print(f"Subject: {msg['Subject']}")
-                                print("-" * 50)
-                        except Exception as e:
-                            print(f"Error sending email to {company_email}: {str(e)}")
-                            # If there's an error, try to reconnect
-                            if not test_mode and "smtplib.SMTPServerDisconnected" in str(e):
-                                print("Attempting to reconnect to SMTP server...")
-                                try:
-                                    server = smtplib.SMTP(smtp_config['smtp_server'], smtp_config.get('smtp_port', 587))
-                                    server.starttls()
-                                    server.login(smtp_config['smtp_username'], smtp_config['smtp_password'])
-                                    print("Reconnected to SMTP server")
-                                    # Retry sending the email
-                                    server.send_message(msg)
-                                    print(f"Email sent to {company_email} after reconnection")
-                                except Exception as retry_error:
-                                    print(f"Failed to resend to {company_email}: {str(retry_error)}")
-                    
-                    # Add delay to avoid being flagged as spam (only if not in test mode)
-                    if not test_mode:
-                        delay_between_emails = 2
-                        if idx < len(batch):
-                            time.sleep(delay_between_emails)
+                            account = router.choose()
+                            if account is None:
+                                quota_reached = True
+                                break
                             
-                except Exception as e:
-                    print(f"Error sending email to {row[email_col]}: {str(e)}")
-                    continue
-                    
-                # Update progress after each email
-                if progress_callback:
-                    current_progress = (start_idx + idx) / total_emails
-                    update_progress(current_progress)
-        
-            # Add a delay between batches
-            if batch_num < num_batches - 1 and len(batch) > 0:
-                delay_between_batches = 15
-                print(f"Waiting {delay_between_batches} seconds before next batch...")
-                # Update progress during batch delay
-                if progress_callback:
-                    progress = end_idx / total_emails
-                    update_progress(progress)
-                time.sleep(delay_between_batches)
+                            # Create the email unless a render worker already did
+                            if msg is None:
+                                with metrics.time('build_message'):
+                                    msg = self.prepare_message(account.smtp_config, company_email, subject_line,
+                                                               body, account.skeleton, attachments)
+                            
+                            # Hand the email to the sender threads and report
+                            # any sends that have already finished; the domain
+                            # slot is freed once the send is over
+                            future = account.dispatcher.submit(company_email, msg)
+                            submitted = True
+                            future.add_done_callback(lambda _, domain=domain: scheduler.release(domain))
+                            report_completed()
+                                
+                    except Exception as e:
+                        if account is not None and not submitted:
+                            router.release(account)
+                        metrics.incr('failed')
+                        events.emit('failed', f"Error sending email to {company_email}: {str(e)}",
+                                    recipient=company_email, error=str(e))
+                        continue
+                    finally:
+                        if not submitted:
+                            scheduler.release(domain)
+                        
+                    # Update progress after each email
+                    if progress_callback:
+                        update_progress(start_idx + idx)
+                
+                # Wait for the rest of the batch to be delivered
+                if router:
+                    report_completed(wait=True)
+                events.emit('batch_end', f"Finished batch {batch_num + 1}/{num_batches}", batch=batch_num + 1)
+                if metrics_file:
+                    metrics.write_prometheus(metrics_file)
+        finally:
+            rendered.close()
+            # Close SMTP connections at the very end
+            for account in senders:
+                if account.dispatcher:
+                    account.dispatcher.shutdown()
+            if router:
+                reconnects = sum(account.pool.reconnects for account in senders if account.pool)
+                for account in senders:
+                    if account.pool:
+                        account.pool.close()
+                events.emit('info', f"SMTP connections closed ({reconnects} reconnect{'' if reconnects == 1 else 's'} during the run)",
+                            reconnects=reconnects)
+            if metrics_file:
+                metrics.write_prometheus(metrics_file)
+        
+        if stream:
+            self._report_rejected(campaign)
+        
+        snapshot = metrics.snapshot()
+        smtp_latency = snapshot['stages'].get('smtp_send')
+        if smtp_latency:
+            events.emit('info', f"Sent {snapshot['counters'].get('sent', 0)} emails in {snapshot['elapsed_seconds']:.1f}s "
+                                f"({snapshot['messages_per_second']:.2f}/s, SMTP p50 {smtp_latency['p50_seconds'] * 1000:.0f} ms, "
+                                f"p95 {smtp_latency['p95_seconds'] * 1000:.0f} ms, throttled {snapshot['throttled_seconds']:.1f}s)",
+                        metrics=snapshot)
+        
+        if scheduler.waited_seconds >= 1:
+            events.emit('info', f"Per-domain limits held sending back for {scheduler.waited_seconds:.1f}s",
+                        domain_wait_seconds=scheduler.waited_seconds)
+        
+        if router and len(senders) > 1:
+            usage = ", ".join(f"{name} {sent}/{quota or 'unlimited'}" for name, (sent, quota) in router.usage().items())
+            events.emit('info', f"Sent today per account: {usage}", usage=router.usage())
+        
+        if cancel_event is not None and cancel_event.is_set():
+            events.emit('cancelled', "Email sending was cancelled. Emails already handed to the server have been sent.")
+            return 'cancelled'
+        
+        if quota_reached:
+            events.emit('quota', "Every sender account has reached its quota; run the campaign again later "
+                                 "to reach the remaining recipients.", usage=router.usage())
+            return 'quota'
+        
+        if test_mode:
+            events.emit('info', f"Rendered {metrics.counters.get('previewed', 0)} emails without sending; "
+                                f"the first {PREVIEW_EVENTS} are shown in full.")
         
         # Final progress update
         if progress_callback:
-            update_progress(1.0)
+            update_progress(None)
         
-        # Close SMTP connection at the very end
-        if not test_mode and server:
+        events.emit('done', "Email sending process completed!", counts=dict(events.counts))
+        return 'done'
+
+    def spool_emails(self, smtp_config, outbox, batch_size=100, email_col=None, company_col=None,
+                     progress_callback=None, journal=None, campaign_id=None, resume=True, stream=False,
+                     resolver=None, suppression=None, cancel_event=None, fast_mime=True, attachments=None,
+                     render_workers=None):
+        """
+        Render the campaign into an outbox without sending anything
+        
+        This is the render stage of a spooled campaign; deliver_outbox drains
+        the outbox afterwards, or concurrently from other processes. Arguments
+        are those of send_emails, plus:
+        
+        Args:
+            outbox (Outbox): Spool that receives the rendered messages
+        
+        Returns:
+            int: Number of messages written to the outbox
+        """
+        events = self.events
+        if self.data is None and not stream:
+            events.emit('error', "No data loaded. Please load data first.")
+            return 0
+        
+        campaign_id = campaign_id or make_campaign_id(smtp_config.get('smtp_username'), self.template)
+        # Recipients already waiting in or delivered from the outbox are not
+        # spooled twice, even without a journal
+        already_handled = outbox.recipients(campaign_id)
+        if journal is not None and resume:
+            already_handled |= journal.completed(campaign_id)
+        
+        metrics = self.metrics
+        metrics.reset()
+        with metrics.time('prepare'):
+            campaign = self._prepare_campaign(smtp_config, batch_size, email_col, company_col,
+                                              exclude=already_handled, stream=stream, resolver=resolver,
+                                              suppression=suppression, exclude_reason='already sent or spooled')
+        if campaign is None or campaign.total == 0:
+            return 0
+        attachments = self._load_attachments(attachments)
+        if attachments is None:
+            return 0
+        skeleton = MessageSkeleton(smtp_config['smtp_username'], attachments=[
+            ATTACHMENT_CACHE.get(path) for path in attachments
+        ]) if fast_mime else None
+        
+        spooled = 0
+        rendered = self._rendered_batches(campaign, skeleton, render_workers)
+        try:
+            for start_idx, items in rendered:
+                if cancel_event is not None and cancel_event.is_set():
+                    break
+                for company_email, msg, subject_line, body in items:
+                    try:
+                        if msg is None:
+                            with metrics.time('build_message'):
+                                msg = self.prepare_message(smtp_config, company_email, subject_line, body,
+                                                           skeleton, attachments)
+                                if not isinstance(msg, PreparedMessage):
+                                    msg = prepare_mime(msg)
+                        with metrics.time('spool'):
+                            outbox.spool(company_email, msg, campaign_id)
+                    except Exception as e:
+                        metrics.incr('failed')
+                        events.emit('failed', f"Error rendering email to {company_email}: {str(e)}",
+                                    recipient=company_email, error=str(e))
+                        continue
+                    metrics.incr('spooled')
+                    spooled += 1
+                if callable(progress_callback) and campaign.total:
+                    progress_callback(min((start_idx + len(items)) / campaign.total, 1.0))
+        finally:
+            rendered.close()
+        
+        if stream:
+            self._report_rejected(campaign)
+        if cancel_event is not None and cancel_event.is_set():
+            events.emit('cancelled', f"Rendering was cancelled after {spooled} emails.", spooled=spooled)
+        else:
+            events.emit('done', f"Rendered {spooled} emails into the outbox at {outbox.path}", spooled=spooled)
+        return spooled
+
+    def deliver_outbox(self, smtp_config, outbox, progress_callback=None, delay_between_emails=2,
+                       rate_limits=None, journal=None, suppression=None, suppress_after_send=False,
+                       cancel_event=None, metrics_file=None, quota_store=None):
+        """
+        Deliver the messages waiting in an outbox
+        
+        This is the delivery stage of a spooled campaign. Several drainers may
+        run against the same outbox at once; each message is claimed by one.
+        Accepted messages move to done/, failed ones to failed/, from where
+        Outbox.retry_failed queues them again without re-rendering. Messages
+        to recipients the journal already lists as sent move to done/ unsent.
+        
+        Args:
+            smtp_config (dict): SMTP configuration
+            outbox (Outbox): Spool written by spool_emails
+            progress_callback (callable): Optional callback for progress updates (0-1)
+            delay_between_emails (float): Minimum seconds between two sends
+            rate_limits (dict): Optional send caps: 'per_minute' paces sending, while
+                'per_hour' and 'per_day' are quotas of the sending account; delivery
+                stops once one is used up
+            journal (SendJournal): Optional journal recording every accepted message
+            suppression (SuppressionList): Optional list to add recipients to once sent
+            suppress_after_send (bool): Add every recipient to the suppression list once sent
+            cancel_event (threading.Event): Stop claiming messages once this is set
+            metrics_file (str): Write Prometheus-format metrics to this file at the end of the run
+            quota_store (QuotaStore): Persists the account's usage so quotas hold across runs
+        
+        Returns:
+            dict: Number of messages in each outbox state afterwards
+        """
+        events = self.events
+        metrics = self.metrics
+        total_emails = outbox.counts()['new']
+        limiter = RateLimiter.from_settings(delay_between_emails, rate_limits)
+        metrics.reset(limiter)
+        account = SenderAccount.from_settings(smtp_config, rate_limits=rate_limits)
+        router = AccountRouter([account], quota_store)
+        
+        pool_size = smtp_config.get('pool_size', 1)
+        pool = SMTPConnectionPool(smtp_config, size=pool_size)
+        try:
+            events.emit('info', f"Connecting to SMTP server {smtp_config['smtp_server']}:{smtp_config.get('smtp_port', 587)} "
+                                f"with {pool_size} connection(s)...")
+            pool.open()
+        except Exception as e:
+            events.emit('error', f"Error connecting to SMTP server: {str(e)}")
+            pool.close()
+            return outbox.counts()
+        events.emit('info', f"Delivering {total_emails} emails from the outbox at {outbox.path}", total=total_emails)
+        
+        # Recipients the journal lists as sent, loaded once per campaign and
+        # kept up to date as this run delivers
+        completed = {}
+        
+        def already_sent(entry):
+            if journal is None or not entry.campaign_id:
+                return False
+            if entry.campaign_id not in completed:
+                completed[entry.campaign_id] = journal.completed(entry.campaign_id)
+            return normalize_address(entry.recipient) in completed[entry.campaign_id]
+        
+        # Entries travel through the dispatcher in place of the recipient, so
+        # each one is filed as soon as the relay accepts it
+        def record_sent(entry):
+            outbox.mark_done(entry)
+            router.record_sent(account)
+            metrics.incr('sent')
+            if journal and entry.campaign_id:
+                journal.record(entry.campaign_id, entry.recipient)
+                if entry.campaign_id in completed:
+                    completed[entry.campaign_id].add(normalize_address(entry.recipient))
+            if suppression is not None and suppress_after_send:
+                suppression.add(entry.recipient, 'contacted')
+        
+        def record_retry(entry, attempt, error):
+            metrics.incr('retried')
+            events.emit('retry', f"Retrying {entry.recipient} (attempt {attempt + 1}): {str(error)}",
+                        recipient=entry.recipient, attempt=attempt, error=str(error))
+        
+        def report_sent(entry, future):
             try:
-                print("\nClosing SMTP connection...")
-                server.quit()
-                print("SMTP connection closed successfully")
+                future.result()
+                events.emit('sent', f"Email sent to {entry.recipient}", recipient=entry.recipient)
+            except SendCancelled:
+                router.release(account)
+                outbox.release(entry)
             except Exception as e:
-                print(f"Error closing SMTP connection: {str(e)}")
+                router.release(account)
+                metrics.incr('failed')
+                outbox.mark_failed(entry, str(e))
+                events.emit('failed', f"Error sending email to {entry.recipient}: {str(e)}",
+                            recipient=entry.recipient, error=str(e))
+                if journal and entry.campaign_id:
+                    journal.record(entry.campaign_id, entry.recipient, 'failed', str(e))
+            if callable(progress_callback) and total_emails:
+                finished = sum(metrics.counters.get(key, 0) for key in ('sent', 'failed', 'skipped'))
+                progress_callback(min(finished / total_emails, 1.0))
         
-        print("\nEmail sending process completed!")
+        dispatcher = SendDispatcher(pool, limiter=limiter, on_sent=record_sent, on_retry=record_retry,
+                                    metrics=metrics, cancel_event=cancel_event)
+        claimed = outbox.claim()
+        quota_reached = False
+        try:
+            for entry in claimed:
+                if cancel_event is not None and cancel_event.is_set():
+                    outbox.release(entry)
+                    break
+                if router.choose() is None:
+                    quota_reached = True
+                    outbox.release(entry)
+                    break
+                if already_sent(entry):
+                    outbox.mark_done(entry)
+                    metrics.incr('skipped')
+                    events.emit('skipped', f"Not sending to {entry.recipient} again; the journal lists it as sent",
+                                recipient=entry.recipient, reason='already sent')
+                    continue
+                dispatcher.submit(entry, entry.message)
+                for done_entry, future in dispatcher.completed():
+                    report_sent(done_entry, future)
+            for done_entry, future in dispatcher.completed(wait=True):
+                report_sent(done_entry, future)
+        finally:
+            claimed.close()
+            dispatcher.shutdown()
+            pool.close()
+            if metrics_file:
+                metrics.write_prometheus(metrics_file)
+        
+        counts = outbox.counts()
+        if cancel_event is not None and cancel_event.is_set():
+            events.emit('cancelled', "Delivery was cancelled; undelivered emails stay in the outbox.", counts=counts)
+        elif quota_reached:
+            events.emit('quota', "The sender account has reached its quota; undelivered emails stay in the outbox.",
+                        counts=counts, usage=router.usage())
+        else:
+            events.emit('done', f"Outbox drained: {counts['done']} delivered, {counts['failed']} failed", counts=counts)
+        return counts
+
+    async def send_emails_async(self, smtp_config, test_mode=True, **options):
+        """
+        Asynchronous counterpart of send_emails built on asyncio SMTP sessions.
+        
+        Yields one async_sender.SendResult per recipient as it completes; see
+        async_sender.iter_send_results for the supported options.
+        """
+        from async_sender import iter_send_results
+        
+        if self.data is None and not options.get('stream'):
+            self.events.emit('error', "No data loaded. Please load data first.")
+            return
+        
+        async for result in iter_send_results(self, smtp_config, test_mode=test_mode, **options):
+            yield result
 
 if __name__ == "__main__":
+    # Send events are logged; show them on the console
+    import logging
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    
     # Initialize the email system
     excel_file = 'SampleData.xlsx'
     email_system = EmailSystem(excel_file)
@@ -447,6 +1040,6 @@ if __name__ == "__main__":
         smtp_config = {}
     
     # Start sending emails
-    email_system.send_emails(smtp_config, test_mode=test_mode, batch_size=batch_size)
+    email_system.send_emails(smtp_config, test_mode=test_mode, batch_size=batch_size, interactive=True)
     
     print("\nProcess completed. Check the logs above for details.")
@@ -0,0 +1,76 @@
+"""
+Structured send events.
+
+Sending code records what happens (emails sent, skipped, failed or retried,
+batches starting and ending) as events in a bounded ring buffer instead of
+printing. Every event is also passed to the standard ``logging`` module, so
+console output is configured in one place, and readers such as the web app
+only ever look at the tail of the buffer.
+"""
+import itertools
+import logging
+import threading
+import time
+from collections import deque, namedtuple
+
+logger = logging.getLogger('email_system')
+
+Event = namedtuple('Event', ['seq', 'time', 'kind', 'message', 'data'])
+
+# Logging level for each event kind; anything else is logged as INFO
+EVENT_LEVELS = {
+    'failed': logging.ERROR,
+    'error': logging.ERROR,
+    'retry': logging.WARNING,
+    'throttled': logging.WARNING,
+    'skipped': logging.WARNING,
+    'cancelled': logging.WARNING,
+    'quota': logging.WARNING,
+}
+
+
+def format_event(event):
+    """Render an event as a single log line"""
+    return f"{time.strftime('%H:%M:%S', time.localtime(event.time))} {event.message}"
+
+
+class EventLog:
+    """
+    Thread-safe ring buffer of the most recent events of a sending run.
+
+    Args:
+        maxlen (int): Number of events kept; older ones are dropped, but
+            ``counts`` still covers every event ever emitted
+    """
+
+    def __init__(self, maxlen=1000):
+        self._events = deque(maxlen=maxlen)
+        self._seq = itertools.count(1)
+        self._lock = threading.Lock()
+        self.counts = {}
+
+    def emit(self, kind, message, **data):
+        """Record an event and forward it to the 'email_system' logger"""
+        with self._lock:
+            event = Event(next(self._seq), time.time(), kind, message, data)
+            self._events.append(event)
+            self.counts[kind] = self.counts.get(kind, 0) + 1
+        logger.log(EVENT_LEVELS.get(kind, logging.INFO), message, extra={'event': event})
+        return event
+
+    def tail(self, n=50):
+        """The last ``n`` events, oldest first"""
+        with self._lock:
+            if n >= len(self._events):
+                return list(self._events)
+            return list(itertools.islice(self._events, len(self._events) - n, None))
+
+    def since(self, seq):
+        """Events still in the buffer that came after sequence number ``seq``"""
+        with self._lock:
+            return [event for event in self._events if event.seq > seq]
+
+    def clear(self):
+        with self._lock:
+            self._events.clear()
+            self.counts = {}
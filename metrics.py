@@ -0,0 +1,192 @@
+"""
+Send pipeline instrumentation.
+
+``SendMetrics`` records how long each stage of a campaign takes (rendering,
+MIME building, waiting on the rate limiter, SMTP round trips, pauses between
+batches) together with simple counters. A snapshot gives throughput and
+latency percentiles for tuning batch sizes and concurrency, and the same
+numbers can be written as Prometheus text or served over HTTP.
+"""
+import math
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+# Latency samples kept per stage for percentiles; older samples are dropped
+MAX_SAMPLES = 10000
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+def percentile(sorted_values, q):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    rank = min(len(sorted_values) - 1, max(0, math.ceil(q * len(sorted_values)) - 1))
+    return sorted_values[rank]
+
+
+class StageStats:
+    """Count, total time and recent samples of one pipeline stage"""
+
+    def __init__(self, max_samples=MAX_SAMPLES):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.samples = deque(maxlen=max_samples)
+
+    def observe(self, seconds):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        self.samples.append(seconds)
+
+    def snapshot(self):
+        ordered = sorted(self.samples)
+        stats = {
+            'count': self.count,
+            'total_seconds': self.total,
+            'mean_seconds': self.total / self.count if self.count else None,
+            'max_seconds': self.max,
+        }
+        for q in QUANTILES:
+            stats[f"p{int(q * 100)}_seconds"] = percentile(ordered, q)
+        return stats
+
+
+class SendMetrics:
+    """
+    Thread-safe timings and counters for one sending run.
+
+    Args:
+        limiter (RateLimiter): Optional limiter whose throttling totals are reported
+    """
+
+    def __init__(self, limiter=None):
+        self._lock = threading.Lock()
+        self.limiter = limiter
+        self.reset()
+
+    def reset(self, limiter=None):
+        """Start a new run, optionally tracking a new rate limiter"""
+        with self._lock:
+            self.started_at = time.time()
+            self._start = time.perf_counter()
+            self._stages = {}
+            self.counters = {}
+            if limiter is not None:
+                self.limiter = limiter
+
+    def observe(self, stage, seconds):
+        """Record one duration for a stage"""
+        with self._lock:
+            stats = self._stages.get(stage)
+            if stats is None:
+                stats = self._stages[stage] = StageStats()
+            stats.observe(seconds)
+
+    @contextmanager
+    def time(self, stage):
+        """Context manager timing the enclosed block as one sample of ``stage``"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+
+    def incr(self, counter, amount=1):
+        with self._lock:
+            self.counters[counter] = self.counters.get(counter, 0) + amount
+
+    def snapshot(self):
+        """
+        Return the current numbers as a plain dict.
+
+        Keys: 'elapsed_seconds', 'messages_per_second', 'counters',
+        'stages' ({stage: count, totals and p50/p95/p99 seconds}),
+        'throttled_seconds' and 'throttle_events'.
+        """
+        with self._lock:
+            elapsed = time.perf_counter() - self._start
+            counters = dict(self.counters)
+            stages = {name: stats.snapshot() for name, stats in self._stages.items()}
+        sent = counters.get('sent', 0)
+        return {
+            'started_at': self.started_at,
+            'elapsed_seconds': elapsed,
+            'messages_per_second': sent / elapsed if elapsed > 0 else 0.0,
+            'counters': counters,
+            'stages': stages,
+            'throttled_seconds': getattr(self.limiter, 'throttled_seconds', 0.0),
+            'throttle_events': getattr(self.limiter, 'throttle_events', 0),
+        }
+
+    def to_prometheus(self, prefix='email_sender'):
+        """Render the snapshot in the Prometheus text exposition format"""
+        snap = self.snapshot()
+        lines = [
+            f"# HELP {prefix}_messages_total Messages by outcome",
+            f"# TYPE {prefix}_messages_total counter",
+        ]
+        for name, value in sorted(snap['counters'].items()):
+            lines.append(f'{prefix}_messages_total{{outcome="{name}"}} {value}')
+        lines += [
+            f"# HELP {prefix}_messages_per_second Accepted messages per second since the run started",
+            f"# TYPE {prefix}_messages_per_second gauge",
+            f"{prefix}_messages_per_second {snap['messages_per_second']:.6f}",
+            f"# HELP {prefix}_throttled_seconds_total Time the rate limiter held sends back beyond the configured spacing",
+            f"# TYPE {prefix}_throttled_seconds_total counter",
+            f"{prefix}_throttled_seconds_total {snap['throttled_seconds']:.6f}",
+            f"# HELP {prefix}_throttle_events_total Throttling replies from the relay",
+            f"# TYPE {prefix}_throttle_events_total counter",
+            f"{prefix}_throttle_events_total {snap['throttle_events']}",
+            f"# HELP {prefix}_stage_seconds Time spent per pipeline stage",
+            f"# TYPE {prefix}_stage_seconds summary",
+        ]
+        for stage, stats in sorted(snap['stages'].items()):
+            for q in QUANTILES:
+                value = stats[f"p{int(q * 100)}_seconds"]
+                if value is not None:
+                    lines.append(f'{prefix}_stage_seconds{{stage="{stage}",quantile="{q}"}} {value:.6f}')
+            lines.append(f'{prefix}_stage_seconds_sum{{stage="{stage}"}} {stats["total_seconds"]:.6f}')
+            lines.append(f'{prefix}_stage_seconds_count{{stage="{stage}"}} {stats["count"]}')
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path, prefix='email_sender'):
+        """Write the Prometheus text atomically, e.g. for node_exporter's textfile collector"""
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as fp:
+            fp.write(self.to_prometheus(prefix))
+        os.replace(tmp_path, path)
+
+    def serve(self, port=9108, host='127.0.0.1'):
+        """
+        Serve the Prometheus text at http://host:port/metrics from a daemon thread.
+
+        Returns:
+            ThreadingHTTPServer: call ``shutdown()`` on it to stop serving
+        """
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        metrics = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] not in ('/', '/metrics'):
+                    self.send_error(404)
+                    return
+                body = metrics.to_prometheus().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), MetricsHandler)
+        threading.Thread(target=server.serve_forever, name='metrics-http', daemon=True).start()
+        return server
@@ -0,0 +1,156 @@
+"""
+Pre-serialized MIME messages.
+
+Building a ``MIMEMultipart`` per recipient and letting ``smtplib`` flatten it
+through the ``email`` generator dominates the cost of sending short plain-text
+emails. ``MessageSkeleton`` runs the generator once per campaign to produce
+the constant parts of the message (headers, boundary, part headers for both
+charsets, encoded attachments) and then assembles each recipient's wire bytes by slotting in the
+To and Subject headers and the encoded body.
+
+The bytes are identical to what ``smtplib.SMTP.send_message`` would send for
+``EmailSystem.build_message`` with the same boundary, including compat32's
+'>From ' escaping of plain-text bodies and base64 bodies for non-ASCII text.
+Whenever a recipient falls outside what the fast path reproduces exactly
+(non-ASCII or over-long headers, line breaks in headers, non-ASCII
+addresses), ``render`` returns None and the caller uses the regular path.
+"""
+import email.utils
+import random
+import re
+import sys
+from collections import namedtuple
+from email import base64mime
+from email.generator import BytesGenerator
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from io import BytesIO
+
+# Wire-ready message handed to ``sendmail``
+PreparedMessage = namedtuple('PreparedMessage', ['from_addr', 'to_addrs', 'data'])
+
+# Longest header line compat32 writes without folding
+MAX_HEADER_LINE = 78
+
+# What the email generator treats as line breaks and as mbox 'From ' lines
+_NEWLINES = re.compile(r'\r\n|\r|\n')
+_FROM_LINE = re.compile(r'^From ', re.MULTILINE)
+
+# Bare addresses that getaddresses() would return unchanged
+_PLAIN_ADDRESS = re.compile(r"[A-Za-z0-9.!#$%&'*+/=?^_`{|}~-]+@[A-Za-z0-9.-]+")
+
+
+def make_boundary():
+    """A MIME boundary in the email package's own format"""
+    return '=' * 15 + f"{random.randrange(sys.maxsize):019d}" + '=='
+
+
+def smtp_flatten(msg):
+    """Flatten a message exactly as ``smtplib.SMTP.send_message`` does for ASCII addresses"""
+    out = BytesIO()
+    BytesGenerator(out).flatten(msg, linesep='\r\n')
+    return out.getvalue()
+
+
+def prepare_mime(msg):
+    """
+    Serialize a message from ``EmailSystem.build_message`` into a PreparedMessage,
+    taking the envelope from its headers the way ``smtplib.SMTP.send_message`` does
+    """
+    from_addr = email.utils.getaddresses([msg['Sender'] or msg['From']])[0][1]
+    recipients = [value for field in ('To', 'Cc') for value in msg.get_all(field, [])]
+    to_addrs = [address for _, address in email.utils.getaddresses(recipients)]
+    return PreparedMessage(from_addr, to_addrs, smtp_flatten(msg))
+
+
+def _header_line(name, value):
+    """The folded header line, or None if compat32 would fold or encode it"""
+    if not value.isascii() or '\r' in value or '\n' in value:
+        return None
+    line = f"{name}: {value}"
+    if len(line) > MAX_HEADER_LINE:
+        return None
+    return line.encode('ascii') + b'\r\n'
+
+
+class MessageSkeleton:
+    """
+    Per-campaign template of the message built by ``EmailSystem.build_message``.
+
+    Args:
+        from_addr (str): The From header, usually the SMTP username
+        boundary (str): MIME boundary shared by every message of the campaign;
+            a random one is picked by default
+        attachments (list): EncodedAttachment objects attached to every message
+    """
+
+    def __init__(self, from_addr, boundary=None, attachments=()):
+        self.from_header = from_addr
+        self.attachments = list(attachments)
+        self.from_addr = email.utils.getaddresses([from_addr])[0][1]
+        self.boundary = boundary or make_boundary()
+        self.enabled = self.from_addr.isascii() and _header_line('From', from_addr) is not None
+
+        # Let the real generator produce every constant byte once
+        head, _, _ = self._flatten('x@example.com', 's', 'x').partition(b'To: x@example.com\r\n')
+        self._head = head
+        self._delimiter = f"--{self.boundary}".encode('ascii')
+        self._part_heads = {
+            charset: self._part_head(sample)
+            for charset, sample in (('us-ascii', 'x'), ('utf-8', 'é'))
+        }
+        # Everything after the text payload: closing delimiter plus any attachments
+        sample = self._flatten('x@example.com', 's', 'x')
+        text_start = sample.index(self._delimiter + b'\r\n' + self._part_heads['us-ascii'])
+        text_start += len(self._delimiter) + 2 + len(self._part_heads['us-ascii'])
+        self._tail = sample[text_start + 1:]
+
+    def _flatten(self, recipient, subject, body):
+        msg = MIMEMultipart(boundary=self.boundary)
+        msg['From'] = self.from_header
+        msg['To'] = recipient
+        msg['Subject'] = subject
+        msg.attach(MIMEText(body, 'plain'))
+        for attachment in self.attachments:
+            msg.attach(attachment.make_part())
+        return smtp_flatten(msg)
+
+    def _part_head(self, sample_body):
+        """Headers of the text part, from its delimiter line to the blank line"""
+        data = self._flatten('x@example.com', 's', sample_body)
+        start = data.index(self._delimiter + b'\r\n') + len(self._delimiter) + 2
+        end = data.index(b'\r\n\r\n', start) + 4
+        return data[start:end]
+
+    def render(self, recipient, subject, body):
+        """
+        Assemble one recipient's message.
+
+        Returns:
+            PreparedMessage: wire bytes plus envelope addresses, or None when
+            the message has to go through the regular MIME path
+        """
+        if not self.enabled or not recipient.isascii() or ',' in recipient:
+            return None
+        to_line = _header_line('To', recipient)
+        subject_line = _header_line('Subject', subject)
+        if to_line is None or subject_line is None or self.boundary in body:
+            return None
+
+        if body.isascii():
+            part_head = self._part_heads['us-ascii']
+            payload = _FROM_LINE.sub('>From ', body)
+        else:
+            part_head = self._part_heads['utf-8']
+            payload = base64mime.body_encode(body.encode('utf-8'))
+        payload = '\r\n'.join(_NEWLINES.split(payload)).encode('ascii')
+
+        data = b''.join((
+            self._head, to_line, subject_line, b'\r\n',
+            self._delimiter, b'\r\n', part_head, payload, self._tail,
+        ))
+        if _PLAIN_ADDRESS.fullmatch(recipient):
+            to_addrs = [recipient]
+        else:
+            to_addrs = [address for _, address in email.utils.getaddresses([recipient])]
+        return PreparedMessage(self.from_addr, to_addrs, data)
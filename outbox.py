@@ -0,0 +1,223 @@
+"""
+On-disk outbox spool.
+
+Rendering and delivery can run as separate stages: the render stage writes
+finished messages into the outbox at full speed, and any number of drainers
+deliver them at the relay's pace. The layout follows Maildir:
+
+* ``tmp/``     messages being written; moved to ``new/`` once complete
+* ``new/``     rendered messages waiting for delivery
+* ``cur/``     messages claimed by a drainer and being delivered
+* ``done/``    messages the relay accepted
+* ``failed/``  messages that could not be delivered, each with a ``.error`` note
+
+Every move is an atomic rename, so a message is claimed by exactly one
+drainer even when several processes drain the same outbox. Files are plain
+``.eml`` messages exactly as they go on the wire, preceded by one
+``X-Outbox-Envelope`` header carrying the SMTP envelope, so they can be
+inspected with any mail client before anything is sent. Retrying failed
+messages or recovering from a crashed drainer moves files back to ``new/``
+without rendering anything again.
+"""
+import itertools
+import json
+import os
+import socket
+import threading
+import time
+from collections import namedtuple
+
+from mime_fastpath import PreparedMessage
+from send_journal import normalize_address
+
+STATES = ('new', 'cur', 'done', 'failed')
+
+ENVELOPE_HEADER = b'X-Outbox-Envelope: '
+
+# A claimed message ready to be delivered
+OutboxEntry = namedtuple('OutboxEntry', ['name', 'recipient', 'campaign_id', 'message'])
+
+
+class Outbox:
+    """
+    A Maildir-like spool of rendered messages.
+
+    Args:
+        path (str): Outbox directory; created with its subdirectories if missing
+    """
+
+    def __init__(self, path='outbox'):
+        self.path = path
+        for state in ('tmp',) + STATES:
+            os.makedirs(os.path.join(path, state), exist_ok=True)
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+        self._host = socket.gethostname().replace('/', '_').replace('.', '_') or 'localhost'
+
+    def _path(self, state, name):
+        return os.path.join(self.path, state, name)
+
+    def _unique_name(self):
+        # Time first, so listing a directory in name order returns messages
+        # in the order they were spooled
+        with self._lock:
+            count = next(self._counter)
+        return f"{time.time_ns():020d}.P{os.getpid()}Q{count}.{self._host}.eml"
+
+    def spool(self, recipient, message, campaign_id=None):
+        """
+        Write one rendered message to ``new/``.
+
+        Args:
+            recipient (str): The recipient as shown in reports and the journal
+            message (PreparedMessage): Envelope and wire bytes
+            campaign_id (str): Journal key of the campaign the message belongs to
+
+        Returns:
+            str: The message's file name
+        """
+        envelope = json.dumps({
+            'from': message.from_addr,
+            'to': list(message.to_addrs),
+            'recipient': recipient,
+            'campaign': campaign_id,
+        })
+        name = self._unique_name()
+        tmp_path = self._path('tmp', name)
+        with open(tmp_path, 'wb') as fp:
+            fp.write(ENVELOPE_HEADER + envelope.encode('ascii') + b'\r\n')
+            fp.write(message.data)
+        os.rename(tmp_path, self._path('new', name))
+        return name
+
+    def _read(self, state, name):
+        with open(self._path(state, name), 'rb') as fp:
+            envelope = json.loads(fp.readline()[len(ENVELOPE_HEADER):])
+            data = fp.read()
+        message = PreparedMessage(envelope['from'], envelope['to'], data)
+        return OutboxEntry(name, envelope['recipient'], envelope.get('campaign'), message)
+
+    def _names(self, state):
+        return sorted(name for name in os.listdir(os.path.join(self.path, state)) if name.endswith('.eml'))
+
+    def recipients(self, campaign_id, states=('new', 'cur', 'done')):
+        """
+        Return the recipients a campaign already has messages for.
+
+        Only the envelope line of each message is read.
+
+        Args:
+            campaign_id (str): Journal key of the campaign
+            states (tuple): Directories to look in; by default every message
+                that is waiting, being delivered or delivered
+
+        Returns:
+            set: Normalized recipient addresses
+        """
+        recipients = set()
+        for state in states:
+            for name in self._names(state):
+                try:
+                    with open(self._path(state, name), 'rb') as fp:
+                        envelope = json.loads(fp.readline()[len(ENVELOPE_HEADER):])
+                except FileNotFoundError:
+                    # Moved on while listing; states are scanned in the order
+                    # messages move through them, so it is found again later
+                    continue
+                if envelope.get('campaign') == campaign_id:
+                    recipients.add(normalize_address(envelope['recipient']))
+        return recipients
+
+    def claim(self):
+        """
+        Claim waiting messages one at a time, oldest first.
+
+        Yields:
+            OutboxEntry: a message moved to ``cur/``; messages another drainer
+            claims first are skipped
+        """
+        while True:
+            names = self._names('new')
+            if not names:
+                return
+            for name in names:
+                try:
+                    os.rename(self._path('new', name), self._path('cur', name))
+                except FileNotFoundError:
+                    continue
+                # The claim time lets recover() tell abandoned claims apart
+                os.utime(self._path('cur', name))
+                yield self._read('cur', name)
+
+    def mark_done(self, entry):
+        """Move a claimed message to ``done/``"""
+        os.rename(self._path('cur', entry.name), self._path('done', entry.name))
+
+    def mark_failed(self, entry, error=None):
+        """Move a claimed message to ``failed/``, noting why"""
+        with open(self._path('failed', entry.name + '.error'), 'w', encoding='utf-8') as fp:
+            fp.write(f"{error}\n")
+        os.rename(self._path('cur', entry.name), self._path('failed', entry.name))
+
+    def release(self, entry):
+        """Give back a claimed message that was not attempted"""
+        os.rename(self._path('cur', entry.name), self._path('new', entry.name))
+
+    def retry_failed(self):
+        """
+        Queue every failed message for delivery again.
+
+        Returns:
+            int: Number of messages moved back to ``new/``
+        """
+        moved = 0
+        for name in self._names('failed'):
+            try:
+                os.rename(self._path('failed', name), self._path('new', name))
+            except FileNotFoundError:
+                continue
+            try:
+                os.remove(self._path('failed', name + '.error'))
+            except FileNotFoundError:
+                pass
+            moved += 1
+        return moved
+
+    def recover(self, older_than=3600):
+        """
+        Return messages a crashed drainer left claimed to ``new/``.
+
+        Args:
+            older_than (float): Only recover claims at least this many seconds
+                old, so live drainers keep theirs; 0 recovers every claim
+
+        Returns:
+            int: Number of messages moved back to ``new/``
+        """
+        moved = 0
+        cutoff = time.time() - older_than
+        for name in self._names('cur'):
+            try:
+                if os.stat(self._path('cur', name)).st_mtime > cutoff:
+                    continue
+                os.rename(self._path('cur', name), self._path('new', name))
+            except FileNotFoundError:
+                continue
+            moved += 1
+        return moved
+
+    def failures(self):
+        """Return {recipient: error} for the messages in ``failed/``"""
+        failures = {}
+        for name in self._names('failed'):
+            try:
+                entry = self._read('failed', name)
+                with open(self._path('failed', name + '.error'), encoding='utf-8') as fp:
+                    failures[entry.recipient] = fp.read().strip()
+            except FileNotFoundError:
+                continue
+        return failures
+
+    def counts(self):
+        """Return the number of messages in each state"""
+        return {state: len(self._names(state)) for state in STATES}
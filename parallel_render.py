@@ -0,0 +1,117 @@
+"""
+Multi-core rendering for large campaigns.
+
+Rendering the template and serializing messages is pure CPU work. With
+``render_workers`` set, batches of recipient rows are sharded across a
+process pool; each worker renders its batch and assembles the wire bytes
+with the campaign's MessageSkeleton. Results come back in batch order, and
+only a bounded number of batches are in flight, so the sender is fed
+steadily without the whole campaign being rendered into memory ahead of it.
+"""
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+# Per-process state set once by the pool initializer
+_renderer = None
+_skeleton = None
+
+
+def _init_worker(renderer, skeleton):
+    global _renderer, _skeleton
+    _renderer = renderer
+    _skeleton = skeleton
+
+
+def render_items(renderer, skeleton, batch):
+    """
+    Render one batch into (recipient, message, subject, body) tuples.
+
+    ``message`` is the PreparedMessage from the skeleton, or None when the
+    caller has to build the message itself (no skeleton, or the recipient
+    needs the regular MIME path). Subject and body are dropped once the
+    message is prepared, as nothing reads them after that.
+    """
+    recipients, subjects, bodies = renderer.render(batch)
+    if skeleton is None:
+        return list(zip(recipients, [None] * len(recipients), subjects, bodies))
+    items = []
+    for recipient, subject, body in zip(recipients, subjects, bodies):
+        prepared = skeleton.render(recipient, subject, body)
+        if prepared is None:
+            items.append((recipient, None, subject, body))
+        else:
+            items.append((recipient, prepared, None, None))
+    return items
+
+
+def _render_in_worker(batch):
+    return render_items(_renderer, _skeleton, batch)
+
+
+def default_workers():
+    """One worker per core, leaving one for the sender"""
+    return max(1, (os.cpu_count() or 2) - 1)
+
+
+def iter_rendered(batches, renderer, skeleton=None, workers=None, max_pending=None, metrics=None):
+    """
+    Render (start_index, batch) pairs on a process pool, yielding them in order.
+
+    Args:
+        batches (iterable): (start_index, DataFrame) pairs, e.g. Campaign.batches()
+        renderer (BatchRenderer): Renderer for the campaign's template
+        skeleton (MessageSkeleton): Optional skeleton to serialize messages with;
+            skeletons carrying attachments stay in the calling process, because
+            shipping every attachment back from the workers costs more than
+            joining the bytes here
+        workers (int): Worker processes; one per core but one by default
+        max_pending (int): Batches submitted ahead of the consumer; twice the
+            worker count by default
+        metrics (SendMetrics): Optional metrics; time spent waiting for a
+            rendered batch is recorded as the 'render_wait' stage
+
+    Yields:
+        tuple: (start_index, items) with items as returned by ``render_items``
+    """
+    workers = workers or default_workers()
+    max_pending = max_pending or workers * 2
+    worker_skeleton = skeleton if skeleton is not None and not skeleton.attachments else None
+    pending = deque()
+    batches = iter(batches)
+    executor = ProcessPoolExecutor(
+        max_workers=workers,
+        # Spawn rather than fork: the caller may be running other threads
+        mp_context=get_context('spawn'),
+        initializer=_init_worker,
+        initargs=(renderer, worker_skeleton)
+    )
+    try:
+        exhausted = False
+        while True:
+            while not exhausted and len(pending) < max_pending:
+                item = next(batches, None)
+                if item is None:
+                    exhausted = True
+                    break
+                start_idx, batch = item
+                pending.append((start_idx, executor.submit(_render_in_worker, batch)))
+            if not pending:
+                return
+            start_idx, future = pending.popleft()
+            wait_start = time.perf_counter()
+            items = future.result()
+            if metrics is not None:
+                metrics.observe('render_wait', time.perf_counter() - wait_start)
+            if skeleton is not None and worker_skeleton is None:
+                items = [
+                    (recipient, skeleton.render(recipient, subject, body), subject, body)
+                    for recipient, _, subject, body in items
+                ]
+            yield start_idx, items
+    finally:
+        for _, future in pending:
+            future.cancel()
+        executor.shutdown(wait=True)
@@ -0,0 +1,94 @@
+"""
+Incremental previews of rendered emails.
+
+The web app reruns its whole script on every keystroke, so the preview must
+not re-render the dataset each time. ``PreviewCache`` renders only the rows
+on the visible page and memoizes each one per (template version, row); the
+template version is a hash of everything rendering depends on (template
+text, sender details, resume link, column and placeholder mapping). Editing
+the template re-renders just the visible page, and paging back to rows seen
+under the current version costs nothing.
+"""
+import hashlib
+import json
+import threading
+from collections import namedtuple
+
+from bounded_cache import BoundedLRU
+from template_engine import BatchRenderer, campaign_template
+
+PreviewRow = namedtuple('PreviewRow', ['row', 'recipient', 'subject', 'body'])
+
+
+def template_version(template, email_col, company_col, additional_cols=None, user_details=None, resume_link=None):
+    """Hash of everything a rendered email depends on, apart from the row itself"""
+    state = json.dumps([template, email_col, company_col, additional_cols or {}, user_details or {}, resume_link],
+                       sort_keys=True, default=str)
+    return hashlib.blake2b(state.encode('utf-8'), digest_size=16).hexdigest()
+
+
+class PreviewCache:
+    """
+    Rendered preview rows, memoized per template version and row.
+
+    Results are tied to one DataFrame at a time; handing in a different
+    frame (a new upload) starts over.
+
+    Args:
+        max_rows (int): Evict least recently used rendered rows beyond this count
+        max_versions (int): Compiled template versions kept for reuse
+    """
+
+    def __init__(self, max_rows=2000, max_versions=8):
+        self._frame = None
+        self._rows = BoundedLRU(max_rows)
+        self._renderers = BoundedLRU(max_versions)
+        self._lock = threading.Lock()
+        self.rendered = 0
+
+    def _renderer(self, version, template, email_col, company_col, additional_cols, user_details, resume_link):
+        renderer = self._renderers.get(version)
+        if renderer is None:
+            compiled, personalized_cols = campaign_template(template, user_details=user_details,
+                                                            resume_link=resume_link,
+                                                            additional_cols=additional_cols)
+            renderer = BatchRenderer(compiled, email_col, company_col, personalized_cols)
+            self._renderers.put(version, renderer)
+        return renderer
+
+    def page(self, frame, template, email_col, company_col, additional_cols=None, user_details=None,
+             resume_link=None, start=0, count=5):
+        """
+        Render rows ``start`` to ``start + count`` of a frame.
+
+        Args:
+            frame (DataFrame): Recipient rows
+            template (str): Raw template text
+            email_col (str): Column with the recipient addresses
+            company_col (str): Column filling [Company Name]
+            additional_cols (dict): Column -> placeholder for further fields
+            user_details (dict): Sender details keyed by placeholder name
+            resume_link (str): Resume link; the resume line is dropped without one
+            start (int): Position of the first row on the page
+            count (int): Rows per page
+
+        Returns:
+            list: PreviewRow tuples for the rows on the page
+        """
+        version = template_version(template, email_col, company_col, additional_cols, user_details, resume_link)
+        positions = range(max(0, start), min(len(frame), start + count))
+        with self._lock:
+            if frame is not self._frame:
+                self._frame = frame
+                self._rows.clear()
+            rows = {position: self._rows.get((version, position)) for position in positions}
+            missing = [position for position, row in rows.items() if row is None]
+            if missing:
+                renderer = self._renderer(version, template, email_col, company_col, additional_cols,
+                                          user_details, resume_link)
+                recipients, subjects, bodies = renderer.render(frame.iloc[missing])
+                for position, recipient, subject, body in zip(missing, recipients, subjects, bodies):
+                    rows[position] = PreviewRow(position, recipient, subject, body)
+                    self._rows.put((version, position), rows[position])
+                self.rendered += len(missing)
+            return list(rows.values())
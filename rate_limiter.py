@@ -0,0 +1,162 @@
+import logging
+import smtplib
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Reply codes relays use to say "slow down, try again later"
+THROTTLE_CODES = {421, 450, 451, 452}
+
+
+def is_throttle_error(error):
+    """Return True if an SMTP exception is a temporary throttling reply"""
+    code = getattr(error, 'smtp_code', None)
+    if code in THROTTLE_CODES:
+        return True
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return any(code in THROTTLE_CODES for code, _ in error.recipients.values())
+    return False
+
+
+class TokenBucket:
+    """
+    A token bucket that hands out reservations instead of blocking.
+
+    Tokens refill continuously at ``rate`` per second up to ``capacity``.
+    Taking a token may drive the balance negative; the deficit is how long
+    the caller has to wait before its send is allowed.
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now):
+        """Seconds until a whole token is available, without taking it"""
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def reserve(self, now):
+        """Take one token and return how many seconds to wait before using it"""
+        self._refill(now)
+        self.tokens -= 1
+        if self.tokens >= 0:
+            return 0.0
+        return -self.tokens / self.rate
+
+
+class RateLimiter:
+    """
+    Global send-rate limiter consulted before every message.
+
+    Combines a spacing bucket (one send per ``min_interval`` seconds) with an
+    optional per-minute cap. When the relay answers with a throttling code
+    the spacing is slowed down and all sends pause for an exponentially
+    growing back-off; consecutive successes gradually restore the configured
+    rate. Hourly and daily caps are not waited out here: they are sender
+    account quotas (see sender_accounts), which stop the run once used up.
+
+    ``throttled_seconds`` counts only waiting beyond the configured spacing:
+    back-off pauses, slowed-down spacing and the per-minute cap.
+
+    Args:
+        min_interval (float): Minimum seconds between sends, 0 for no spacing
+        per_minute (int): Maximum sends per minute, None for no cap
+        max_backoff (float): Upper bound for a single back-off pause in seconds
+    """
+
+    def __init__(self, min_interval=0, per_minute=None, max_backoff=300):
+        self.min_interval = max(0.0, float(min_interval or 0))
+        self.max_backoff = max_backoff
+        self._lock = threading.Lock()
+        self._spacing = TokenBucket(1.0 / self.min_interval, 1) if self.min_interval else None
+        self._caps = [TokenBucket(per_minute / 60, per_minute)] if per_minute else []
+        self._backoff = 0.0
+        self._paused_until = 0.0
+        self._successes = 0
+        self.throttled_seconds = 0.0
+        self.throttle_events = 0
+
+    @classmethod
+    def from_settings(cls, delay_between_emails=0, rate_limits=None):
+        """Build a limiter from the UI delay setting and an optional caps dict"""
+        rate_limits = rate_limits or {}
+        return cls(
+            min_interval=delay_between_emails,
+            per_minute=rate_limits.get('per_minute'),
+        )
+
+    def reserve(self):
+        """Reserve the next send slot and return the seconds to wait for it"""
+        with self._lock:
+            now = time.monotonic()
+            wait = max(0.0, self._paused_until - now)
+            # The part of the spacing wait the configured interval accounts
+            # for is ordinary pacing, not throttling
+            paced = 0.0
+            if self._spacing:
+                spacing_wait = self._spacing.reserve(now)
+                paced = spacing_wait * self._spacing.rate * self.min_interval
+                wait = max(wait, spacing_wait)
+            for bucket in self._caps:
+                wait = max(wait, bucket.reserve(now))
+            self.throttled_seconds += max(0.0, wait - paced)
+            return wait
+
+    def acquire(self, cancel_event=None):
+        """
+        Block the calling thread until the next send is allowed.
+
+        Args:
+            cancel_event (threading.Event): Stop waiting as soon as this is set
+
+        Returns:
+            bool: False if the wait was cut short by ``cancel_event``
+        """
+        wait = self.reserve()
+        if cancel_event is not None:
+            if wait <= 0:
+                return not cancel_event.is_set()
+            deadline = time.monotonic() + wait
+            if not cancel_event.wait(wait):
+                return True
+            # The rest of the wait never happened, so it isn't throttling either
+            with self._lock:
+                self.throttled_seconds = max(0.0, self.throttled_seconds - max(0.0, deadline - time.monotonic()))
+            return False
+        if wait > 0:
+            time.sleep(wait)
+        return True
+
+    def record_throttle(self):
+        """Back off after the relay answered with a throttling code"""
+        with self._lock:
+            self.throttle_events += 1
+            self._successes = 0
+            self._backoff = min(self.max_backoff, self._backoff * 2 if self._backoff else max(self.min_interval, 1.0) * 5)
+            self._paused_until = max(self._paused_until, time.monotonic() + self._backoff)
+            if self._spacing:
+                self._spacing.rate = max(self._spacing.rate / 2, 1.0 / self.max_backoff)
+            logger.warning("Relay is throttling; pausing sends for %.0f seconds", self._backoff)
+
+    def record_success(self):
+        """Recover towards the configured rate after successful sends"""
+        with self._lock:
+            self._successes += 1
+            if self._successes < 10:
+                return
+            self._successes = 0
+            self._backoff /= 2
+            if self._backoff < 1:
+                self._backoff = 0.0
+            if self._spacing:
+                self._spacing.rate = min(self._spacing.rate * 1.25, 1.0 / self.min_interval)
@@ -0,0 +1,124 @@
+"""
+Column role inference for recipient datasets.
+
+Which column holds the email addresses and which the company names is
+decided from the column names first and, failing that, from a bounded,
+evenly spread sample of rows instead of whole columns. Results are cached
+per dataset fingerprint (column names, row count and a hash of the sampled
+rows), so repeated sends and app reruns on the same data skip inference
+entirely. Explicit column choices always win over inferred ones.
+"""
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+from bounded_cache import BoundedLRU
+
+# Rows looked at when inferring column roles from content
+SAMPLE_ROWS = 1000
+
+# Column names that identify a role outright, lowercased
+EMAIL_NAMES = ('email', 'e-mail', 'email address')
+COMPANY_NAMES = ('org. name', 'org name', 'organization', 'company', 'company name')
+
+ColumnRoles = namedtuple('ColumnRoles', ['email_col', 'company_col'])
+
+
+def sample_frame(frame, rows=SAMPLE_ROWS):
+    """Up to ``rows`` rows spread evenly over the frame, always the same ones for the same frame"""
+    if len(frame) <= rows:
+        return frame
+    positions = np.unique(np.linspace(0, len(frame) - 1, rows).astype(np.int64))
+    return frame.iloc[positions]
+
+
+def fingerprint(frame, sample=None):
+    """Cache key for a frame: its columns, length and a hash of the sampled rows"""
+    sample = sample_frame(frame) if sample is None else sample
+    row_hash = int(pd.util.hash_pandas_object(sample, index=False).sum()) & 0xFFFFFFFFFFFFFFFF
+    return (tuple(str(col) for col in frame.columns), len(frame), row_hash)
+
+
+def infer_roles(frame, sample=None):
+    """
+    Guess the email and company columns of a frame.
+
+    Names are matched exactly, then partially ('mail', 'org', 'company').
+    Without a name match the company is taken from the first column and the
+    email from the later column with the most '@' values in the sample.
+
+    Returns:
+        ColumnRoles: either entry is None if no column qualifies
+    """
+    email_col = None
+    company_col = None
+
+    # First, try exact matches for known column names
+    for col in frame.columns:
+        col_lower = str(col).lower()
+        if col_lower in EMAIL_NAMES:
+            email_col = col
+        elif col_lower in COMPANY_NAMES:
+            company_col = col
+
+    # If not found, try partial matches
+    if email_col is None or company_col is None:
+        for col in frame.columns:
+            col_lower = str(col).lower()
+            if email_col is None and 'mail' in col_lower:
+                email_col = col
+            if company_col is None and ('org' in col_lower or 'company' in col_lower):
+                company_col = col
+
+    # If still not found, use first column for company name
+    if company_col is None and len(frame.columns) > 0:
+        company_col = frame.columns[0]
+
+    # Look for the column whose sampled values look most like addresses
+    if email_col is None and len(frame.columns) > 1:
+        sample = sample_frame(frame) if sample is None else sample
+        best_share = 0.0
+        for col in frame.columns[1:]:
+            share = sample[col].astype(str).str.contains('@', regex=False).mean()
+            if share > best_share:
+                email_col, best_share = col, share
+
+    return ColumnRoles(email_col, company_col)
+
+
+# Inferred ColumnRoles per dataset fingerprint
+SCHEMA_CACHE = BoundedLRU(max_entries=64)
+
+
+def profile(frame, cache=SCHEMA_CACHE):
+    """Return the inferred ColumnRoles of a frame, inferring them only once per dataset"""
+    sample = sample_frame(frame)
+    key = fingerprint(frame, sample)
+    roles = cache.get(key)
+    if roles is None:
+        roles = infer_roles(frame, sample)
+        cache.put(key, roles)
+    return roles
+
+
+def resolve_columns(frame, email_col=None, company_col=None, cache=SCHEMA_CACHE):
+    """
+    Settle the email and company columns for a send.
+
+    Explicit choices are kept as they are; only the missing ones are
+    inferred, and nothing is inferred when both are given.
+
+    Raises:
+        KeyError: if an explicitly chosen column is not in the frame
+    """
+    for col in (email_col, company_col):
+        if col is not None and col not in frame.columns:
+            raise KeyError(f"Column '{col}' is not in the data")
+    if email_col is not None and company_col is not None:
+        return ColumnRoles(email_col, company_col)
+    roles = profile(frame, cache)
+    return ColumnRoles(
+        email_col if email_col is not None else roles.email_col,
+        company_col if company_col is not None else roles.company_col,
+    )
@@ -0,0 +1,93 @@
+import hashlib
+import sqlite3
+import threading
+import time
+
+
+def open_database(path, *schema):
+    """
+    Open a SQLite database in WAL mode for use from several threads.
+
+    Statements run in autocommit mode; callers serialize access with their
+    own lock.
+
+    Args:
+        path (str): Database file, created if missing
+        schema (str): CREATE statements run on every open
+    """
+    conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    for statement in schema:
+        conn.execute(statement)
+    return conn
+
+
+def normalize_address(address):
+    """Normalize an email address for journal and de-duplication lookups"""
+    return str(address).strip().lower()
+
+
+def make_campaign_id(sender, template):
+    """Derive a stable campaign id from the sending account and the raw template"""
+    digest = hashlib.sha1(f"{sender}\0{template}".encode('utf-8')).hexdigest()
+    return digest[:16]
+
+
+class SendJournal:
+    """
+    Durable record of who has been mailed, kept in SQLite (WAL mode).
+
+    Each accepted message is written straight away, keyed by campaign id and
+    normalized recipient address, so an interrupted campaign can be resumed
+    without re-sending. Safe to share between sender threads.
+    """
+
+    def __init__(self, path='send_journal.sqlite3'):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = open_database(
+            path,
+            """CREATE TABLE IF NOT EXISTS sends (
+                campaign_id TEXT NOT NULL,
+                recipient TEXT NOT NULL,
+                status TEXT NOT NULL,
+                detail TEXT,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (campaign_id, recipient)
+            ) WITHOUT ROWID"""
+        )
+
+    def record(self, campaign_id, recipient, status='sent', detail=None):
+        """Record the outcome for one recipient; a recorded 'sent' is never downgraded"""
+        with self._lock:
+            self._conn.execute(
+                'INSERT INTO sends (campaign_id, recipient, status, detail, updated_at) '
+                'VALUES (?, ?, ?, ?, ?) '
+                'ON CONFLICT (campaign_id, recipient) DO UPDATE SET '
+                'status = excluded.status, detail = excluded.detail, updated_at = excluded.updated_at '
+                "WHERE sends.status != 'sent'",
+                (campaign_id, normalize_address(recipient), status, detail, time.time())
+            )
+
+    def completed(self, campaign_id):
+        """Return the set of normalized addresses already sent in a campaign"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT recipient FROM sends WHERE campaign_id = ? AND status = 'sent'",
+                (campaign_id,)
+            )
+            return {recipient for (recipient,) in rows}
+
+    def summary(self, campaign_id):
+        """Return a {status: count} overview of a campaign"""
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT status, COUNT(*) FROM sends WHERE campaign_id = ? GROUP BY status',
+                (campaign_id,)
+            )
+            return dict(rows.fetchall())
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
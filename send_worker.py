@@ -0,0 +1,169 @@
+"""
+Background send worker.
+
+Campaigns run on worker threads owned by the process rather than by a
+Streamlit script run, so the UI only submits a job and polls its state on
+later reruns. Jobs outlive the rerun that created them, several campaigns
+can be queued at once, and stopping a job is a plain event the sender
+checks between emails.
+"""
+import itertools
+import queue
+import threading
+import time
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+# Stopped early because every sender account used up its quota
+QUOTA_REACHED = 'quota_reached'
+
+FINISHED_STATES = (DONE, FAILED, CANCELLED, QUOTA_REACHED)
+
+# Job state for each outcome EmailSystem.send_emails returns
+RUN_OUTCOMES = {'done': DONE, 'error': FAILED, 'cancelled': CANCELLED, 'quota': QUOTA_REACHED}
+
+_job_ids = itertools.count(1)
+
+
+class SendJob:
+    """
+    One campaign submitted to the worker.
+
+    Args:
+        email_system (EmailSystem): Loaded system holding the data and template
+        send_kwargs (dict): Keyword arguments for ``EmailSystem.send_emails``
+        label (str): Optional name shown in the UI
+        on_finished (callable): Called without arguments once the job has
+            finished, however it ended; e.g. to remove its temporary files
+    """
+
+    def __init__(self, email_system, send_kwargs, label=None, on_finished=None):
+        self.id = next(_job_ids)
+        self.email_system = email_system
+        self.send_kwargs = send_kwargs
+        self.label = label or f"Campaign {self.id}"
+        self.on_finished = on_finished
+        self.state = QUEUED
+        self.progress = 0.0
+        self.error = None
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.cancel_event = threading.Event()
+
+    @property
+    def finished(self):
+        return self.state in FINISHED_STATES
+
+    def cancel(self):
+        """Ask the job to stop; a queued job never starts"""
+        self.cancel_event.set()
+
+    def update_progress(self, progress):
+        self.progress = max(0.0, min(float(progress), 1.0))
+
+    def run(self):
+        try:
+            self._run()
+        finally:
+            self.finished_at = time.time()
+            if self.on_finished is not None:
+                try:
+                    self.on_finished()
+                except Exception as e:
+                    self.email_system.events.emit('error', f"Cleaning up after send job {self.id} failed: {str(e)}",
+                                                  error=str(e))
+
+    def _run(self):
+        if self.cancel_event.is_set():
+            self.state = CANCELLED
+            return
+        self.state = RUNNING
+        self.started_at = time.time()
+        try:
+            outcome = self.email_system.send_emails(
+                progress_callback=self.update_progress,
+                cancel_event=self.cancel_event,
+                **self.send_kwargs
+            )
+        except Exception as e:
+            self.error = e
+            self.state = FAILED
+            self.email_system.events.emit('error', f"Send job {self.id} failed: {str(e)}", error=str(e))
+            return
+        if outcome == 'error':
+            # The reason has been reported as the run's last 'error' event
+            errors = [event.message for event in self.email_system.events.tail() if event.kind == 'error']
+            self.error = errors[-1] if errors else "The send run could not start"
+        self.state = RUN_OUTCOMES.get(outcome, DONE)
+
+
+class SendWorker:
+    """
+    Runs send jobs from a queue on daemon threads.
+
+    Args:
+        max_concurrent (int): Number of campaigns sent at the same time
+    """
+
+    def __init__(self, max_concurrent=2):
+        self.max_concurrent = max_concurrent
+        self._queue = queue.Queue()
+        self._jobs = {}
+        self._threads = []
+        self._lock = threading.Lock()
+
+    def _start_threads(self):
+        # Threads are started on the first submit so importing stays cheap
+        while len(self._threads) < self.max_concurrent:
+            thread = threading.Thread(target=self._run, name=f"send-worker-{len(self._threads) + 1}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            try:
+                job.run()
+            finally:
+                self._queue.task_done()
+
+    def submit(self, email_system, label=None, on_finished=None, **send_kwargs):
+        """Queue a campaign and return its SendJob"""
+        job = SendJob(email_system, send_kwargs, label=label, on_finished=on_finished)
+        with self._lock:
+            self._jobs[job.id] = job
+            self._start_threads()
+        self._queue.put(job)
+        return job
+
+    def get(self, job_id):
+        return self._jobs.get(job_id)
+
+    def jobs(self):
+        """All submitted jobs, oldest first"""
+        with self._lock:
+            return list(self._jobs.values())
+
+    def forget(self, job_id):
+        """Drop a finished job from the registry"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None and job.finished:
+                del self._jobs[job_id]
+
+
+_worker = None
+_worker_lock = threading.Lock()
+
+
+def get_worker():
+    """Process-wide worker shared by every Streamlit session"""
+    global _worker
+    with _worker_lock:
+        if _worker is None:
+            _worker = SendWorker()
+        return _worker
@@ -0,0 +1,239 @@
+"""
+Sending a campaign from several mailboxes.
+
+Providers cap how much one mailbox may send per hour and per day. A campaign
+can be spread across several sender accounts, each with its own credentials,
+connections, rate limiter and quotas; an ``AccountRouter`` picks the account
+for every recipient by a balancing strategy and stops handing out an account
+once its quota is used up. Usage is persisted in SQLite by ``QuotaStore`` so
+quotas hold across runs and restarts.
+
+Usage is counted in clock-hour buckets: the hourly quota covers the current
+hour and the daily quota the current hour plus the 23 before it, which
+matches the rolling 24-hour window most providers apply.
+"""
+import threading
+import time
+
+from send_journal import open_database
+
+# How an AccountRouter spreads recipients over accounts
+STRATEGIES = ('least_used', 'round_robin', 'fill_first')
+
+# Keys of an account entry that are quotas, not SMTP settings
+QUOTA_KEYS = ('daily_quota', 'hourly_quota', 'weight')
+
+
+def _hour(now=None):
+    return int((time.time() if now is None else now) // 3600)
+
+
+class QuotaStore:
+    """
+    Persistent per-account send counts, kept in SQLite (WAL mode).
+
+    Safe to share between sender threads.
+    """
+
+    def __init__(self, path='sender_quota.sqlite3'):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = open_database(
+            path,
+            """CREATE TABLE IF NOT EXISTS usage (
+                account TEXT NOT NULL,
+                hour INTEGER NOT NULL,
+                sent INTEGER NOT NULL,
+                PRIMARY KEY (account, hour)
+            ) WITHOUT ROWID"""
+        )
+
+    def record(self, account, count=1):
+        """Count ``count`` sends for an account in the current hour"""
+        with self._lock:
+            self._conn.execute(
+                'INSERT INTO usage (account, hour, sent) VALUES (?, ?, ?) '
+                'ON CONFLICT (account, hour) DO UPDATE SET sent = sent + excluded.sent',
+                (account, _hour(), count)
+            )
+
+    def used(self, account, hours=24):
+        """Return the sends of an account in the current and ``hours - 1`` previous hours"""
+        with self._lock:
+            (sent,) = self._conn.execute(
+                'SELECT COALESCE(SUM(sent), 0) FROM usage WHERE account = ? AND hour > ?',
+                (account, _hour() - hours)
+            ).fetchone()
+            return sent
+
+    def prune(self, keep_hours=24 * 7):
+        """Forget usage older than ``keep_hours``"""
+        with self._lock:
+            self._conn.execute('DELETE FROM usage WHERE hour <= ?', (_hour() - keep_hours,))
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class SenderAccount:
+    """
+    One mailbox a campaign can send from.
+
+    Args:
+        smtp_config (dict): SMTP configuration of the account
+        daily_quota (int): Sends allowed per rolling day, None for no cap
+        hourly_quota (int): Sends allowed per clock hour, None for no cap
+        weight (float): Share of recipients under the 'round_robin' strategy
+    """
+
+    def __init__(self, smtp_config, daily_quota=None, hourly_quota=None, weight=1):
+        self.smtp_config = smtp_config
+        self.name = smtp_config['smtp_username']
+        self.daily_quota = daily_quota or None
+        self.hourly_quota = hourly_quota or None
+        self.weight = max(float(weight or 1), 0.001)
+        self.sent_today = 0
+        self.sent_this_hour = 0
+        # Sends handed out but not yet accepted by the relay
+        self.reserved = 0
+        # Transport state, set up by whoever sends through the account
+        self.limiter = None
+        self.pool = None
+        self.dispatcher = None
+        self.skeleton = None
+
+    @classmethod
+    def from_settings(cls, smtp_config, account=None, rate_limits=None):
+        """
+        Build an account from the campaign's SMTP configuration, overridden by
+        an account entry such as ``{'smtp_username': ..., 'smtp_password': ...,
+        'daily_quota': 500}``. The 'per_hour' and 'per_day' caps of
+        ``rate_limits`` are the quotas of accounts that don't set their own.
+        """
+        rate_limits = rate_limits or {}
+        account = dict(account or {})
+        quotas = {'hourly_quota': rate_limits.get('per_hour'), 'daily_quota': rate_limits.get('per_day')}
+        for key in QUOTA_KEYS:
+            value = account.pop(key, None)
+            if value is not None:
+                quotas[key] = value
+        return cls({**smtp_config, **account}, **quotas)
+
+    def remaining(self):
+        """Sends left before a quota is reached; None when the account has no quota"""
+        left = [quota - used - self.reserved for quota, used in ((self.daily_quota, self.sent_today),
+                                                                 (self.hourly_quota, self.sent_this_hour)) if quota]
+        return max(0, min(left)) if left else None
+
+    def load_usage(self, store):
+        """Start from the usage a QuotaStore has on record"""
+        self.sent_today = store.used(self.name, 24)
+        self.sent_this_hour = store.used(self.name, 1)
+
+
+class AccountRouter:
+    """
+    Picks the sender account for each recipient.
+
+    Strategies:
+        least_used   the account with the smallest share of its quota used,
+                     so every mailbox reaches its cap at about the same time
+        round_robin  accounts in turn, in proportion to their weights
+        fill_first   the first account until its quota is reached, then the next
+
+    Args:
+        accounts (list): SenderAccount objects
+        store (QuotaStore): Optional store to load and persist usage
+        strategy (str): One of STRATEGIES
+    """
+
+    def __init__(self, accounts, store=None, strategy='least_used'):
+        if strategy not in STRATEGIES:
+            raise ValueError(f"Unknown balancing strategy {strategy!r}; expected one of {', '.join(STRATEGIES)}")
+        self.accounts = list(accounts)
+        self.store = store
+        self.strategy = strategy
+        self._lock = threading.Lock()
+        self._hour = _hour()
+        self._credit = {account.name: 0.0 for account in self.accounts}
+        if store is not None:
+            for account in self.accounts:
+                account.load_usage(store)
+
+    def _load(self, account):
+        """Fraction of the tightest quota used; accounts without quotas count as empty"""
+        shares = [(used + account.reserved) / quota
+                  for quota, used in ((account.daily_quota, account.sent_today),
+                                      (account.hourly_quota, account.sent_this_hour)) if quota]
+        return max(shares) if shares else 0.0
+
+    def choose(self):
+        """
+        Reserve one send on the next account.
+
+        Returns:
+            SenderAccount: the account to send from, or None once every quota is used up
+        """
+        with self._lock:
+            hour = _hour()
+            if hour != self._hour:
+                # A new clock hour frees the hourly quotas
+                self._hour = hour
+                for account in self.accounts:
+                    if self.store is not None:
+                        account.load_usage(self.store)
+                    else:
+                        account.sent_this_hour = 0
+            available = [account for account in self.accounts if account.remaining() != 0]
+            if not available:
+                return None
+            if self.strategy == 'fill_first':
+                account = available[0]
+            elif self.strategy == 'round_robin':
+                # Smooth weighted round robin
+                total = sum(account.weight for account in available)
+                for candidate in available:
+                    self._credit[candidate.name] += candidate.weight
+                account = max(available, key=lambda candidate: self._credit[candidate.name])
+                self._credit[account.name] -= total
+            else:
+                # Accounts without quotas are balanced on what they have sent
+                account = min(available, key=lambda candidate: (self._load(candidate),
+                                                                candidate.sent_today + candidate.reserved))
+            account.reserved += 1
+            return account
+
+    def record_sent(self, account):
+        """Count, and persist, one accepted message"""
+        with self._lock:
+            account.reserved = max(0, account.reserved - 1)
+            account.sent_today += 1
+            account.sent_this_hour += 1
+        if self.store is not None:
+            self.store.record(account.name)
+
+    def release(self, account):
+        """Give back a reservation whose message was not accepted"""
+        with self._lock:
+            account.reserved = max(0, account.reserved - 1)
+
+    def keepalive(self, idle_for=0):
+        """NOOP the idle sessions of every account's connection pool"""
+        for account in self.accounts:
+            if account.pool is not None:
+                account.pool.keepalive(idle_for)
+
+    def usage(self):
+        """Return {account: (sent today, daily quota)} for reports"""
+        return {account.name: (account.sent_today, account.daily_quota) for account in self.accounts}
+
+    # Aggregate throttling totals, so the router can stand in for a single
+    # limiter in SendMetrics
+    @property
+    def throttled_seconds(self):
+        return sum(account.limiter.throttled_seconds for account in self.accounts if account.limiter)
+
+    @property
+    def throttle_events(self):
+        return sum(account.limiter.throttle_events for account in self.accounts if account.limiter)
@@ -0,0 +1,194 @@
+import logging
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from mime_fastpath import PreparedMessage
+from rate_limiter import is_throttle_error
+from smtp_session import DEFAULT_TIMEOUT, SMTPSession, is_disconnect
+
+logger = logging.getLogger(__name__)
+
+
+class SendCancelled(Exception):
+    """A queued message was not sent because the run was cancelled"""
+
+
+class SMTPConnectionPool:
+    """
+    A fixed-size pool of self-healing SMTP sessions shared by sender threads.
+
+    Args:
+        smtp_config (dict): SMTP configuration; 'smtp_timeout' sets the socket
+            timeout and 'max_messages_per_connection' how many messages a
+            session sends before it is recycled
+        size (int): Number of sessions
+    """
+
+    def __init__(self, smtp_config, size=1):
+        self.smtp_config = smtp_config
+        self.size = max(1, int(size))
+        self._idle = queue.Queue()
+        self._sessions = []
+        self._lock = threading.Lock()
+
+    def _new_session(self):
+        return SMTPSession(
+            self.smtp_config,
+            timeout=self.smtp_config.get('smtp_timeout', DEFAULT_TIMEOUT),
+            max_messages=self.smtp_config.get('max_messages_per_connection')
+        )
+
+    def open(self):
+        """Connect and log in every session up front"""
+        for _ in range(self.size):
+            session = self._new_session().connect()
+            self._sessions.append(session)
+            self._idle.put(session)
+        return self
+
+    def reconnect(self, session):
+        """Re-establish a dropped session, backing off while the server is unreachable"""
+        return session.reconnect()
+
+    def acquire(self):
+        """Borrow an idle session, waiting until one is free"""
+        return self._idle.get()
+
+    def release(self, session):
+        """Return a borrowed session to the pool"""
+        self._idle.put(session)
+
+    def keepalive(self, idle_for=0):
+        """NOOP every idle session unused for ``idle_for`` seconds"""
+        borrowed = []
+        try:
+            while True:
+                try:
+                    session = self._idle.get_nowait()
+                except queue.Empty:
+                    break
+                borrowed.append(session)
+                try:
+                    session.keepalive(idle_for)
+                except Exception as e:
+                    # The next send reconnects; don't abort the wait for it
+                    logger.warning("SMTP keepalive failed: %s", e)
+        finally:
+            for session in borrowed:
+                self._idle.put(session)
+
+    @property
+    def reconnects(self):
+        return sum(session.reconnects for session in self._sessions)
+
+    def close(self):
+        """Log out of every session"""
+        with self._lock:
+            sessions, self._sessions = self._sessions, []
+        for session in sessions:
+            session.close()
+
+
+class SendDispatcher:
+    """
+    Sends messages over a connection pool from a thread pool.
+
+    Up to ``max_in_flight`` messages are queued or being sent at any time;
+    ``submit`` blocks once that limit is reached so callers never build the
+    whole campaign in memory ahead of the relay. Messages are either
+    ``email.message.Message`` objects or pre-serialized ``PreparedMessage``
+    bytes, which go straight to ``sendmail``. ``on_sent`` is called from
+    the sender thread with the recipient as soon as the relay accepts it, and
+    ``on_retry`` with the recipient, the attempt number and the error before
+    a failed send is retried. With ``metrics`` set, rate limiter waits and
+    SMTP round trips are timed as the 'rate_wait' and 'smtp_send' stages.
+    Once ``cancel_event`` is set, messages still waiting on the rate limiter
+    are not sent; their futures raise SendCancelled.
+    """
+
+    def __init__(self, pool, limiter=None, max_in_flight=None, max_retries=3, on_sent=None, on_retry=None,
+                 metrics=None, cancel_event=None):
+        self.pool = pool
+        self.limiter = limiter
+        self.cancel_event = cancel_event
+        self.metrics = metrics
+        self.on_sent = on_sent
+        self.on_retry = on_retry
+        self.max_retries = max_retries
+        self._executor = ThreadPoolExecutor(max_workers=pool.size, thread_name_prefix='smtp-send')
+        self._slots = threading.BoundedSemaphore(max_in_flight or pool.size * 2)
+        self._pending = deque()
+
+    def _send(self, recipient, msg):
+        """Send one message; returns the number of retries it needed"""
+        try:
+            attempt = 0
+            while True:
+                if self.limiter:
+                    wait_start = time.perf_counter()
+                    if not self.limiter.acquire(self.cancel_event):
+                        raise SendCancelled(recipient)
+                    if self.metrics:
+                        self.metrics.observe('rate_wait', time.perf_counter() - wait_start)
+                server = self.pool.acquire()
+                try:
+                    send_start = time.perf_counter()
+                    if isinstance(msg, PreparedMessage):
+                        server.sendmail(msg.from_addr, msg.to_addrs, msg.data)
+                    else:
+                        server.send_message(msg)
+                except Exception as e:
+                    disconnected = is_disconnect(e)
+                    throttled = is_throttle_error(e)
+                    if attempt >= self.max_retries or not (disconnected or throttled):
+                        raise
+                    if throttled and self.limiter:
+                        self.limiter.record_throttle()
+                    if disconnected:
+                        # Retry over a fresh connection
+                        self.pool.reconnect(server)
+                    error = e
+                else:
+                    if self.metrics:
+                        self.metrics.observe('smtp_send', time.perf_counter() - send_start)
+                    if self.limiter:
+                        self.limiter.record_success()
+                    break
+                finally:
+                    self.pool.release(server)
+                attempt += 1
+                if self.on_retry:
+                    self.on_retry(recipient, attempt, error)
+            # The relay has accepted the message, so a failing callback
+            # (journal or suppression list write) must not turn it into a failure
+            if self.on_sent:
+                try:
+                    self.on_sent(recipient)
+                except Exception:
+                    logger.exception("Recording the send to %s failed", recipient)
+            return attempt
+        finally:
+            self._slots.release()
+
+    def submit(self, recipient, msg):
+        """Queue a message; returns immediately unless too many are in flight"""
+        self._slots.acquire()
+        future = self._executor.submit(self._send, recipient, msg)
+        self._pending.append((recipient, future))
+        return future
+
+    def completed(self, wait=False):
+        """
+        Yield (recipient, future) pairs for finished sends in submission order.
+
+        Args:
+            wait (bool): Block until every pending send has finished
+        """
+        while self._pending and (wait or self._pending[0][1].done()):
+            yield self._pending.popleft()
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
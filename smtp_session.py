@@ -0,0 +1,216 @@
+"""
+Self-healing SMTP sessions.
+
+An ``SMTPSession`` wraps one logged-in ``smtplib.SMTP`` connection and knows
+how to replace it: dropped connections are detected by exception type and
+re-established with exponential backoff (always with EHLO, STARTTLS, login
+and the configured timeout), idle sessions are kept alive with NOOP, and a
+session is recycled proactively after a configurable number of messages,
+before the relay gets a chance to cut it off.
+"""
+import logging
+import random
+import smtplib
+import socket
+import time
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TIMEOUT = 30
+
+# NOOP any session idle for this long while waiting between batches
+KEEPALIVE_INTERVAL = 30
+
+# Reply codes meaning the server is closing or has lost the session
+DISCONNECT_CODES = {421}
+
+
+def open_smtp_connection(smtp_config, timeout=DEFAULT_TIMEOUT):
+    """
+    Open, secure and log in a single SMTP connection.
+
+    STARTTLS is skipped when ``smtp_config['use_tls']`` is False and login
+    when no password is configured, e.g. for a local relay or test sink.
+    """
+    server = smtplib.SMTP(smtp_config['smtp_server'], smtp_config.get('smtp_port', 587), timeout=timeout)
+    try:
+        server.ehlo()
+        if smtp_config.get('use_tls', True):
+            server.starttls()
+            server.ehlo()
+        if smtp_config.get('smtp_password'):
+            server.login(smtp_config['smtp_username'], smtp_config['smtp_password'])
+    except Exception:
+        try:
+            server.close()
+        except Exception:
+            pass
+        raise
+    return server
+
+
+def is_disconnect(error):
+    """Return True if an exception means the SMTP connection is gone"""
+    if isinstance(error, smtplib.SMTPServerDisconnected):
+        return True
+    if isinstance(error, smtplib.SMTPResponseException):
+        return error.smtp_code in DISCONNECT_CODES
+    if isinstance(error, smtplib.SMTPException):
+        return False
+    # Socket-level failures: resets, broken pipes, timeouts
+    return isinstance(error, (OSError, socket.timeout))
+
+
+def is_retryable_connect_error(error):
+    """Connection failures worth retrying; bad credentials or config are not"""
+    if isinstance(error, (smtplib.SMTPAuthenticationError, smtplib.SMTPNotSupportedError)):
+        return False
+    if isinstance(error, smtplib.SMTPConnectError):
+        return True
+    return is_disconnect(error)
+
+
+class SMTPSession:
+    """
+    One SMTP connection that reconnects itself.
+
+    Args:
+        smtp_config (dict): SMTP configuration
+        timeout (float): Socket timeout for every connection attempt
+        max_messages (int): Recycle the connection after this many messages; None never recycles
+        max_reconnect_attempts (int): Connection attempts before giving up
+        backoff_base (float): Seconds before the second attempt; doubles every attempt
+        backoff_max (float): Upper bound for the wait between attempts
+    """
+
+    def __init__(self, smtp_config, timeout=DEFAULT_TIMEOUT, max_messages=None, max_reconnect_attempts=5,
+                 backoff_base=1.0, backoff_max=60.0):
+        self.smtp_config = smtp_config
+        self.timeout = timeout
+        self.max_messages = max_messages
+        self.max_reconnect_attempts = max(1, max_reconnect_attempts)
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.server = None
+        self.messages_sent = 0
+        self.reconnects = 0
+        self.last_used = time.monotonic()
+
+    @property
+    def connected(self):
+        return self.server is not None
+
+    def connect(self):
+        """Open a fresh connection, retrying transient failures with exponential backoff"""
+        self._drop()
+        attempt = 0
+        while True:
+            try:
+                self.server = open_smtp_connection(self.smtp_config, timeout=self.timeout)
+                break
+            except Exception as e:
+                attempt += 1
+                if attempt >= self.max_reconnect_attempts or not is_retryable_connect_error(e):
+                    raise
+                delay = min(self.backoff_max, self.backoff_base * 2 ** (attempt - 1))
+                # Jitter keeps several sessions from reconnecting in lockstep
+                delay *= random.uniform(0.8, 1.2)
+                logger.warning("SMTP connection failed (%s); retrying in %.1f seconds", e, delay)
+                time.sleep(delay)
+        self.messages_sent = 0
+        self.last_used = time.monotonic()
+        return self
+
+    def reconnect(self):
+        """Replace a lost connection"""
+        self.reconnects += 1
+        return self.connect()
+
+    def recycle(self):
+        """Politely close the connection and open a new one"""
+        self._quit()
+        return self.connect()
+
+    def _send(self, method, *args):
+        if self.server is None:
+            self.connect()
+        elif self.max_messages and self.messages_sent >= self.max_messages:
+            self.recycle()
+        try:
+            result = getattr(self.server, method)(*args)
+        except Exception as e:
+            if is_disconnect(e):
+                # Never reuse a broken socket, even if the caller gives up
+                self._drop()
+            raise
+        self.messages_sent += 1
+        self.last_used = time.monotonic()
+        return result
+
+    def send_message(self, msg, from_addr=None, to_addrs=None):
+        """Send a message, opening or recycling the connection first if needed"""
+        return self._send('send_message', msg, from_addr, to_addrs)
+
+    def sendmail(self, from_addr, to_addrs, msg):
+        """Send pre-serialized message bytes, like ``smtplib.SMTP.sendmail``"""
+        return self._send('sendmail', from_addr, to_addrs, msg)
+
+    def keepalive(self, idle_for=0):
+        """
+        NOOP the connection if it has been idle for ``idle_for`` seconds,
+        reconnecting straight away if the server has dropped it.
+        """
+        if self.server is None or time.monotonic() - self.last_used < idle_for:
+            return
+        try:
+            code, _ = self.server.noop()
+            if code in DISCONNECT_CODES:
+                raise smtplib.SMTPServerDisconnected(f"NOOP answered {code}")
+            self.last_used = time.monotonic()
+        except Exception as e:
+            if not is_disconnect(e):
+                raise
+            logger.info("SMTP session dropped while idle; reconnecting")
+            self.reconnect()
+
+    def _quit(self):
+        if self.server is not None:
+            try:
+                self.server.quit()
+            except Exception:
+                pass
+        self._drop()
+
+    def _drop(self):
+        if self.server is not None:
+            try:
+                self.server.close()
+            except Exception:
+                pass
+        self.server = None
+
+    def close(self):
+        """Log out and close the connection"""
+        self._quit()
+
+
+def wait_with_keepalive(pool, seconds, cancel_event=None, interval=KEEPALIVE_INTERVAL):
+    """
+    Wait between batches while keeping the pool's sessions alive.
+
+    Returns:
+        bool: True if ``cancel_event`` was set during the wait
+    """
+    deadline = time.monotonic() + seconds
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return False
+        step = min(remaining, interval)
+        if cancel_event is not None:
+            if cancel_event.wait(step):
+                return True
+        else:
+            time.sleep(step)
+        if pool is not None and deadline - time.monotonic() > 0:
+            pool.keepalive(idle_for=interval)
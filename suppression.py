@@ -0,0 +1,116 @@
+"""
+Persistent suppression list.
+
+Opt-outs, hard bounces and already-contacted addresses are kept on disk and
+excluded from every campaign. Membership is answered from an in-memory set
+of 64-bit address hashes, so lookups are constant time and a million entries
+cost a few tens of megabytes. Two files are kept side by side:
+
+* ``<path>``      tab-separated log of address, reason and time, used for export
+* ``<path>.idx``  packed 64-bit hashes, loaded at start-up without parsing text
+"""
+import csv
+import hashlib
+import os
+import threading
+import time
+from array import array
+
+
+def address_hash(address):
+    """64-bit hash of a normalized address"""
+    normalized = str(address).strip().lower().encode('utf-8')
+    return int.from_bytes(hashlib.blake2b(normalized, digest_size=8).digest(), 'little')
+
+
+class SuppressionList:
+    """
+    Addresses that must never be emailed again.
+
+    Args:
+        path (str): Location of the tab-separated log; the hash index lives at
+            ``path + '.idx'``
+    """
+
+    def __init__(self, path='suppression_list.tsv'):
+        self.path = path
+        self.index_path = path + '.idx'
+        self._lock = threading.Lock()
+        hashes = array('Q')
+        if os.path.exists(self.index_path):
+            with open(self.index_path, 'rb') as fp:
+                hashes.frombytes(fp.read())
+        self._hashes = set(hashes)
+
+    def __len__(self):
+        return len(self._hashes)
+
+    def __contains__(self, address):
+        return address_hash(address) in self._hashes
+
+    def add(self, address, reason='opt-out'):
+        """Suppress one address; returns False if it was already listed"""
+        return self.add_many([address], reason) == 1
+
+    def add_many(self, addresses, reason='opt-out'):
+        """Suppress many addresses in one write; returns how many were new"""
+        now = time.strftime('%Y-%m-%dT%H:%M:%S')
+        new_hashes = array('Q')
+        lines = []
+        with self._lock:
+            for address in addresses:
+                address = str(address).strip().lower()
+                if not address or address == 'nan':
+                    continue
+                key = address_hash(address)
+                if key in self._hashes:
+                    continue
+                self._hashes.add(key)
+                new_hashes.append(key)
+                lines.append(f"{address}\t{reason}\t{now}\n")
+            if lines:
+                with open(self.path, 'a', encoding='utf-8') as fp:
+                    fp.writelines(lines)
+                with open(self.index_path, 'ab') as fp:
+                    new_hashes.tofile(fp)
+        return len(lines)
+
+    def mask(self, addresses):
+        """Return a list of booleans marking which addresses are suppressed"""
+        hashes = self._hashes
+        return [isinstance(a, str) and address_hash(a) in hashes for a in addresses]
+
+    def import_file(self, source, reason='opt-out'):
+        """
+        Bulk-import addresses from a text or CSV file.
+
+        Takes the 'email' column when the file has a header naming one,
+        otherwise the first column of every line.
+        """
+        if isinstance(source, (str, os.PathLike)):
+            with open(source, newline='', encoding='utf-8') as fp:
+                lines = fp.read().splitlines()
+        else:
+            source.seek(0)
+            data = source.read()
+            lines = (data.decode('utf-8') if isinstance(data, bytes) else data).splitlines()
+        rows = list(csv.reader(lines))
+        column = 0
+        if rows:
+            header = [str(cell).strip().lower() for cell in rows[0]]
+            for name in ('email', 'e-mail', 'email address'):
+                if name in header:
+                    column = header.index(name)
+                    rows = rows[1:]
+                    break
+        return self.add_many((row[column] for row in rows if len(row) > column and '@' in row[column]), reason)
+
+    def export(self, target):
+        """Write every suppressed address with its reason and time as CSV"""
+        with open(target, 'w', newline='', encoding='utf-8') as out:
+            writer = csv.writer(out)
+            writer.writerow(['email', 'reason', 'added_at'])
+            if os.path.exists(self.path):
+                with open(self.path, encoding='utf-8') as fp:
+                    for line in fp:
+                        writer.writerow(line.rstrip('\n').split('\t'))
@@ -0,0 +1,173 @@
+import re
+
+# Placeholders look like [Company Name] and never span lines or nest
+PLACEHOLDER_PATTERN = re.compile(r'\[([^\[\]\n]+)\]')
+
+RESUME_LINE = 'You can find my resume here: [Resume Link]\n\n'
+
+
+class CompiledTemplate:
+    """
+    An email template parsed once per campaign.
+
+    The template is split into static text and placeholder slots. Placeholders
+    whose value is the same for every recipient (sender details, resume link)
+    are folded into the static text at compile time, so rendering a row is a
+    single ``str.format`` pass over the per-row values only.
+    """
+
+    def __init__(self, template, constants=None, fields=()):
+        """
+        Args:
+            template (str): Raw template text using [Placeholder] markers
+            constants (dict): Placeholder -> value, identical for all recipients
+            fields (iterable): Placeholders whose value changes per recipient.
+                These take precedence over constants of the same name.
+        """
+        self.template = template
+        self.constants = dict(constants or {})
+        self.fields = tuple(fields)
+
+        field_index = {name: idx for idx, name in enumerate(self.fields)}
+        parts = []
+        last = 0
+        for match in PLACEHOLDER_PATTERN.finditer(template):
+            parts.append(self._escape(template[last:match.start()]))
+            name = match.group(1)
+            if name in field_index:
+                parts.append('{%d}' % field_index[name])
+            elif name in self.constants:
+                parts.append(self._escape(str(self.constants[name])))
+            else:
+                # Unknown placeholders are left in the email untouched
+                parts.append(self._escape(match.group(0)))
+            last = match.end()
+        parts.append(self._escape(template[last:]))
+        self._format = ''.join(parts).format
+
+    @staticmethod
+    def _escape(text):
+        return text.replace('{', '{{').replace('}', '}}')
+
+    def render(self, *values):
+        """Render the full email text from per-row values given in ``fields`` order"""
+        return self._format(*values)
+
+    def render_parts(self, *values):
+        """Render a row and split it into (subject, body)"""
+        return split_subject(self._format(*values))
+
+    def render_frame(self, frame, columns, strip_columns=()):
+        """
+        Render every row of a DataFrame column-wise.
+
+        Args:
+            frame (DataFrame): Recipient rows to render
+            columns (list): Column feeding each entry of ``fields``, in order
+            strip_columns (iterable): Columns whose values are whitespace-stripped
+
+        Returns:
+            tuple: (subjects, bodies) lists aligned with the rows of ``frame``
+        """
+        values = [column_values(frame, col, strip=col in strip_columns) for col in columns]
+        fmt = self._format
+        if values:
+            rendered = [fmt(*row) for row in zip(*values)]
+        else:
+            rendered = [fmt()] * len(frame)
+        subjects = []
+        bodies = []
+        for email_content in rendered:
+            subject_line, body = split_subject(email_content)
+            subjects.append(subject_line)
+            bodies.append(body)
+        return subjects, bodies
+
+
+def column_values(frame, col, strip=False):
+    """Return a DataFrame column as a list of strings, with missing values as ''"""
+    if col is None or col not in frame.columns:
+        return [''] * len(frame)
+    series = frame[col]
+    series = series.astype(object).where(series.notna(), '').astype(str)
+    if strip:
+        series = series.str.strip()
+    return series.tolist()
+
+
+def split_subject(email_content):
+    """Split rendered email text into its subject line and body"""
+    subject_line, _, body = email_content.partition('\n')
+    return subject_line.replace('Subject: ', ''), body
+
+
+def compile_template(template, user_details=None, resume_link=None, fields=()):
+    """
+    Compile an EmailSystem template for a campaign.
+
+    Args:
+        template (str): Raw template text
+        user_details (dict): Sender details keyed by placeholder name
+        resume_link (str): Resume link; when empty the resume line is dropped
+        fields (iterable): Placeholders filled from the recipient data
+    """
+    constants = dict(user_details or {})
+    if resume_link:
+        constants.setdefault('Resume Link', resume_link)
+    elif 'Resume Link' not in constants:
+        template = template.replace(RESUME_LINE, '')
+    return CompiledTemplate(template, constants, fields)
+
+
+def campaign_template(template, user_details=None, resume_link=None, additional_cols=None):
+    """
+    Compile a template for a campaign's recipient columns.
+
+    [Company Name] is always filled from the company column; every entry of
+    ``additional_cols`` (column -> placeholder) adds a field, the first
+    column mapped to a placeholder winning.
+
+    Returns:
+        tuple: (CompiledTemplate, personalized_cols) with the columns filling
+        the fields after [Company Name], in order
+    """
+    placeholders = ['Company Name']
+    personalized_cols = []
+    for col, placeholder in (additional_cols or {}).items():
+        if placeholder not in placeholders:
+            placeholders.append(placeholder)
+            personalized_cols.append(col)
+    compiled = compile_template(template, user_details=user_details, resume_link=resume_link,
+                                fields=placeholders)
+    return compiled, personalized_cols
+
+
+class BatchRenderer:
+    """
+    Renders batches of recipient rows with a compiled template.
+
+    Holds only what rendering needs (no recipient data), so it can be sent
+    to worker processes.
+
+    Args:
+        template (CompiledTemplate): Template compiled for the campaign
+        email_col (str): Column with the recipient addresses
+        company_col (str): Column filling the first template field
+        personalized_cols (list): Columns filling the remaining fields, in order
+    """
+
+    def __init__(self, template, email_col, company_col, personalized_cols=()):
+        self.template = template
+        self.email_col = email_col
+        self.company_col = company_col
+        self.personalized_cols = list(personalized_cols)
+
+    def render(self, batch):
+        """Render a batch column-wise into aligned (recipients, subjects, bodies) lists"""
+        recipients = column_values(batch, self.email_col, strip=True)
+        subjects, bodies = self.template.render_frame(
+            batch,
+            [self.company_col] + self.personalized_cols,
+            strip_columns=(self.company_col,)
+        )
+        return recipients, subjects, bodies
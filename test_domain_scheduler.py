@@ -0,0 +1,63 @@
+"""
+DomainScheduler interleaves receiving domains and holds back capped ones;
+test mode sends nothing, so it never waits on the caps.
+"""
+import threading
+import time
+
+from conftest import make_email_system
+from domain_scheduler import DomainScheduler, recipient_domain
+
+ADDRESSES = ['a1@a.com', 'a2@a.com', 'a3@a.com', 'b1@b.com', 'c1@c.com', 'b2@b.com']
+
+
+def test_recipient_domain():
+    assert recipient_domain(' Bob@Example.COM ') == 'example.com'
+
+
+def test_domains_take_turns():
+    scheduled = [address for _, address in DomainScheduler().schedule(ADDRESSES)]
+    assert scheduled == ['a1@a.com', 'b1@b.com', 'c1@c.com', 'a2@a.com', 'b2@b.com', 'a3@a.com']
+
+
+def test_in_flight_cap_waits_for_release():
+    scheduler = DomainScheduler(max_in_flight=1)
+    scheduled = scheduler.schedule(['a1@a.com', 'a2@a.com'])
+    assert next(scheduled) == ('a.com', 'a1@a.com')
+    timer = threading.Timer(0.1, scheduler.release, ['a.com'])
+    timer.start()
+    start = time.monotonic()
+    assert next(scheduled) == ('a.com', 'a2@a.com')
+    assert time.monotonic() - start >= 0.05
+    assert scheduler.waited_seconds > 0
+
+
+def test_capped_domain_does_not_hold_up_others():
+    scheduler = DomainScheduler(per_minute=1)
+    start = time.monotonic()
+    scheduled = scheduler.schedule(['a1@a.com', 'a2@a.com', 'b1@b.com'])
+    assert [next(scheduled)[1] for _ in range(2)] == ['a1@a.com', 'b1@b.com']
+    assert time.monotonic() - start < 1
+
+
+def test_cancel_stops_waiting_on_a_cap():
+    scheduler = DomainScheduler(per_minute=1)
+    cancel_event = threading.Event()
+    timer = threading.Timer(0.1, cancel_event.set)
+    timer.start()
+    start = time.monotonic()
+    try:
+        scheduled = list(scheduler.schedule(['a1@a.com', 'a2@a.com'], cancel_event=cancel_event))
+    finally:
+        timer.cancel()
+    assert [address for _, address in scheduled] == ['a1@a.com']
+    assert time.monotonic() - start < 5
+
+
+def test_test_mode_ignores_domain_caps():
+    email_system = make_email_system([f"hr{i}@corp.com" for i in range(5)])
+    start = time.monotonic()
+    email_system.send_emails({'smtp_username': 'me@example.com'}, test_mode=True,
+                             domain_limits={'max_in_flight': 1, 'per_minute': 1})
+    assert time.monotonic() - start < 5
+    assert email_system.events.counts.get('preview') == 5
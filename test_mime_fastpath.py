@@ -0,0 +1,93 @@
+"""
+MessageSkeleton must produce exactly the bytes smtplib.SMTP.send_message sends
+for EmailSystem.build_message, or decline so the regular path is used.
+"""
+import smtplib
+
+import pytest
+
+from attachment_cache import ATTACHMENT_CACHE
+from email_system import EmailSystem
+from mime_fastpath import MessageSkeleton
+
+
+class CapturingSMTP(smtplib.SMTP):
+    """Runs send_message's own serialization and keeps the result instead of sending it"""
+
+    def __init__(self):
+        super().__init__()
+        self.sent = None
+
+    def ehlo_or_helo_if_needed(self):
+        pass
+
+    def has_extn(self, opt):
+        return False
+
+    def sendmail(self, from_addr, to_addrs, msg, mail_options=(), rcpt_options=()):
+        self.sent = (from_addr, list(to_addrs), msg)
+        return {}
+
+
+def send_message_bytes(sender, recipient, subject, body, attachments=(), boundary=None):
+    msg = EmailSystem(None).build_message({'smtp_username': sender}, recipient, subject, body, attachments)
+    msg.set_boundary(boundary)
+    smtp = CapturingSMTP()
+    smtp.send_message(msg)
+    return smtp.sent
+
+
+def assert_same_as_send_message(sender, recipient, subject, body, attachments=()):
+    skeleton = MessageSkeleton(sender, attachments=[ATTACHMENT_CACHE.get(path) for path in attachments])
+    prepared = skeleton.render(recipient, subject, body)
+    assert prepared is not None, "expected the fast path to handle this message"
+    expected = send_message_bytes(sender, recipient, subject, body, attachments, skeleton.boundary)
+    assert (prepared.from_addr, list(prepared.to_addrs), prepared.data) == expected
+
+
+LONG_LINE = "word " * 200
+
+CORPUS = [
+    # (sender, recipient, subject, body)
+    ('me@example.com', 'hr@corp.com', 'Application for Engineer', 'Dear Corp,\n\nHello.\n'),
+    ('me@example.com', 'hr@corp.com', '', ''),
+    ('Me <me@example.com>', 'Bob <bob@corp.com>', 'Hi', 'Regards,\nMe'),
+    ('"Doe, J" <j@example.com>', 'a.b+c@x.org', 'Hi', 'x'),
+    ('me@example.com', 'hr@corp.com', 'Hi', 'From the start\nand\nFrom here on\n'),
+    ('me@example.com', 'hr@corp.com', 'Hi', 'windows\r\nlines\rand mac\n'),
+    ('me@example.com', 'hr@corp.com', 'Hi', LONG_LINE),
+    ('me@example.com', 'hr@corp.com', 'Hi', 'Dear Zürich team,\n\nMerci beaucoup ☃\n'),
+    ('me@example.com', 'hr@corp.com', 'Hi', f'é {LONG_LINE}\nFrom x\n'),
+    ('me@example.com', 'hr@corp.com', 'x' * 60, '--boundary-looking line\n=3D\n.\n'),
+]
+
+
+@pytest.mark.parametrize('sender, recipient, subject, body', CORPUS)
+def test_matches_send_message(sender, recipient, subject, body):
+    assert_same_as_send_message(sender, recipient, subject, body)
+
+
+@pytest.fixture
+def attachment_files(tmp_path):
+    text = tmp_path / 'notes.txt'
+    text.write_text('line one\nline two\n')
+    binary = tmp_path / 'resume.pdf'
+    binary.write_bytes(bytes(range(256)) * 300)
+    return [str(text), str(binary)]
+
+
+@pytest.mark.parametrize('body', ['Please find my resume attached.\n', 'Ça va ?\nFrom me\n', ''])
+def test_matches_send_message_with_attachments(attachment_files, body):
+    assert_same_as_send_message('me@example.com', 'hr@corp.com', 'Resume', body, attachment_files)
+
+
+@pytest.mark.parametrize('sender, recipient, subject', [
+    ('me@example.com', 'hr@corp.com', 'Candidature à Zürich'),
+    ('me@example.com', 'hr@corp.com', 'A subject long enough that compat32 has to fold the header line ' * 2),
+    ('me@example.com', 'hr@corp.com', 'Line\nbreak'),
+    ('me@example.com', 'rené@corp.com', 'Hi'),
+    ('me@example.com', 'a@corp.com, b@corp.com', 'Hi'),
+    ('Zoë <me@example.com>', 'hr@corp.com', 'Hi'),
+])
+def test_declines_what_it_cannot_reproduce(sender, recipient, subject):
+    assert MessageSkeleton(sender).render(recipient, subject, 'body') is None
@@ -0,0 +1,79 @@
+"""
+The outbox spool: claiming, filing and recovering messages, and a campaign
+that is spooled or delivered twice still reaching each recipient once.
+"""
+import os
+
+from conftest import delivered_to, make_email_system
+from mime_fastpath import PreparedMessage
+from outbox import Outbox
+from send_journal import SendJournal
+
+EMAILS = ['a@one.com', 'b@two.com', 'c@three.com']
+
+
+def message(recipient):
+    return PreparedMessage('me@example.com', [recipient], b'Subject: Hi\r\n\r\nHello.\r\n')
+
+
+def test_claim_moves_messages_through_the_states(tmp_path):
+    outbox = Outbox(str(tmp_path))
+    for recipient in EMAILS:
+        outbox.spool(recipient, message(recipient), 'campaign')
+    claimed = list(outbox.claim())
+    assert [entry.recipient for entry in claimed] == EMAILS
+    assert claimed[0].message == message(EMAILS[0])
+    outbox.mark_done(claimed[0])
+    outbox.mark_failed(claimed[1], 'mailbox unavailable')
+    outbox.release(claimed[2])
+    assert outbox.counts() == {'new': 1, 'cur': 0, 'done': 1, 'failed': 1}
+    assert outbox.failures() == {'b@two.com': 'mailbox unavailable'}
+    assert outbox.retry_failed() == 1
+    assert outbox.counts() == {'new': 2, 'cur': 0, 'done': 1, 'failed': 0}
+
+
+def test_recover_only_returns_old_claims(tmp_path):
+    outbox = Outbox(str(tmp_path))
+    outbox.spool(EMAILS[0], message(EMAILS[0]))
+    next(outbox.claim())
+    assert outbox.recover(older_than=3600) == 0
+    assert outbox.recover(older_than=0) == 1
+    assert outbox.counts()['new'] == 1
+
+
+def test_recipients_of_a_campaign(tmp_path):
+    outbox = Outbox(str(tmp_path))
+    outbox.spool('A@One.com', message('A@One.com'), 'campaign')
+    outbox.spool('b@two.com', message('b@two.com'), 'other')
+    entry = next(outbox.claim())
+    outbox.mark_failed(entry, 'no')
+    assert outbox.recipients('campaign') == set()
+    outbox.retry_failed()
+    assert outbox.recipients('campaign') == {'a@one.com'}
+    assert outbox.recipients('other') == {'b@two.com'}
+
+
+def test_spool_twice_delivers_once(tmp_path, smtp_sink, smtp_config):
+    outbox = Outbox(str(tmp_path / 'outbox'))
+    email_system = make_email_system(EMAILS)
+    assert email_system.spool_emails(smtp_config, outbox) == 3
+    assert email_system.spool_emails(smtp_config, outbox) == 0
+    counts = email_system.deliver_outbox(smtp_config, outbox, delay_between_emails=0)
+    assert counts['done'] == 3
+    # Spooling again after delivery finds the recipients in done/
+    assert email_system.spool_emails(smtp_config, outbox) == 0
+    assert sorted(delivered_to(smtp_sink)) == EMAILS
+
+
+def test_deliver_skips_recipients_the_journal_lists_as_sent(tmp_path, smtp_sink, smtp_config):
+    outbox = Outbox(str(tmp_path / 'outbox'))
+    journal = SendJournal(str(tmp_path / 'journal.sqlite3'))
+    email_system = make_email_system(EMAILS)
+    email_system.spool_emails(smtp_config, outbox, campaign_id='campaign')
+    # Sent by another route, e.g. send_emails or a copy of the outbox
+    journal.record('campaign', 'B@two.com')
+    counts = email_system.deliver_outbox(smtp_config, outbox, delay_between_emails=0, journal=journal)
+    assert counts == {'new': 0, 'cur': 0, 'done': 3, 'failed': 0}
+    assert sorted(delivered_to(smtp_sink)) == ['a@one.com', 'c@three.com']
+    assert journal.completed('campaign') == {'a@one.com', 'b@two.com', 'c@three.com'}
+    assert not os.listdir(tmp_path / 'outbox' / 'new')
@@ -0,0 +1,137 @@
+"""
+Rate-limit waits must end as soon as the run is cancelled, and hourly and
+daily caps are sender account quotas rather than waits.
+"""
+import threading
+import time
+
+import pytest
+
+from rate_limiter import RateLimiter
+from sender_accounts import AccountRouter, SenderAccount
+from smtp_pool import SendCancelled, SendDispatcher
+
+
+def cancel_after(seconds):
+    cancel_event = threading.Event()
+    timer = threading.Timer(seconds, cancel_event.set)
+    timer.start()
+    return cancel_event, timer
+
+
+def test_spacing_is_not_throttling():
+    limiter = RateLimiter(min_interval=0.02)
+    start = time.monotonic()
+    for _ in range(5):
+        assert limiter.acquire()
+    assert time.monotonic() - start >= 0.07
+    assert limiter.throttled_seconds < 0.01
+
+
+def test_per_minute_cap_allows_a_burst_then_waits():
+    limiter = RateLimiter(per_minute=3)
+    assert [limiter.reserve() for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert limiter.reserve() > 10
+    assert limiter.throttled_seconds > 10
+
+
+def test_repeated_throttling_backs_off_longer():
+    limiter = RateLimiter(min_interval=1, max_backoff=60)
+    limiter.record_throttle()
+    first = limiter.reserve()
+    limiter.record_throttle()
+    assert limiter.throttle_events == 2
+    assert 4 < first < limiter.reserve() <= 60
+
+
+def test_acquire_without_wait_is_allowed():
+    assert RateLimiter().acquire(threading.Event())
+
+
+def test_cancel_during_cap_wait_returns_promptly():
+    limiter = RateLimiter(per_minute=1)
+    assert limiter.acquire()
+    cancel_event, timer = cancel_after(0.1)
+    start = time.monotonic()
+    try:
+        assert not limiter.acquire(cancel_event)
+    finally:
+        timer.cancel()
+    assert time.monotonic() - start < 5
+
+
+def test_cancel_during_backoff_returns_promptly():
+    limiter = RateLimiter(max_backoff=300)
+    limiter.record_throttle()
+    cancel_event, timer = cancel_after(0.1)
+    start = time.monotonic()
+    try:
+        assert not limiter.acquire(cancel_event)
+    finally:
+        timer.cancel()
+    assert time.monotonic() - start < 5
+
+
+def test_acquire_after_cancel_does_not_send():
+    cancel_event = threading.Event()
+    cancel_event.set()
+    assert not RateLimiter().acquire(cancel_event)
+
+
+class RecordingServer:
+    def __init__(self):
+        self.sent = []
+
+    def send_message(self, msg):
+        self.sent.append(msg)
+
+
+class SingleConnectionPool:
+    """The part of SMTPConnectionPool the dispatcher uses, over one recording server"""
+    size = 1
+
+    def __init__(self):
+        self.server = RecordingServer()
+
+    def acquire(self):
+        return self.server
+
+    def release(self, server):
+        pass
+
+    def reconnect(self, server):
+        pass
+
+
+def test_dispatcher_cancels_messages_waiting_on_the_limiter():
+    pool = SingleConnectionPool()
+    cancel_event = threading.Event()
+    dispatcher = SendDispatcher(pool, RateLimiter(per_minute=1), cancel_event=cancel_event)
+    first = dispatcher.submit('a@example.com', 'first')
+    second = dispatcher.submit('b@example.com', 'second')
+    assert first.result(timeout=5) == 0
+    cancel_event.set()
+    with pytest.raises(SendCancelled):
+        second.result(timeout=5)
+    dispatcher.shutdown()
+    assert pool.server.sent == ['first']
+
+
+def test_rate_limit_caps_become_account_quotas():
+    account = SenderAccount.from_settings({'smtp_username': 'me@example.com'},
+                                          rate_limits={'per_hour': 10, 'per_day': 2})
+    assert (account.hourly_quota, account.daily_quota) == (10, 2)
+    router = AccountRouter([account])
+    for _ in range(2):
+        chosen = router.choose()
+        assert chosen is account
+        router.record_sent(chosen)
+    assert router.choose() is None
+
+
+def test_account_quota_overrides_rate_limit_cap():
+    account = SenderAccount.from_settings({'smtp_username': 'me@example.com'},
+                                          {'smtp_username': 'other@example.com', 'daily_quota': 500},
+                                          {'per_day': 2})
+    assert account.name == 'other@example.com'
+    assert account.daily_quota == 500
@@ -0,0 +1,58 @@
+"""
+The send journal records who a campaign reached, so a later run resumes
+without mailing anyone twice.
+"""
+from conftest import delivered_to, make_email_system
+from send_journal import SendJournal, make_campaign_id, normalize_address
+
+EMAILS = ['a@one.com', 'b@two.com', 'c@three.com']
+
+
+def test_normalize_address():
+    assert normalize_address('  Bob@Example.COM ') == 'bob@example.com'
+
+
+def test_campaign_id_depends_on_sender_and_template():
+    campaign_id = make_campaign_id('me@example.com', 'Hello')
+    assert campaign_id == make_campaign_id('me@example.com', 'Hello')
+    assert campaign_id != make_campaign_id('other@example.com', 'Hello')
+    assert campaign_id != make_campaign_id('me@example.com', 'Hello!')
+
+
+def test_sent_is_never_downgraded(tmp_path):
+    journal = SendJournal(str(tmp_path / 'journal.sqlite3'))
+    journal.record('campaign', 'A@One.com')
+    journal.record('campaign', 'a@one.com', 'failed', 'mailbox full')
+    journal.record('campaign', 'b@two.com', 'failed', 'mailbox full')
+    journal.record('other', 'c@three.com')
+    assert journal.completed('campaign') == {'a@one.com'}
+    assert journal.summary('campaign') == {'sent': 1, 'failed': 1}
+
+
+def test_failed_recipient_can_be_sent_later(tmp_path):
+    journal = SendJournal(str(tmp_path / 'journal.sqlite3'))
+    journal.record('campaign', 'b@two.com', 'failed', 'timeout')
+    journal.record('campaign', 'b@two.com')
+    assert journal.summary('campaign') == {'sent': 1}
+
+
+def test_journal_survives_reopening(tmp_path):
+    path = str(tmp_path / 'journal.sqlite3')
+    journal = SendJournal(path)
+    journal.record('campaign', 'a@one.com')
+    journal.close()
+    assert SendJournal(path).completed('campaign') == {'a@one.com'}
+
+
+def test_resumed_campaign_skips_recipients_already_sent(tmp_path, smtp_sink, smtp_config):
+    journal = SendJournal(str(tmp_path / 'journal.sqlite3'))
+    email_system = make_email_system(EMAILS)
+    journal.record('campaign', 'b@two.com')
+    outcome = email_system.send_emails(smtp_config, test_mode=False, delay_between_emails=0,
+                                       delay_between_batches=0, journal=journal, campaign_id='campaign')
+    assert outcome == 'done'
+    assert sorted(delivered_to(smtp_sink)) == ['a@one.com', 'c@three.com']
+    assert journal.completed('campaign') == set(EMAILS)
+    # Everyone has been reached, so a third run sends nothing
+    assert email_system.send_emails(smtp_config, test_mode=False, journal=journal, campaign_id='campaign') == 'done'
+    assert len(smtp_sink.messages) == 2
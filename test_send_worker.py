@@ -0,0 +1,63 @@
+"""
+A SendJob's final state follows the outcome send_emails returns, not the
+events the run emitted along the way.
+"""
+from conftest import delivered_to, make_email_system
+from email_system import EmailSystem
+from send_worker import CANCELLED, DONE, FAILED, QUOTA_REACHED, SendJob
+
+EMAILS = ['a@one.com', 'b@two.com', 'c@three.com']
+
+SEND_KWARGS = {'test_mode': False, 'delay_between_emails': 0, 'delay_between_batches': 0}
+
+
+def run_job(email_system, smtp_config, **send_kwargs):
+    job = SendJob(email_system, dict(SEND_KWARGS, smtp_config=smtp_config, **send_kwargs))
+    job.run()
+    return job
+
+
+def test_job_done(smtp_sink, smtp_config):
+    job = run_job(make_email_system(EMAILS), smtp_config)
+    assert job.state == DONE
+    assert job.progress == 1.0
+    assert sorted(delivered_to(smtp_sink)) == EMAILS
+
+
+def test_job_fails_when_the_run_cannot_start(smtp_sink, smtp_config):
+    # The sink doesn't offer STARTTLS, so connecting is refused outright
+    job = run_job(make_email_system(EMAILS), dict(smtp_config, use_tls=True))
+    assert job.state == FAILED
+    assert job.error.startswith("Error connecting to SMTP server")
+    assert delivered_to(smtp_sink) == []
+
+
+def test_job_stops_at_quota(smtp_sink, smtp_config):
+    job = run_job(make_email_system(EMAILS), smtp_config, rate_limits={'per_day': 2})
+    assert job.state == QUOTA_REACHED
+    assert len(delivered_to(smtp_sink)) == 2
+
+
+class NoisyEmailSystem(EmailSystem):
+    """Reports a non-fatal error in the middle of an otherwise normal run"""
+
+    def send_emails(self, smtp_config, **kwargs):
+        self.events.emit('error', "Error in progress callback: display went away")
+        return super().send_emails(smtp_config, **kwargs)
+
+
+def test_non_fatal_error_event_does_not_fail_the_job(smtp_sink, smtp_config):
+    email_system = make_email_system(EMAILS, NoisyEmailSystem)
+    job = run_job(email_system, smtp_config)
+    assert email_system.events.counts['error'] == 1
+    assert job.state == DONE
+    assert job.error is None
+
+
+def test_cancelled_job_never_starts(smtp_sink, smtp_config):
+    job = SendJob(make_email_system(EMAILS), dict(SEND_KWARGS, smtp_config=smtp_config))
+    job.cancel()
+    job.run()
+    assert job.state == CANCELLED
+    assert job.started_at is None
+    assert delivered_to(smtp_sink) == []
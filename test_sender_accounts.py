@@ -0,0 +1,99 @@
+"""
+Sender accounts: the router's balancing strategies and quotas, and the
+QuotaStore that makes quotas hold across runs.
+"""
+import pytest
+
+import sender_accounts
+from conftest import delivered_to, make_email_system
+from sender_accounts import AccountRouter, QuotaStore, SenderAccount
+
+
+def account(name, **quotas):
+    return SenderAccount({'smtp_username': name}, **quotas)
+
+
+def choose_sent(router, count):
+    """Choose and record ``count`` sends; returns the chosen account names"""
+    names = []
+    for _ in range(count):
+        chosen = router.choose()
+        if chosen is None:
+            names.append(None)
+            continue
+        router.record_sent(chosen)
+        names.append(chosen.name)
+    return names
+
+
+def test_unknown_strategy():
+    with pytest.raises(ValueError):
+        AccountRouter([account('a')], strategy='random')
+
+
+def test_fill_first_moves_on_at_quota():
+    router = AccountRouter([account('a', daily_quota=2), account('b', daily_quota=1)], strategy='fill_first')
+    assert choose_sent(router, 4) == ['a', 'a', 'b', None]
+
+
+def test_round_robin_follows_weights():
+    router = AccountRouter([account('a', weight=2), account('b')], strategy='round_robin')
+    assert choose_sent(router, 6).count('a') == 4
+
+
+def test_least_used_balances_quota_share():
+    router = AccountRouter([account('a', daily_quota=100), account('b', daily_quota=50)])
+    names = choose_sent(router, 30)
+    assert (names.count('a'), names.count('b')) == (20, 10)
+
+
+def test_hourly_quota():
+    router = AccountRouter([account('a', hourly_quota=1, daily_quota=10)])
+    assert choose_sent(router, 2) == ['a', None]
+
+
+def test_reservations_count_until_released():
+    router = AccountRouter([account('a', daily_quota=1)])
+    chosen = router.choose()
+    assert router.choose() is None
+    router.release(chosen)
+    assert router.choose() is chosen
+
+
+def test_quota_store_counts_by_hour(tmp_path, monkeypatch):
+    store = QuotaStore(str(tmp_path / 'quota.sqlite3'))
+    hour = 1_000_000
+    monkeypatch.setattr(sender_accounts, '_hour', lambda now=None: hour)
+    store.record('a', 3)
+    hour += 1
+    store.record('a')
+    store.record('b')
+    assert (store.used('a', 1), store.used('a', 24), store.used('b')) == (1, 4, 1)
+    hour += 24
+    assert store.used('a', 24) == 0
+    store.prune(keep_hours=1)
+    assert store.used('a', 24 * 7) == 0
+
+
+def test_usage_persists_across_routers(tmp_path):
+    path = str(tmp_path / 'quota.sqlite3')
+    router = AccountRouter([account('a', daily_quota=3)], QuotaStore(path))
+    assert choose_sent(router, 2) == ['a', 'a']
+    router = AccountRouter([account('a', daily_quota=3)], QuotaStore(path))
+    assert router.usage() == {'a': (2, 3)}
+    assert choose_sent(router, 2) == ['a', None]
+
+
+def test_campaign_spread_over_accounts_stops_at_quota(tmp_path, smtp_sink, smtp_config):
+    emails = [f"hr{i}@corp{i}.com" for i in range(5)]
+    email_system = make_email_system(emails)
+    accounts = [{'smtp_username': 'first@example.com', 'daily_quota': 1},
+                {'smtp_username': 'second@example.com', 'daily_quota': 2}]
+    store = QuotaStore(str(tmp_path / 'quota.sqlite3'))
+    outcome = email_system.send_emails(smtp_config, test_mode=False, delay_between_emails=0,
+                                       delay_between_batches=0, accounts=accounts, quota_store=store)
+    assert outcome == 'quota'
+    assert len(delivered_to(smtp_sink)) == 3
+    assert sorted(sender for sender, _, _ in smtp_sink.messages) == ['first@example.com', 'second@example.com',
+                                                                      'second@example.com']
+    assert (store.used('first@example.com'), store.used('second@example.com')) == (1, 2)
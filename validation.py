@@ -0,0 +1,154 @@
+"""
+Pre-send recipient validation.
+
+Addresses are normalized and checked column-wise: a vectorized pattern
+accepts the common case, and only values it cannot decide are handed to
+``email-validator``. Duplicates and suppressed addresses are dropped, and
+every rejected row is kept with its reason. Optional MX/domain checks go
+through a pluggable resolver that caches answers, so they can run offline
+against a stub.
+"""
+import pandas as pd
+
+# Plain ASCII addresses that are certainly well-formed
+SIMPLE_EMAIL_PATTERN = r"[a-z0-9!#$%&'*+/=?^_`{|}~-]+(?:\.[a-z0-9!#$%&'*+/=?^_`{|}~-]+)*@(?:[a-z0-9](?:[a-z0-9-]*[a-z0-9])?\.)+[a-z]{2,}"
+
+
+def normalize_emails(series):
+    """Strip whitespace and lower-case an address column, keeping missing values"""
+    return series.astype(object).where(series.notna()).str.strip().str.lower()
+
+
+def dns_mail_lookup(domain):
+    """Return False only if DNS says the domain cannot receive mail"""
+    import dns.exception
+    import dns.resolver
+
+    for record_type in ('MX', 'A'):
+        try:
+            dns.resolver.resolve(domain, record_type, lifetime=5)
+            return True
+        except (dns.resolver.NXDOMAIN, dns.resolver.NoNameservers):
+            return False
+        except dns.resolver.NoAnswer:
+            continue
+        except dns.exception.DNSException:
+            # Don't reject recipients because of a flaky resolver
+            return True
+    return False
+
+
+class DomainResolver:
+    """
+    Answers whether a domain accepts mail, caching every answer.
+
+    Args:
+        lookup (callable): domain -> bool; defaults to a DNS MX/A lookup.
+            Pass e.g. ``lambda domain: domain in known_domains`` to run offline.
+    """
+
+    def __init__(self, lookup=None):
+        self.lookup = lookup or dns_mail_lookup
+        self.cache = {}
+
+    def accepts_mail(self, domain):
+        answer = self.cache.get(domain)
+        if answer is None:
+            answer = self.cache[domain] = bool(self.lookup(domain))
+        return answer
+
+
+class RecipientValidator:
+    """
+    Validates, normalizes and de-duplicates recipient addresses in bulk.
+
+    One validator is used for a whole campaign; duplicates are detected across
+    every frame passed to ``check``, so it also works chunk by chunk.
+
+    Args:
+        resolver (DomainResolver): Optional resolver used to drop domains that
+            cannot receive mail
+        suppression (SuppressionList): Optional list of addresses never to email
+    """
+
+    def __init__(self, resolver=None, suppression=None):
+        self.resolver = resolver
+        self.suppression = suppression
+        self._seen = set()
+        self._rejected = []
+
+    def _check_ambiguous(self, addresses):
+        """Run email-validator on the few addresses the fast pattern could not decide"""
+        from email_validator import EmailNotValidError, validate_email
+
+        normalized = {}
+        reasons = {}
+        for address in addresses:
+            try:
+                result = validate_email(address, check_deliverability=False)
+                normalized[address] = result.normalized.lower()
+            except EmailNotValidError as e:
+                reasons[address] = f"invalid address: {e}"
+        return normalized, reasons
+
+    def check(self, frame, email_col):
+        """
+        Validate the address column of a frame.
+
+        Returns:
+            tuple: (keep, addresses) arrays aligned with the rows of ``frame``;
+            ``keep`` marks rows to send to and ``addresses`` holds the
+            normalized addresses
+        """
+        column = frame[email_col].reset_index(drop=True)
+        addresses = normalize_emails(column)
+        reasons = pd.Series(None, index=addresses.index, dtype=object)
+        reasons[addresses.isna() | (addresses == '')] = 'missing address'
+
+        simple = addresses.str.fullmatch(SIMPLE_EMAIL_PATTERN).fillna(False).astype(bool)
+        ambiguous = ~simple & reasons.isna()
+        if ambiguous.any():
+            normalized, failures = self._check_ambiguous(addresses[ambiguous].unique())
+            addresses[ambiguous] = addresses[ambiguous].map(lambda a: normalized.get(a, a))
+            reasons[ambiguous] = addresses[ambiguous].map(failures)
+
+        if self.suppression is not None and len(self.suppression):
+            pending = reasons.isna()
+            suppressed = self.suppression.mask(addresses[pending])
+            reasons[addresses[pending].index[suppressed]] = 'suppressed'
+
+        if self.resolver is not None:
+            pending = reasons.isna()
+            domains = addresses[pending].str.rpartition('@')[2]
+            accepts = {domain: self.resolver.accepts_mail(domain) for domain in domains.unique()}
+            no_mail = domains.map(accepts) == False  # noqa: E712
+            reasons[no_mail[no_mail].index] = 'domain does not accept mail'
+
+        pending = reasons.isna()
+        duplicate = pending & addresses.duplicated(keep='first')
+        if self._seen:
+            duplicate |= pending & addresses.isin(self._seen)
+        reasons[duplicate] = 'duplicate address'
+
+        keep = reasons.isna().to_numpy()
+        self._seen.update(addresses[keep])
+        if not keep.all():
+            self._rejected.append(pd.DataFrame({
+                'row': frame.index[~keep],
+                'email': column[~keep].to_numpy(),
+                'reason': reasons[~keep].to_numpy(),
+            }))
+        return keep, addresses.to_numpy()
+
+    @property
+    def rejected(self):
+        """DataFrame of every rejected row with its original address and the reason"""
+        if not self._rejected:
+            return pd.DataFrame(columns=['row', 'email', 'reason'])
+        return pd.concat(self._rejected, ignore_index=True)
+
+    def summary(self):
+        """Return a {reason: count} overview of the rejected rows"""
+        if not self._rejected:
+            return {}
+        return self.rejected['reason'].str.split(':').str[0].value_counts().to_dict()